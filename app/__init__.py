@@ -1,11 +1,14 @@
 import os
 import logging
 import asyncio
-from flask import Flask, session, request, redirect, url_for
+from flask import Flask, Response, session, request, redirect, url_for, g
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
-from dotenv import load_dotenv
+from app.config import config
 from app.db.models import Database
+from app.db.tracing import tracing_enabled, query_budget, start_trace, stop_trace
+from app import metrics
+from app.profiling import profiling_enabled, RequestProfiler
 
 # Configure logging
 logging.basicConfig(
@@ -14,12 +17,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def run_fetch_all_data():
+    """Scheduled job fetching the latest MELCloud and Home Assistant data."""
+    # Imported on first run: the fetchers pull in requests and the MELCloud
+    # client, which web workers don't need to boot (and avoids circular imports)
+    from app.data_fetchers import fetch_all_data
+    asyncio.run(fetch_all_data())
+
+def run_update_prices():
+    """Scheduled job storing the current prices from .env."""
+    from app.data_fetchers import update_prices
+    update_prices()
+
 def create_app(test_config=None):
     # Create and configure the app
     app = Flask(__name__, instance_relative_config=True)
     
-    # Load environment variables
-    load_dotenv()
+    # Load environment variables from .env (reloaded only when the file changes)
+    config.refresh()
     
     # Set a basic secret key for development
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-for-testing-only')
@@ -32,20 +47,22 @@ def create_app(test_config=None):
     db_dir = os.path.join(os.path.dirname(__file__), 'db')
     os.makedirs(db_dir, exist_ok=True)
     
-    # Initialize database
+    # Initialize database (Database() creates or migrates the tables if needed)
     db = Database()
-    db.create_tables()
+    
+    # Let collectors and scripts in other processes hand their writes to this process
+    writer_socket = os.getenv('DB_WRITER_SOCKET')
+    if writer_socket:
+        from app.db.writer import start_writer_server
+        start_writer_server(writer_socket, db)
     
     # Set up scheduler for data collection
     try:
         scheduler = BackgroundScheduler()
         
-        # Import here to avoid circular imports
-        from app.data_fetchers import fetch_all_data, update_prices
-        
         # Schedule data fetching (every 30 minutes)
         scheduler.add_job(
-            lambda: asyncio.run(fetch_all_data()),
+            run_fetch_all_data,
             'interval', 
             minutes=30,
             id='fetch_data'
@@ -53,7 +70,7 @@ def create_app(test_config=None):
         
         # Schedule price updates (once a day)
         scheduler.add_job(
-            update_prices,
+            run_update_prices,
             'interval',
             hours=24,
             id='update_prices'
@@ -80,14 +97,75 @@ def create_app(test_config=None):
     def index():
         return redirect(url_for('dashboard.index'))
     
+    # Prometheus metrics of the requests and of the scheduled collectors
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+    
     # Add global context processors
     @app.context_processor
     def inject_current_date():
         return {'current_date': datetime.now()}
     
+    # Let requests ask to be run under cProfile (X-Profile or ?_profile=top|save)
+    if profiling_enabled():
+        app.wsgi_app = RequestProfiler(app.wsgi_app)
+        logger.info("Per-request profiling enabled")
+    
     # Ensure CSRF token is available for all templates
     @app.before_request
     def make_session_permanent():
         session.permanent = True
     
+    # Time the phases of every request
+    @app.before_request
+    def start_request_metrics():
+        metrics.start_request()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        trace = g.get('sql_trace')
+        metrics.finish_request(request.endpoint, response.status_code, trace.count if trace else None)
+        return response
+    
+    # Trace the SQL queries of every request
+    if tracing_enabled():
+        budget = query_budget()
+        debug_panel = app.debug or os.getenv('SQL_DEBUG_PANEL', 'false').lower() in ('1', 'true', 'yes', 'on')
+        
+        @app.before_request
+        def start_sql_trace():
+            g.sql_trace, g.sql_trace_token = start_trace(request.endpoint or request.path)
+        
+        @app.after_request
+        def report_sql_trace(response):
+            trace = g.get('sql_trace')
+            if trace is None:
+                return response
+            
+            repeated = trace.repeated(threshold=1)
+            response.headers['X-SQL-Queries'] = str(trace.count)
+            response.headers['X-SQL-Time-Ms'] = f"{trace.total_ms:.1f}"
+            response.headers['X-SQL-Max-Repeat'] = str(repeated[0][0] if repeated else 0)
+            
+            if trace.count > budget:
+                logger.warning(f"{request.method} {request.path} ran {trace.count} queries "
+                               f"(budget {budget})")
+                trace.log_summary(logging.WARNING)
+            
+            if debug_panel and request.args.get('sql_debug') and response.mimetype == 'text/html' \
+                    and not response.direct_passthrough:
+                import json
+                from markupsafe import escape
+                panel = f'<pre class="sql-debug">{escape(json.dumps(trace.summary(), indent=2))}</pre>'
+                response.set_data(response.get_data(as_text=True).replace('</body>', panel + '</body>', 1))
+            
+            return response
+        
+        @app.teardown_request
+        def stop_sql_trace(exc):
+            token = g.pop('sql_trace_token', None)
+            if token is not None:
+                stop_trace(token)
+    
     return app
@@ -0,0 +1,82 @@
+import os
+import time
+import logging
+import threading
+from dotenv import dotenv_values
+
+
+logger = logging.getLogger(__name__)
+
+# Shortest time between two checks of the .env modification time
+CHECK_INTERVAL = 1.0
+
+class Config:
+    """Settings from the environment and the .env file.
+
+    The .env file is parsed once and parsed again only when its modification
+    time changes (e.g. after the settings pages save new credentials or
+    prices). As with load_dotenv(), variables set in the real environment win
+    over the file; variables that came from the file are updated when the
+    file changes.
+    """
+
+    def __init__(self, env_path=None, check_interval=CHECK_INTERVAL):
+        self.env_path = env_path or os.path.join(os.getcwd(), '.env')
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Load the .env file if it changed since the last load; return whether it did."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.env_path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime == self._mtime and not force:
+                return False
+
+            values = dotenv_values(self.env_path) if mtime is not None else {}
+            for key, value in values.items():
+                if value is None:
+                    continue
+                if key in os.environ and key not in self._loaded:
+                    # Set in the real environment
+                    continue
+                os.environ[key] = value
+                self._loaded[key] = value
+
+            # Variables removed from the file are removed from the environment too
+            for key in set(self._loaded) - set(values):
+                if os.environ.get(key) == self._loaded.pop(key):
+                    del os.environ[key]
+
+            if self._mtime is not None:
+                logger.info(f"Reloaded settings from {self.env_path}")
+            self._mtime = mtime
+            return True
+
+    def get(self, key, default=None):
+        """Return a setting as a string."""
+        self.refresh()
+        return os.getenv(key, default)
+
+    def get_float(self, key, default):
+        """Return a setting as a float."""
+        return float(self.get(key, default))
+
+    def get_bool(self, key, default=False):
+        """Return a setting as a boolean ('1', 'true', 'yes' and 'on' are true)."""
+        value = self.get(key)
+        if value is None:
+            return default
+        return value.lower() in ('1', 'true', 'yes', 'on')
+
+config = Config()
@@ -4,10 +4,29 @@ import logging
 import json
 import requests
 from datetime import datetime, timedelta
+from app.config import config
 from app.db.models import Database
+from app.db.archive import RawArchive
+from app.db.readings import ReadingsStore
+from app.db.tracing import traced
+from app.metrics import api_call, record_failure, record_retry, record_rows_written, collector_run
 
 logger = logging.getLogger(__name__)
 
+_raw_archive = None
+
+def archive_raw_response(source, kind, payload, device_id=None, start_date=None, end_date=None):
+    """Store a raw API response in the archive, never failing the caller."""
+    global _raw_archive
+    try:
+        if _raw_archive is None:
+            _raw_archive = RawArchive()
+        return _raw_archive.store(source, kind, payload, device_id=device_id,
+                                  start_date=start_date, end_date=end_date)
+    except Exception as e:
+        logger.warning(f"Failed to archive {source} {kind} response: {e}")
+        return None
+
 # Mock implementation for testing when pymelcloud is not available
 class MockMELCloudDevice:
     def __init__(self):
@@ -185,7 +204,8 @@ class MELCloudFetcher:
                 try:
                     import pymelcloud
                     logger.info("Using real pymelcloud library")
-                    session = await pymelcloud.login(self.username, self.password)
+                    with api_call('melcloud', 'login'):
+                        session = await pymelcloud.login(self.username, self.password)
                     if not session:
                         logger.error("pymelcloud login returned None")
                         raise ValueError("Failed to authenticate with MELCloud")
@@ -204,9 +224,11 @@ class MELCloudFetcher:
                     devices = session['devices']
                 
                 if not devices:
+                    record_failure('melcloud', 'list_devices')
                     logger.error(f"No devices found in MELCloud session (attempt {retries+1}/{max_retries})")
                     retries += 1
                     if retries < max_retries:
+                        record_retry('melcloud')
                         logger.info(f"Retrying in {retry_delay} seconds...")
                         await asyncio.sleep(retry_delay)
                         continue
@@ -217,7 +239,8 @@ class MELCloudFetcher:
                 
                 # Get energy report with error handling
                 try:
-                    energy_report = device.energy_report()
+                    with api_call('melcloud', 'energy_report'):
+                        energy_report = device.energy_report()
                     logger.info("Successfully retrieved energy report")
                 except Exception as e:
                     logger.error(f"Error getting energy report: {str(e)}")
@@ -227,6 +250,9 @@ class MELCloudFetcher:
                 if not energy_report or not isinstance(energy_report, dict):
                     logger.error(f"Invalid energy report format: {type(energy_report)}")
                     raise ValueError("Energy report has invalid format")
+                
+                archive_raw_response("melcloud", "pymelcloud_energy_report", energy_report,
+                                     device_id=getattr(device, 'serial_number', None))
                     
                 # Check if required keys exist
                 required_keys = ['Energy_Consumed', 'Power_Consumed']
@@ -285,6 +311,7 @@ class MELCloudFetcher:
                         # Store in database
                         success = db.add_energy_data(date_obj, power_value, energy_value, cost)
                         if success:
+                            record_rows_written('melcloud', inserted=1)
                             logger.info(f"Added energy data for {date_str}: Energy={energy_value}kWh, Power={power_value}W, Cost=${cost:.2f}")
                         else:
                             logger.info(f"Energy data for {date_str} already exists in database")
@@ -330,6 +357,7 @@ class MELCloudFetcher:
                             # Try to add to database (will be skipped if already exists)
                             success = db.add_energy_data(date_obj, power_value, energy_value, cost)
                             if success:
+                                record_rows_written('melcloud', inserted=1)
                                 logger.info(f"Added weekly energy data for {date_str}: Energy={energy_value}kWh, Power={power_value}W, Cost=${cost:.2f}")
                             
                         except Exception as e:
@@ -342,6 +370,7 @@ class MELCloudFetcher:
                 logger.error(f"Error fetching energy data (attempt {retries+1}/{max_retries}): {str(e)}")
                 retries += 1
                 if retries < max_retries:
+                    record_retry('melcloud')
                     logger.info(f"Retrying in {retry_delay} seconds...")
                     await asyncio.sleep(retry_delay)
                 else:
@@ -472,6 +501,7 @@ class HomeAssistantFetcher:
         self.hass_url = hass_url
         self.hass_token = hass_token
         self.db = db if db else Database()
+        self.readings = ReadingsStore(self.db)
         
     def fetch_data(self):
         """Fetch temperature data from Home Assistant and store in database."""
@@ -487,8 +517,9 @@ class HomeAssistantFetcher:
             
             # Make request to Home Assistant API
             try:
-                response = requests.get(api_url, headers=headers, timeout=10)  # Add timeout
-                response.raise_for_status()
+                with api_call('homeassistant', 'states'):
+                    response = requests.get(api_url, headers=headers, timeout=10)  # Add timeout
+                    response.raise_for_status()
             except (requests.exceptions.RequestException, requests.exceptions.ConnectionError) as e:
                 logger.warning(f"Could not connect to Home Assistant: {str(e)}")
                 # Generate mock data if Home Assistant is not available
@@ -502,13 +533,26 @@ class HomeAssistantFetcher:
             indoor_temp_entity = next((entity for entity in states if entity['entity_id'] == 'sensor.indoor_temperature'), None)
             outdoor_temp_entity = next((entity for entity in states if entity['entity_id'] == 'sensor.outdoor_temperature'), None)
             
+            # Archive only the sensors we read; the full state dump changes on every call
+            archive_raw_response(
+                "homeassistant", "states",
+                [entity for entity in (indoor_temp_entity, outdoor_temp_entity) if entity],
+                start_date=datetime.now().date(), end_date=datetime.now().date()
+            )
+            
             if indoor_temp_entity and outdoor_temp_entity:
                 indoor_temp = float(indoor_temp_entity['state'])
                 outdoor_temp = float(outdoor_temp_entity['state'])
                 timestamp = datetime.now()
                 
-                # Store in database
-                self.db.add_temperature_data(timestamp, indoor_temp, outdoor_temp)
+                # Store the samples; the daily outdoor_temp is derived from them
+                indoor_series = self.readings.get_series_id('homeassistant:sensor.indoor_temperature', unit='°C')
+                outdoor_series = self.readings.get_series_id('homeassistant:sensor.outdoor_temperature', unit='°C',
+                                                             agg='mean', rollup_column='outdoor_temp')
+                self.readings.append(indoor_series, [(timestamp, indoor_temp)])
+                self.readings.append(outdoor_series, [(timestamp, outdoor_temp)])
+                self.readings.rollup_daily(timestamp.date(), timestamp.date())
+                record_rows_written('homeassistant', inserted=2)
                 logger.info("Temperature data fetched and stored successfully")
                 return True  # Return True to indicate success
             else:
@@ -549,14 +593,11 @@ def update_prices(electricity_price=None, diesel_price=None, diesel_efficiency=N
     
     # If values are provided, use them directly instead of env vars
     if electricity_price is None or diesel_price is None or diesel_efficiency is None:
-        # Force reload of environment variables
-        from dotenv import load_dotenv
-        load_dotenv(override=True)
-        
-        # Get values from environment
-        electricity_price = float(os.getenv('ELECTRICITY_PRICE', 0.28))
-        diesel_price = float(os.getenv('DIESEL_PRICE', 1.50))
-        diesel_efficiency = float(os.getenv('DIESEL_EFFICIENCY', 0.85))
+        # Get values from the environment, picking up any change to .env
+        config.refresh(force=True)
+        electricity_price = config.get_float('ELECTRICITY_PRICE', 0.28)
+        diesel_price = config.get_float('DIESEL_PRICE', 1.50)
+        diesel_efficiency = config.get_float('DIESEL_EFFICIENCY', 0.85)
     
     # Log the values before updating the database
     logger.info(f"update_prices function received - Electricity: {electricity_price} (type: {type(electricity_price)}), "
@@ -587,12 +628,13 @@ def update_prices(electricity_price=None, diesel_price=None, diesel_efficiency=N
 async def fetch_all_data():
     """Fetch all data from both sources."""
     db = Database()
-    mel_fetcher = MELCloudFetcher(os.getenv('MELCLOUD_USERNAME'), os.getenv('MELCLOUD_PASSWORD'), db)
-    hass_fetcher = HomeAssistantFetcher(os.getenv('HASS_URL'), os.getenv('HASS_TOKEN'), db)
-    
-    await mel_fetcher.fetch_data()
-    hass_fetcher.fetch_data()
-    update_prices()
+    with traced("scheduled fetch"), collector_run("scheduled_fetch", db):
+        mel_fetcher = MELCloudFetcher(os.getenv('MELCLOUD_USERNAME'), os.getenv('MELCLOUD_PASSWORD'), db)
+        hass_fetcher = HomeAssistantFetcher(os.getenv('HASS_URL'), os.getenv('HASS_TOKEN'), db)
+        
+        await mel_fetcher.fetch_data()
+        hass_fetcher.fetch_data()
+        update_prices()
 
 async def fetch_and_store_energy_data(start_date=None, end_date=None):
     username = os.getenv('MELCLOUD_USERNAME')
@@ -0,0 +1,230 @@
+import sqlite3
+import os
+import gzip
+import json
+import hashlib
+import datetime
+import logging
+import threading
+from pathlib import Path
+from app.config import config
+
+
+logger = logging.getLogger(__name__)
+
+class RawArchive:
+    """Content-addressed store of raw API responses.
+
+    Every payload is serialized to canonical JSON, hashed with SHA-256 and
+    written once as a gzip file under ``objects/``. A small SQLite index maps
+    (source, kind, device, date range) to the payload hash, so identical
+    responses fetched again only bump a counter in the index.
+    """
+
+    def __init__(self, root=None):
+        """Initialize the archive directory and its index."""
+        if root is None:
+            # Default to the path specified in .env or a default location
+            root = config.get('RAW_ARCHIVE_PATH', 'app/db/raw_archive')
+
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        Path(self.objects_dir).mkdir(parents=True, exist_ok=True)
+
+        self.index_path = os.path.join(root, 'index.db')
+        self.conn = None
+        # Collectors archive from worker threads, so writes are serialized
+        self._lock = threading.Lock()
+        self.create_tables()
+
+    def get_connection(self):
+        """Get a connection to the archive index."""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+        return self.conn
+
+    def close_connection(self):
+        """Close the archive index connection."""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def create_tables(self):
+        """Create index tables if they don't exist."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        # One row per distinct payload stored on disk
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS objects (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        ''')
+
+        # One row per (source, kind, device, range) that produced a payload
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            device_id TEXT NOT NULL DEFAULT '',
+            start_date DATE NOT NULL DEFAULT '',
+            end_date DATE NOT NULL DEFAULT '',
+            hash TEXT NOT NULL,
+            first_fetched_at TEXT NOT NULL,
+            last_fetched_at TEXT NOT NULL,
+            fetch_count INTEGER NOT NULL DEFAULT 1,
+            UNIQUE(source, kind, device_id, start_date, end_date, hash)
+        )
+        ''')
+
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_responses_range
+        ON responses(source, kind, device_id, start_date, end_date)
+        ''')
+
+        conn.commit()
+
+    def _object_path(self, content_hash):
+        """Return the on-disk path of a payload, sharded by hash prefix."""
+        return os.path.join(self.objects_dir, content_hash[:2], f"{content_hash}.json.gz")
+
+    @staticmethod
+    def _format_date(value):
+        """Normalize a date, datetime or string to YYYY-MM-DD ('' if missing)."""
+        if value is None:
+            return ''
+        if isinstance(value, datetime.datetime):
+            return value.date().isoformat()
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        return str(value)[:10]
+
+    def store(self, source, kind, payload, device_id=None, start_date=None, end_date=None):
+        """Archive a raw payload and index it.
+
+        Args:
+            source: Data source name ('melcloud', 'homeassistant')
+            kind: Type of response ('energy_report', 'devices', 'history', ...)
+            payload: JSON-serializable response body
+            device_id: Device or entity the response refers to
+            start_date: First date covered by the response
+            end_date: Last date covered by the response
+
+        Returns:
+            The SHA-256 content hash of the payload
+        """
+        data = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+
+        with self._lock:
+            return self._store(data, content_hash, now, source, kind, device_id, start_date, end_date)
+
+    def _store(self, data, content_hash, now, source, kind, device_id, start_date, end_date):
+        """Write the payload and index row; callers must hold the lock."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT stored_size FROM objects WHERE hash = ?', (content_hash,))
+        path = self._object_path(content_hash)
+        if cursor.fetchone() is None or not os.path.exists(path):
+            # mtime=0 keeps the compressed bytes identical for identical payloads
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+
+            cursor.execute('''
+            INSERT OR REPLACE INTO objects (hash, size, stored_size, created_at)
+            VALUES (?, ?, ?, ?)
+            ''', (content_hash, len(data), len(compressed), now))
+
+        key = (source, kind, str(device_id) if device_id is not None else '',
+               self._format_date(start_date), self._format_date(end_date), content_hash)
+
+        cursor.execute('''
+        UPDATE responses
+        SET last_fetched_at = ?, fetch_count = fetch_count + 1
+        WHERE source = ? AND kind = ? AND device_id = ? AND start_date = ? AND end_date = ? AND hash = ?
+        ''', (now,) + key)
+
+        if cursor.rowcount == 0:
+            cursor.execute('''
+            INSERT INTO responses (source, kind, device_id, start_date, end_date, hash,
+                                   first_fetched_at, last_fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', key + (now, now))
+
+        conn.commit()
+        return content_hash
+
+    def load(self, content_hash):
+        """Load and decode an archived payload by its hash."""
+        with open(self._object_path(content_hash), 'rb') as f:
+            return json.loads(gzip.decompress(f.read()).decode('utf-8'))
+
+    def find(self, source=None, kind=None, device_id=None, start_date=None, end_date=None):
+        """Find archived responses, optionally overlapping a date range.
+
+        Returns index rows ordered by start date and fetch time, most recent
+        fetch last, so callers can let newer payloads win.
+        """
+        conditions = []
+        params = []
+
+        if source is not None:
+            conditions.append('source = ?')
+            params.append(source)
+        if kind is not None:
+            conditions.append('kind = ?')
+            params.append(kind)
+        if device_id is not None:
+            conditions.append('device_id = ?')
+            params.append(str(device_id))
+        if start_date is not None:
+            conditions.append("(end_date = '' OR end_date >= ?)")
+            params.append(self._format_date(start_date))
+        if end_date is not None:
+            conditions.append('start_date <= ?')
+            params.append(self._format_date(end_date))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+        SELECT id, source, kind, device_id, start_date, end_date, hash,
+               first_fetched_at, last_fetched_at, fetch_count
+        FROM responses
+        {where}
+        ORDER BY start_date, last_fetched_at, id
+        ''', params)
+
+        return cursor.fetchall()
+
+    def get_stats(self):
+        """Return payload counts and raw vs stored sizes."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        SELECT COUNT(*) AS objects,
+               COALESCE(SUM(size), 0) AS raw_bytes,
+               COALESCE(SUM(stored_size), 0) AS stored_bytes
+        FROM objects
+        ''')
+        stats = dict(cursor.fetchone())
+
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(fetch_count), 0) FROM responses')
+        row = cursor.fetchone()
+        stats['responses'] = row[0]
+        stats['fetches'] = row[1]
+
+        return stats
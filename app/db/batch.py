@@ -0,0 +1,164 @@
+import bisect
+import datetime
+import logging
+from app.db.fuels import FUELS, FuelPrices
+
+
+logger = logging.getLogger(__name__)
+
+# Most series a single batch may ask for
+MAX_BATCH_SERIES = 20
+
+BATCH_AGGREGATIONS = ('day', 'week', 'month', 'quarter', 'year', 'total')
+# Equivalent cost of each fuel of the registry, e.g. diesel_cost or lpg_cost
+FUEL_METRICS = {f'{key}_cost': key for key in FUELS}
+BATCH_METRICS = ('energy_consumed', 'energy_produced', 'cop', 'cost') + tuple(FUEL_METRICS) + ('savings', 'outdoor_temp')
+ENERGY_TYPES = ('total', 'heating', 'hot_water')
+
+def period_key(day, aggregation, start_date):
+    """Return the period a date belongs to, with the keys of the export API."""
+    if aggregation == 'day':
+        return day.isoformat()
+    if aggregation == 'week':
+        return (day - datetime.timedelta(days=day.weekday())).isoformat()
+    if aggregation == 'month':
+        return f"{day.year:04d}-{day.month:02d}-01"
+    if aggregation == 'quarter':
+        return f"{day.year:04d}-Q{(day.month - 1) // 3 + 1}"
+    if aggregation == 'year':
+        return f"{day.year:04d}"
+    return start_date.isoformat()
+
+def validate_series(name, spec):
+    """Check one series request and fill in its defaults; raises ValueError."""
+    if not isinstance(spec, dict):
+        raise ValueError(f"Series {name} must be an object")
+    if not isinstance(spec.get('start_date'), datetime.date) or not isinstance(spec.get('end_date'), datetime.date):
+        raise ValueError(f"Series {name} needs a start_date and an end_date")
+    if spec['start_date'] > spec['end_date']:
+        raise ValueError(f"Series {name} ends before it starts")
+
+    series = dict(spec)
+    series.setdefault('aggregation', 'day')
+    series.setdefault('energy_type', 'total')
+    series.setdefault('device_id', None)
+    series['metrics'] = list(spec.get('metrics') or BATCH_METRICS)
+
+    if series['aggregation'] not in BATCH_AGGREGATIONS:
+        raise ValueError(f"Series {name}: unknown aggregation {series['aggregation']}")
+    if series['energy_type'] not in ENERGY_TYPES:
+        raise ValueError(f"Series {name}: unknown energy type {series['energy_type']}")
+    unknown = [metric for metric in series['metrics'] if metric not in BATCH_METRICS]
+    if unknown:
+        raise ValueError(f"Series {name}: unknown metrics {', '.join(unknown)}")
+    return series
+
+def _add(total, value):
+    return total if value is None else (value if total is None else total + value)
+
+def run_batch(db, requests):
+    """Compute several named series with one scan of energy_data and one price load.
+
+    Args:
+        requests: Dictionary of series name -> {start_date, end_date (dates),
+            aggregation, metrics, energy_type, device_id}
+
+    Returns:
+        Dictionary of series name -> {'periods': [...], <metric>: [...], ...}
+    """
+    if len(requests) > MAX_BATCH_SERIES:
+        raise ValueError(f"At most {MAX_BATCH_SERIES} series per batch")
+    series = {name: validate_series(name, spec) for name, spec in requests.items()}
+    if not series:
+        return {}
+
+    start_date = min(spec['start_date'] for spec in series.values())
+    end_date = max(spec['end_date'] for spec in series.values())
+
+    cursor = db.get_connection().cursor()
+    cursor.execute('''
+    SELECT date, device_id,
+           heating_energy_consumed, hot_water_energy_consumed, total_energy_consumed,
+           heating_energy_produced, hot_water_energy_produced, total_energy_produced,
+           cost, outdoor_temp
+    FROM energy_data
+    WHERE date >= ? AND date <= ?
+    ORDER BY date
+    ''', (start_date, end_date))
+
+    # date -> list of rows of that date (one per device)
+    days = {}
+    for row in cursor:
+        days.setdefault(row['date'], []).append(row)
+    dates = sorted(days)
+    prices = FuelPrices(db)
+
+    results = {}
+    for name, spec in series.items():
+        consumed_column = f"{spec['energy_type']}_energy_consumed"
+        produced_column = f"{spec['energy_type']}_energy_produced"
+        # Savings are against diesel
+        fuels = [FUELS[key] for metric, key in FUEL_METRICS.items()
+                 if metric in spec['metrics'] or (key == 'diesel' and 'savings' in spec['metrics'])]
+        periods = {}
+
+        first = bisect.bisect_left(dates, spec['start_date'].isoformat())
+        last = bisect.bisect_right(dates, spec['end_date'].isoformat())
+        for date_str in dates[first:last]:
+            day = datetime.date.fromisoformat(date_str[:10])
+            rows = days[date_str]
+            device_rows = rows if spec['device_id'] is None else [
+                row for row in rows if row['device_id'] == spec['device_id']]
+
+            key = period_key(day, spec['aggregation'], spec['start_date'])
+            bucket = periods.setdefault(key, {'consumed': None, 'produced': None, 'cost': None,
+                                              'fuel_costs': {}, 'temperatures': []})
+
+            # Outdoor temperature is site-wide, so any row of the date carries it
+            temperatures = [row['outdoor_temp'] for row in rows if row['outdoor_temp'] is not None]
+            if temperatures:
+                bucket['temperatures'].append(max(temperatures))
+
+            produced = None
+            for row in device_rows:
+                bucket['consumed'] = _add(bucket['consumed'], row[consumed_column])
+                bucket['cost'] = _add(bucket['cost'], row['cost'])
+                produced = _add(produced, row[produced_column])
+            bucket['produced'] = _add(bucket['produced'], produced)
+
+            if produced:
+                month_prices = prices.for_month(day.year, day.month)
+                for fuel in fuels:
+                    fuel_cost = fuel.cost(produced, *month_prices[fuel.key])
+                    bucket['fuel_costs'][fuel.key] = _add(bucket['fuel_costs'].get(fuel.key), fuel_cost)
+
+        result = {
+            'start_date': spec['start_date'].isoformat(),
+            'end_date': spec['end_date'].isoformat(),
+            'aggregation': spec['aggregation'],
+            'energy_type': spec['energy_type'],
+            'device_id': spec['device_id'],
+            'periods': list(periods)
+        }
+        buckets = list(periods.values())
+        for metric in spec['metrics']:
+            if metric == 'energy_consumed':
+                values = [bucket['consumed'] for bucket in buckets]
+            elif metric == 'energy_produced':
+                values = [bucket['produced'] for bucket in buckets]
+            elif metric == 'cop':
+                values = [bucket['produced'] / bucket['consumed'] if bucket['consumed'] else None
+                          for bucket in buckets]
+            elif metric == 'cost':
+                values = [bucket['cost'] for bucket in buckets]
+            elif metric in FUEL_METRICS:
+                values = [bucket['fuel_costs'].get(FUEL_METRICS[metric]) or 0 for bucket in buckets]
+            elif metric == 'savings':
+                values = [(bucket['fuel_costs'].get('diesel') or 0) - (bucket['cost'] or 0) for bucket in buckets]
+            else:
+                values = [sum(bucket['temperatures']) / len(bucket['temperatures'])
+                          if bucket['temperatures'] else None for bucket in buckets]
+            result[metric] = values
+        results[name] = result
+
+    return results
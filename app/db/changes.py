@@ -0,0 +1,91 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Largest number of changes returned by one call
+MAX_CHANGES = 10000
+
+# API dataset name -> table and columns returned for a changed row
+CHANGE_DATASETS = {
+    'energy': ('energy_data', (
+        'device_id', 'date', 'heating_energy_consumed', 'hot_water_energy_consumed',
+        'total_energy_consumed', 'heating_energy_produced', 'hot_water_energy_produced',
+        'total_energy_produced', 'cop', 'power_consumption', 'cost', 'device_name',
+        'operation_mode', 'demand_percentage', 'outdoor_temp', 'change_seq'
+    )),
+    'prices': ('prices', (
+        'year', 'month', 'electricity_price', 'diesel_price', 'diesel_efficiency', 'change_seq'
+    ))
+}
+
+# Key columns of a deleted row, per dataset
+DELETED_KEYS = {
+    'energy': ('device_id', 'date'),
+    'prices': ('year', 'month')
+}
+
+def fetch_changes(db, since=0, limit=1000, datasets=None):
+    """Return the rows written or deleted after a change_seq watermark.
+
+    Energy rows also carry the outdoor temperature, so temperature changes
+    come back as energy rows.
+
+    Args:
+        since: Watermark of the previous call (0 for everything)
+        limit: Most changes to return; the rest follow on the next call
+        datasets: Names from CHANGE_DATASETS (default all)
+
+    Returns:
+        Dictionary with one list of rows per dataset, 'deleted' (dataset and
+        key of each deleted row), 'watermark' (the since of the next call) and
+        'more' (whether changes beyond the watermark are waiting)
+    """
+    datasets = list(datasets or CHANGE_DATASETS)
+    unknown = [name for name in datasets if name not in CHANGE_DATASETS]
+    if unknown:
+        raise ValueError(f"Unknown datasets: {', '.join(unknown)}")
+
+    # Rows numbered after this point are left to the next call, so a write
+    # racing with this one is never skipped
+    watermark = db.get_change_watermark()
+    cursor = db.get_connection().cursor()
+
+    changes = []
+    for name in datasets:
+        table, columns = CHANGE_DATASETS[name]
+        cursor.execute(f'''
+        SELECT {', '.join(columns)} FROM {table}
+        WHERE change_seq > ? AND change_seq <= ?
+        ORDER BY change_seq
+        LIMIT ?
+        ''', (since, watermark, limit + 1))
+        changes.extend((row['change_seq'], name, dict(row)) for row in cursor.fetchall())
+
+    tables = {CHANGE_DATASETS[name][0]: name for name in datasets}
+    placeholders = ', '.join('?' * len(tables))
+    cursor.execute(f'''
+    SELECT * FROM deleted_rows
+    WHERE change_seq > ? AND change_seq <= ? AND dataset IN ({placeholders})
+    ORDER BY change_seq
+    LIMIT ?
+    ''', (since, watermark, *tables, limit + 1))
+    for row in cursor.fetchall():
+        name = tables[row['dataset']]
+        deleted = {'dataset': name, 'change_seq': row['change_seq']}
+        deleted.update((column, row[column]) for column in DELETED_KEYS[name])
+        changes.append((row['change_seq'], 'deleted', deleted))
+
+    changes.sort(key=lambda change: change[0])
+    more = len(changes) > limit
+    if more:
+        changes = changes[:limit]
+        watermark = changes[-1][0]
+
+    result = {name: [] for name in datasets}
+    result['deleted'] = []
+    for _, kind, row in changes:
+        result[kind].append(row)
+    result['watermark'] = max(watermark, since)
+    result['more'] = more
+    return result
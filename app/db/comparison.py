@@ -0,0 +1,196 @@
+import re
+import calendar
+import datetime
+import logging
+from app.db.degree_days import get_base_temperature
+from app.db.export import PERIOD_EXPRESSIONS
+
+
+logger = logging.getLogger(__name__)
+
+COMPARE_AGGREGATIONS = ('day', 'week', 'month', 'quarter', 'year', 'total')
+ENERGY_TYPES = ('total', 'heating', 'hot_water')
+
+# Metrics of every compared period, in output order
+COMPARE_METRICS = ('energy_consumed', 'energy_produced', 'cop', 'cost', 'outdoor_temp', 'hdd',
+                   'consumed_per_hdd', 'cumulative_consumed', 'cumulative_cost')
+
+# Named offsets: the previous range of the same length, the same dates a year earlier
+OFFSET_ALIASES = {'previous': None, 'year': '1y'}
+OFFSET_PATTERN = re.compile(r'^(\d+)([dwmy])$')
+
+def _shift_months(day, months):
+    """Move a date back by whole months, clamping to the end of shorter months."""
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return datetime.date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+def compare_range(start_date, end_date, offset='previous'):
+    """Return the (start, end) of the range a period is compared with.
+
+    offset is 'previous' (the days right before start_date), 'year' (the same
+    dates one year earlier) or a count and unit going back in time, e.g. '7d',
+    '4w', '3m' or '2y'. The compared range always has as many days as the
+    current one.
+    """
+    days = (end_date - start_date).days
+    offset = OFFSET_ALIASES.get(offset, offset)
+    if offset is None:
+        compare_start = start_date - datetime.timedelta(days=days + 1)
+    else:
+        match = OFFSET_PATTERN.match(str(offset))
+        if not match or int(match.group(1)) == 0:
+            raise ValueError(f"Unknown offset {offset}: use previous, year or e.g. 7d, 4w, 3m, 1y")
+        count, unit = int(match.group(1)), match.group(2)
+        if unit == 'd':
+            compare_start = start_date - datetime.timedelta(days=count)
+        elif unit == 'w':
+            compare_start = start_date - datetime.timedelta(weeks=count)
+        else:
+            compare_start = _shift_months(start_date, count * (12 if unit == 'y' else 1))
+
+    compare_end = compare_start + datetime.timedelta(days=days)
+    if compare_end >= start_date:
+        raise ValueError("The compared range overlaps the current one; use a larger offset")
+    return compare_start, compare_end
+
+def _delta(current, previous):
+    if current is None or previous is None:
+        return None, None
+    delta = current - previous
+    return delta, (delta / abs(previous) * 100 if previous else None)
+
+def compare_periods(db, start_date, end_date, offset='previous', aggregation='total',
+                    energy_type='total', device_id=None, base_temperature=None):
+    """Compare a date range with an earlier one, period by aligned period.
+
+    The days of the compared range are shifted onto the current range (day n
+    of one faces day n of the other) and both are rolled up by the current
+    range's periods in one SQL query; running totals come from window
+    functions over the periods. Heating degree days (base HDD_BASE_TEMPERATURE,
+    default 18 °C) give a weather-normalized consumption, kWh per HDD.
+
+    Returns:
+        Dictionary with the two ranges and, per aligned period, the 'current'
+        and 'previous' value, the 'delta' and the 'delta_pct' of every metric,
+        plus the same for the whole range under 'totals'
+    """
+    if aggregation not in COMPARE_AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+    if energy_type not in ENERGY_TYPES:
+        raise ValueError(f"Unknown energy type: {energy_type}")
+    if start_date > end_date:
+        raise ValueError("The range ends before it starts")
+
+    compare_start, compare_end = compare_range(start_date, end_date, offset)
+    if base_temperature is None:
+        base_temperature = get_base_temperature()
+    period = PERIOD_EXPRESSIONS.get(aggregation, f"'{start_date.isoformat()}'")
+    device_filter = 'AND device_id = :device_id' if device_id is not None else ''
+
+    cursor = db.get_connection().cursor()
+    cursor.execute(f'''
+    WITH daily AS (
+        SELECT date,
+               SUM({energy_type}_energy_consumed) AS consumed,
+               SUM({energy_type}_energy_produced) AS produced,
+               SUM(cost) AS cost,
+               MAX(outdoor_temp) AS outdoor_temp
+        FROM energy_data
+        WHERE ((date >= :start AND date <= :end) OR (date >= :compare_start AND date <= :compare_end))
+              {device_filter}
+        GROUP BY date
+    ),
+    aligned AS (
+        SELECT CASE WHEN date >= :start THEN 'current' ELSE 'previous' END AS side,
+               CASE WHEN date >= :start THEN date(date)
+                    ELSE date(julianday(date) + julianday(:start) - julianday(:compare_start)) END AS date,
+               consumed, produced, cost, outdoor_temp,
+               MAX(:base - outdoor_temp, 0) AS hdd
+        FROM daily
+    ),
+    periods AS (
+        SELECT {period} AS period, MIN(date) AS first_date, MAX(date) AS last_date,
+               SUM(CASE WHEN side = 'current' THEN consumed END) AS current_consumed,
+               SUM(CASE WHEN side = 'previous' THEN consumed END) AS previous_consumed,
+               SUM(CASE WHEN side = 'current' THEN produced END) AS current_produced,
+               SUM(CASE WHEN side = 'previous' THEN produced END) AS previous_produced,
+               SUM(CASE WHEN side = 'current' THEN cost END) AS current_cost,
+               SUM(CASE WHEN side = 'previous' THEN cost END) AS previous_cost,
+               AVG(CASE WHEN side = 'current' THEN outdoor_temp END) AS current_outdoor_temp,
+               AVG(CASE WHEN side = 'previous' THEN outdoor_temp END) AS previous_outdoor_temp,
+               COUNT(CASE WHEN side = 'current' THEN outdoor_temp END) AS current_temperature_days,
+               COUNT(CASE WHEN side = 'previous' THEN outdoor_temp END) AS previous_temperature_days,
+               SUM(CASE WHEN side = 'current' THEN hdd END) AS current_hdd,
+               SUM(CASE WHEN side = 'previous' THEN hdd END) AS previous_hdd
+        FROM aligned
+        GROUP BY period
+    )
+    SELECT *,
+           SUM(current_consumed) OVER running AS current_cumulative_consumed,
+           SUM(previous_consumed) OVER running AS previous_cumulative_consumed,
+           SUM(current_cost) OVER running AS current_cumulative_cost,
+           SUM(previous_cost) OVER running AS previous_cumulative_cost
+    FROM periods
+    WINDOW running AS (ORDER BY period ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+    ORDER BY period
+    ''', {
+        'start': start_date.isoformat(), 'end': end_date.isoformat(),
+        'compare_start': compare_start.isoformat(), 'compare_end': compare_end.isoformat(),
+        'base': base_temperature, 'device_id': device_id
+    })
+    rows = cursor.fetchall()
+
+    def metrics(values):
+        """Build the metric -> {current, previous, delta, delta_pct} mapping of one period."""
+        result = {}
+        for metric in COMPARE_METRICS:
+            pair = []
+            for side in ('current', 'previous'):
+                if metric == 'cop':
+                    value = (values[f'{side}_produced'] / values[f'{side}_consumed']
+                             if values[f'{side}_consumed'] else None)
+                elif metric == 'consumed_per_hdd':
+                    value = (values[f'{side}_consumed'] / values[f'{side}_hdd']
+                             if values[f'{side}_hdd'] and values[f'{side}_consumed'] is not None else None)
+                else:
+                    name = {'energy_consumed': 'consumed', 'energy_produced': 'produced'}.get(metric, metric)
+                    value = values[f'{side}_{name}']
+                pair.append(value)
+            delta, delta_pct = _delta(*pair)
+            result[metric] = {'current': pair[0], 'previous': pair[1], 'delta': delta, 'delta_pct': delta_pct}
+        return result
+
+    periods = []
+    for row in rows:
+        entry = {'period': row['period'], 'first_date': row['first_date'], 'last_date': row['last_date']}
+        entry.update(metrics(row))
+        periods.append(entry)
+
+    # Whole-range totals from the period sums (temperatures weighted by their days)
+    totals = {}
+    for side in ('current', 'previous'):
+        for name in ('consumed', 'produced', 'cost', 'hdd'):
+            values = [row[f'{side}_{name}'] for row in rows if row[f'{side}_{name}'] is not None]
+            totals[f'{side}_{name}'] = sum(values) if values else None
+        totals[f'{side}_cumulative_consumed'] = totals[f'{side}_consumed']
+        totals[f'{side}_cumulative_cost'] = totals[f'{side}_cost']
+        temperature_days = sum(row[f'{side}_temperature_days'] for row in rows)
+        totals[f'{side}_outdoor_temp'] = (sum(row[f'{side}_outdoor_temp'] * row[f'{side}_temperature_days']
+                                              for row in rows if row[f'{side}_temperature_days'])
+                                          / temperature_days if temperature_days else None)
+
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'compare_start_date': compare_start.isoformat(),
+        'compare_end_date': compare_end.isoformat(),
+        'offset': offset,
+        'aggregation': aggregation,
+        'energy_type': energy_type,
+        'device_id': device_id,
+        'base_temperature': base_temperature,
+        'periods': periods,
+        'totals': metrics(totals)
+    }
@@ -0,0 +1,249 @@
+import datetime
+import logging
+from app.config import config
+from app.db.batch import period_key
+from app.db.export import PERIOD_EXPRESSIONS
+
+
+logger = logging.getLogger(__name__)
+
+# Heating is assumed to be needed below this daily mean outdoor temperature (°C)
+DEFAULT_BASE_TEMPERATURE = 18.0
+
+# Periods whose degree-day totals are kept up to date in degree_day_rollups
+ROLLUP_AGGREGATIONS = ('week', 'month', 'quarter', 'year')
+
+# Below this many degree days kWh/HDD is dominated by hot water and noise
+MIN_NORMALIZING_HDD = 1.0
+
+def get_base_temperature():
+    """Return the configured HDD base temperature (HDD_BASE_TEMPERATURE)."""
+    return config.get_float('HDD_BASE_TEMPERATURE', DEFAULT_BASE_TEMPERATURE)
+
+def heating_degree_days(outdoor_temp, base_temperature):
+    """Return the heating degree days of a day with the given mean outdoor temperature."""
+    return max(base_temperature - outdoor_temp, 0.0)
+
+def normalized_consumption(consumed, hdd):
+    """Return kWh per heating degree day, or None when there were too few degree days."""
+    if consumed is None or hdd is None or hdd < MIN_NORMALIZING_HDD:
+        return None
+    return consumed / hdd
+
+def period_bounds(aggregation, period):
+    """Return the first and last date of a period key (as made by batch.period_key)."""
+    if aggregation == 'week':
+        start = datetime.date.fromisoformat(period)
+        return start, start + datetime.timedelta(days=6)
+    if aggregation == 'month':
+        start = datetime.date.fromisoformat(period)
+        next_month = (start + datetime.timedelta(days=31)).replace(day=1)
+        return start, next_month - datetime.timedelta(days=1)
+    if aggregation == 'quarter':
+        year, quarter = period.split('-Q')
+        start = datetime.date(int(year), (int(quarter) - 1) * 3 + 1, 1)
+        end_month = start.month + 2
+        next_start = datetime.date(start.year + (end_month == 12), end_month % 12 + 1, 1)
+        return start, next_start - datetime.timedelta(days=1)
+    if aggregation == 'year':
+        return datetime.date(int(period), 1, 1), datetime.date(int(period), 12, 31)
+    day = datetime.date.fromisoformat(period)
+    return day, day
+
+# Base temperature the stored degree days were computed with, read by the triggers
+BASE_TEMPERATURE_SQL = "(SELECT value FROM sync_state WHERE key = 'degree_day_base_temperature')"
+
+def _day_periods(day):
+    """SQL of the (aggregation, period) rollups a day (SQL date expression) belongs to."""
+    return ' UNION ALL '.join(
+        f"SELECT '{aggregation}' AS aggregation, {PERIOD_EXPRESSIONS[aggregation]} AS period "
+        f"FROM (SELECT {day} AS date)"
+        for aggregation in ROLLUP_AGGREGATIONS
+    )
+
+def _apply_day(day, sign):
+    """SQL adding (sign 1) or removing (sign -1) a stored day from its rollups."""
+    return f'''
+    INSERT INTO degree_day_rollups (aggregation, period, hdd, days, temperature_sum)
+    SELECT periods.aggregation, periods.period, {sign} * degree_days.hdd, {sign}, {sign} * degree_days.outdoor_temp
+    FROM ({_day_periods(day)}) AS periods, degree_days
+    WHERE degree_days.date = {day}
+    ON CONFLICT(aggregation, period) DO UPDATE SET
+        hdd = hdd + excluded.hdd,
+        days = days + excluded.days,
+        temperature_sum = temperature_sum + excluded.temperature_sum;
+    '''
+
+def _refresh_day(day):
+    """SQL recomputing the degree days of a date from its energy_data rows.
+
+    Outdoor temperature is site-wide, so the day takes the highest of its
+    device rows, as rebuild_degree_days does.
+    """
+    return f'''
+    {_apply_day(day, -1)}
+    DELETE FROM degree_days WHERE date = {day};
+    INSERT INTO degree_days (date, outdoor_temp, hdd, base_temperature)
+    SELECT {day}, outdoor_temp, MAX({BASE_TEMPERATURE_SQL} - outdoor_temp, 0), {BASE_TEMPERATURE_SQL}
+    FROM (
+        SELECT MAX(outdoor_temp) AS outdoor_temp
+        FROM energy_data
+        WHERE date >= {day} AND date < date({day}, '+1 day')
+    )
+    WHERE outdoor_temp IS NOT NULL;
+    {_apply_day(day, 1)}
+    DELETE FROM degree_day_rollups
+    WHERE days = 0 AND (aggregation, period) IN ({_day_periods(day)});
+    '''
+
+def create_degree_days(cursor, base_temperature):
+    """Create degree_days, degree_day_rollups and the energy_data triggers that keep them current.
+
+    Every write to energy_data that changes a date's outdoor temperature,
+    whichever code path made it, recomputes that date and moves the totals
+    of its week, month, quarter and year by the difference.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS degree_days (
+        date DATE PRIMARY KEY,
+        outdoor_temp REAL NOT NULL,
+        hdd REAL NOT NULL,
+        base_temperature REAL NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS degree_day_rollups (
+        aggregation TEXT NOT NULL,
+        period TEXT NOT NULL,
+        hdd REAL NOT NULL,
+        days INTEGER NOT NULL,
+        temperature_sum REAL NOT NULL,
+        PRIMARY KEY (aggregation, period)
+    )
+    ''')
+
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_degree_days_insert AFTER INSERT ON energy_data
+    WHEN NEW.outdoor_temp IS NOT NULL
+    BEGIN
+        {_refresh_day('date(NEW.date)')}
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_degree_days_update AFTER UPDATE ON energy_data
+    WHEN OLD.outdoor_temp IS NOT NEW.outdoor_temp OR OLD.date IS NOT NEW.date
+    BEGIN
+        {_refresh_day('date(OLD.date)')}
+        {_refresh_day('date(NEW.date)')}
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_degree_days_delete AFTER DELETE ON energy_data
+    WHEN OLD.outdoor_temp IS NOT NULL
+    BEGIN
+        {_refresh_day('date(OLD.date)')}
+    END
+    ''')
+
+    sync_degree_day_base(cursor, base_temperature)
+
+def sync_degree_day_base(cursor, base_temperature):
+    """Recompute the degree days if they were computed for another base temperature."""
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'degree_day_base_temperature'")
+    stored = cursor.fetchone()
+    if stored is None or stored[0] != base_temperature:
+        rebuild_degree_days(cursor, base_temperature)
+
+def rebuild_degree_days(cursor, base_temperature):
+    """Recompute the degree days of every date and every rollup period from energy_data."""
+    cursor.execute('''
+    INSERT INTO sync_state (key, value) VALUES ('degree_day_base_temperature', ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (base_temperature,))
+    cursor.execute('DELETE FROM degree_days')
+    cursor.execute('DELETE FROM degree_day_rollups')
+    cursor.execute('''
+    INSERT INTO degree_days (date, outdoor_temp, hdd, base_temperature)
+    SELECT date(date), MAX(outdoor_temp), MAX(? - MAX(outdoor_temp), 0), ?
+    FROM energy_data
+    WHERE outdoor_temp IS NOT NULL
+    GROUP BY date(date)
+    ''', (base_temperature, base_temperature))
+    for aggregation in ROLLUP_AGGREGATIONS:
+        cursor.execute(f'''
+        INSERT INTO degree_day_rollups (aggregation, period, hdd, days, temperature_sum)
+        SELECT ?, {PERIOD_EXPRESSIONS[aggregation]}, SUM(hdd), COUNT(*), SUM(outdoor_temp)
+        FROM degree_days
+        GROUP BY {PERIOD_EXPRESSIONS[aggregation]}
+        ''', (aggregation,))
+    logger.info(f"Rebuilt degree days with base temperature {base_temperature}°C")
+
+def _period_row(period, hdd, days, temperature_sum):
+    return {
+        'period': period,
+        'hdd': hdd,
+        'days': days,
+        'outdoor_temp': temperature_sum / days if days else None
+    }
+
+def get_degree_days(db, start_date, end_date, aggregation='day', base_temperature=None):
+    """Return the heating degree days of a date range per day or period.
+
+    Periods lying entirely inside the range are read from the maintained
+    rollups; the partial periods at its ends are summed from the daily rows.
+    A base temperature other than the stored one (default
+    HDD_BASE_TEMPERATURE) is computed on the fly.
+
+    Returns:
+        List of {'period', 'hdd', 'days', 'outdoor_temp'} in period order,
+        with the period keys of the export API
+    """
+    if base_temperature is None:
+        base_temperature = get_base_temperature()
+    cursor = db.get_connection().cursor()
+    start, end = start_date.isoformat(), end_date.isoformat()
+
+    cursor.execute('SELECT base_temperature FROM degree_days LIMIT 1')
+    stored = cursor.fetchone()
+    if stored is not None and stored[0] != base_temperature:
+        period = PERIOD_EXPRESSIONS.get(aggregation, 'date')
+        cursor.execute(f'''
+        SELECT {period} AS period, SUM(MAX(? - outdoor_temp, 0)) AS hdd,
+               COUNT(*) AS days, SUM(outdoor_temp) AS temperature_sum
+        FROM degree_days
+        WHERE date >= ? AND date <= ?
+        GROUP BY {period}
+        ORDER BY period
+        ''', (base_temperature, start, end))
+        return [_period_row(*row) for row in cursor.fetchall()]
+
+    if aggregation not in ROLLUP_AGGREGATIONS:
+        cursor.execute('''
+        SELECT date, hdd, 1, outdoor_temp
+        FROM degree_days
+        WHERE date >= ? AND date <= ?
+        ORDER BY date
+        ''', (start, end))
+        return [_period_row(*row) for row in cursor.fetchall()]
+
+    cursor.execute('''
+    SELECT period, hdd, days, temperature_sum
+    FROM degree_day_rollups
+    WHERE aggregation = ? AND period >= ? AND period <= ?
+    ORDER BY period
+    ''', (aggregation, period_key(start_date, aggregation, start_date), period_key(end_date, aggregation, end_date)))
+    rows = [_period_row(*row) for row in cursor.fetchall()]
+
+    # Replace the periods cut by the ends of the range with their days inside it
+    for i in {0, len(rows) - 1} if rows else ():
+        period_start, period_end = period_bounds(aggregation, rows[i]['period'])
+        if period_start >= start_date and period_end <= end_date:
+            continue
+        cursor.execute('''
+        SELECT SUM(hdd), COUNT(*), SUM(outdoor_temp)
+        FROM degree_days
+        WHERE date >= ? AND date <= ?
+        ''', (max(period_start, start_date).isoformat(), min(period_end, end_date).isoformat()))
+        rows[i] = _period_row(rows[i]['period'], *cursor.fetchone())
+
+    return [row for row in rows if row['days']]
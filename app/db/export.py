@@ -0,0 +1,320 @@
+import io
+import csv
+import json
+import datetime
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from SQLite per batch; also one output chunk per batch
+EXPORT_BATCH_SIZE = 1000
+
+AGGREGATIONS = ('none', 'day', 'week', 'month', 'quarter', 'year')
+
+# SQLite expressions giving the same period keys as the dashboard's aggregate_data
+PERIOD_EXPRESSIONS = {
+    'day': "date(date)",
+    'week': "date(date, '-6 days', 'weekday 1')",
+    'month': "strftime('%Y-%m-01', date)",
+    'quarter': "strftime('%Y', date) || '-Q' || ((CAST(strftime('%m', date) AS INTEGER) + 2) / 3)",
+    'year': "strftime('%Y', date)"
+}
+
+# Per dataset: field name -> (raw expression, aggregated expression or None if
+# the field has no meaning once rows are grouped by period)
+ENERGY_FIELDS = {
+    'device_id': ('device_id', None),
+    'device_name': ('device_name', None),
+    'heating_energy_consumed': ('heating_energy_consumed', 'SUM(heating_energy_consumed)'),
+    'hot_water_energy_consumed': ('hot_water_energy_consumed', 'SUM(hot_water_energy_consumed)'),
+    'total_energy_consumed': ('total_energy_consumed', 'SUM(total_energy_consumed)'),
+    'heating_energy_produced': ('heating_energy_produced', 'SUM(heating_energy_produced)'),
+    'hot_water_energy_produced': ('hot_water_energy_produced', 'SUM(hot_water_energy_produced)'),
+    'total_energy_produced': ('total_energy_produced', 'SUM(total_energy_produced)'),
+    'cop': ('cop', '''CASE WHEN SUM(total_energy_consumed) > 0
+                   THEN SUM(total_energy_produced) / SUM(total_energy_consumed)
+                   ELSE AVG(cop) END'''),
+    'power_consumption': ('power_consumption', 'SUM(power_consumption)'),
+    'cost': ('cost', 'SUM(cost)'),
+    'operation_mode': ('operation_mode', None),
+    'demand_percentage': ('demand_percentage', 'AVG(demand_percentage)'),
+    'outdoor_temp': ('outdoor_temp', 'AVG(outdoor_temp)')
+}
+
+TEMPERATURE_FIELDS = {
+    'outdoor_temp': ('outdoor_temp', 'AVG(outdoor_temp)'),
+    'min_outdoor_temp': (None, 'MIN(outdoor_temp)'),
+    'max_outdoor_temp': (None, 'MAX(outdoor_temp)'),
+    'days': (None, 'COUNT(*)')
+}
+
+PRICE_FIELDS = {
+    'year': ('year', None),
+    'month': ('month', None),
+    'electricity_price': ('electricity_price', None),
+    'diesel_price': ('diesel_price', None),
+    'diesel_efficiency': ('diesel_efficiency', None)
+}
+
+DATASETS = {
+    'energy': ENERGY_FIELDS,
+    'temperature': TEMPERATURE_FIELDS,
+    'prices': PRICE_FIELDS
+}
+
+# energy_type -> column prefix of the energy_consumed/energy_produced fields
+ENERGY_TYPES = {'total': 'total', 'heating': 'heating', 'hot_water': 'hot_water'}
+
+def _select_fields(dataset, fields, aggregated, energy_type='total'):
+    """Return the (name, expression) pairs to export, validating requested fields.
+
+    Energy exports also accept energy_consumed and energy_produced, the
+    columns of the requested energy_type.
+    """
+    available = dict(DATASETS[dataset])
+    position = 1 if aggregated else 0
+
+    if dataset == 'energy':
+        if energy_type not in ENERGY_TYPES:
+            raise ValueError(f"Unknown energy type: {energy_type}")
+        prefix = ENERGY_TYPES[energy_type]
+        available['energy_consumed'] = available[f'{prefix}_energy_consumed']
+        available['energy_produced'] = available[f'{prefix}_energy_produced']
+
+    if not fields:
+        return [(name, spec[position]) for name, spec in DATASETS[dataset].items() if spec[position] is not None]
+
+    selected = []
+    for name in fields:
+        if name not in available:
+            raise ValueError(f"Unknown field for {dataset}: {name}")
+        expression = available[name][position]
+        if expression is None:
+            mode = 'aggregated' if aggregated else 'unaggregated'
+            raise ValueError(f"Field {name} is not available in {mode} {dataset} exports")
+        selected.append((name, expression))
+    return selected
+
+def page_key(dataset, aggregation='none', device_id=None):
+    """Return the columns a paged query is ordered and resumed by."""
+    if aggregation != 'none':
+        return ['period']
+    if dataset == 'energy' and device_id is None:
+        # Matches the UNIQUE(device_id, date) index
+        return ['device_id', 'date']
+    if dataset == 'prices':
+        return ['year', 'month']
+    return ['date']
+
+def next_period_start(aggregation, period):
+    """Return the first date after the period key returned by an aggregated query."""
+    if aggregation == 'year':
+        return datetime.date(int(period) + 1, 1, 1)
+    if aggregation == 'quarter':
+        year, quarter = int(period[:4]), int(period[-1])
+        return datetime.date(year + 1, 1, 1) if quarter == 4 else datetime.date(year, quarter * 3 + 1, 1)
+
+    day = datetime.date.fromisoformat(period)
+    if aggregation == 'month':
+        return datetime.date(day.year + 1, 1, 1) if day.month == 12 else datetime.date(day.year, day.month + 1, 1)
+    if aggregation == 'week':
+        return day + datetime.timedelta(days=7)
+    return day + datetime.timedelta(days=1)
+
+def build_export_query(dataset, start_date=None, end_date=None, fields=None, aggregation='none', device_id=None,
+                       energy_type='total', after=None, limit=None):
+    """Return (columns, sql, params) for an export.
+
+    Energy rows are per device and day; aggregated energy rows are summed over
+    all devices (or the one requested) per period. Temperature rows are the
+    site-wide outdoor temperature per day. Prices are monthly and cannot be
+    aggregated further.
+
+    With a limit the query returns one page, ordered by page_key() and
+    starting after the key values in after (keyset pagination). The key
+    columns are always part of a paged result.
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+    if dataset == 'prices' and aggregation != 'none':
+        raise ValueError("Prices are monthly and cannot be aggregated")
+
+    aggregated = aggregation != 'none'
+    selected = _select_fields(dataset, fields, aggregated, energy_type)
+    paged = limit is not None or after is not None
+    key = page_key(dataset, aggregation, device_id)
+
+    if paged:
+        names = [name for name, _ in selected]
+        selected = [(name, name) for name in key if name not in ('date', 'period') and name not in names] + selected
+        if after is not None and len(after) != len(key):
+            raise ValueError("Invalid page cursor")
+
+    conditions, params = [], []
+    if dataset == 'prices':
+        if start_date is not None:
+            conditions.append('year * 100 + month >= ?')
+            params.append(start_date.year * 100 + start_date.month)
+        if end_date is not None:
+            conditions.append('year * 100 + month <= ?')
+            params.append(end_date.year * 100 + end_date.month)
+        if after is not None:
+            conditions.append('(year, month) > (?, ?)')
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        columns = [name for name, _ in selected]
+        sql = f'''
+        SELECT {', '.join(f'{expression} AS {name}' for name, expression in selected)}
+        FROM prices
+        {where}
+        ORDER BY year, month
+        {'LIMIT ?' if limit is not None else ''}
+        '''
+        return columns, sql, params + ([limit] if limit is not None else [])
+
+    if start_date is not None:
+        conditions.append('date >= ?')
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append('date <= ?')
+        params.append(end_date)
+    if after is not None:
+        if aggregated:
+            # Resume at the first day of the next period, so the seek uses the date index
+            conditions.append('date >= ?')
+            params.append(next_period_start(aggregation, after[0]))
+        elif key == ['device_id', 'date']:
+            conditions.append('(device_id, date) > (?, ?)')
+            params.extend(after)
+        else:
+            conditions.append('date > ?')
+            params.append(after[0])
+
+    if dataset == 'energy':
+        if device_id is not None:
+            conditions.append('device_id = ?')
+            params.append(device_id)
+        source = 'energy_data'
+        order = ', '.join(key) if paged else 'date, device_id'
+    else:
+        # Outdoor temperature is site-wide, so collapse the per-device rows first
+        conditions.append('outdoor_temp IS NOT NULL')
+        source = f'''(
+            SELECT date, MAX(outdoor_temp) AS outdoor_temp
+            FROM energy_data
+            WHERE {' AND '.join(conditions)}
+            GROUP BY date
+        )'''
+        conditions = []
+        order = 'date'
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    select = ', '.join(f'{expression} AS {name}' for name, expression in selected)
+    limit_clause = ''
+    if limit is not None:
+        limit_clause = 'LIMIT ?'
+        params.append(limit)
+
+    if aggregated:
+        columns = ['period'] + [name for name, _ in selected]
+        sql = f'''
+        SELECT {PERIOD_EXPRESSIONS[aggregation]} AS period, {select}
+        FROM {source}
+        {where}
+        GROUP BY period
+        ORDER BY period
+        {limit_clause}
+        '''
+    else:
+        columns = ['date'] + [name for name, _ in selected]
+        sql = f'''
+        SELECT date, {select}
+        FROM {source}
+        {where}
+        ORDER BY {order}
+        {limit_clause}
+        '''
+    return columns, sql, params
+
+def iter_export_rows(db, sql, params, batch_size=EXPORT_BATCH_SIZE):
+    """Yield batches of rows from a query without loading the whole result."""
+    cursor = db.get_connection().cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+def csv_chunks(columns, batches):
+    """Yield CSV text, a header line then one chunk per batch of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    yield buffer.getvalue()
+
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def ndjson_chunks(columns, batches):
+    """Yield newline-delimited JSON, one object per row and one chunk per batch."""
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+# Export format -> (chunk generator, MIME type)
+FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'ndjson': (ndjson_chunks, 'application/x-ndjson')
+}
+
+def export_data(db, dataset, fmt, start_date=None, end_date=None, fields=None, aggregation='none',
+                device_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Return a generator of text chunks exporting a dataset in csv or ndjson.
+
+    The query is validated before anything is returned, so bad arguments
+    raise ValueError up front instead of in the middle of a stream.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    columns, sql, params = build_export_query(dataset, start_date, end_date, fields, aggregation, device_id)
+    chunks, _ = FORMATS[fmt]
+    return chunks(columns, iter_export_rows(db, sql, params, batch_size))
+
+def fetch_page(db, dataset, limit, after=None, **query):
+    """Return (columns, rows, key of the last row or None if it was the last page).
+
+    query takes the build_export_query arguments (start_date, end_date,
+    fields, aggregation, device_id, energy_type).
+    """
+    columns, sql, params = build_export_query(dataset, after=after, limit=limit + 1, **query)
+    cursor = db.get_connection().cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+
+    if len(rows) <= limit:
+        return columns, rows, None
+    rows = rows[:limit]
+    key = page_key(dataset, query.get('aggregation', 'none'), query.get('device_id'))
+    return columns, rows, [rows[-1][columns.index(name)] for name in key]
+
+def get_export_range(db, start_date=None, end_date=None):
+    """Fill in missing range bounds with the first and last date in energy_data."""
+    if start_date is None or end_date is None:
+        cursor = db.get_connection().cursor()
+        cursor.execute('SELECT MIN(date), MAX(date) FROM energy_data')
+        first, last = cursor.fetchone()
+        today = datetime.date.today()
+        if start_date is None:
+            start_date = datetime.date.fromisoformat(first[:10]) if first else today
+        if end_date is None:
+            end_date = datetime.date.fromisoformat(last[:10]) if last else today
+    return start_date, end_date
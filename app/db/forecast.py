@@ -0,0 +1,370 @@
+import math
+import datetime
+import logging
+from app.config import config
+from app.db.cache import ResultCache
+from app.db.prices import PriceResolver
+
+
+logger = logging.getLogger(__name__)
+
+ENERGY_TYPES = ('total', 'heating', 'hot_water')
+
+# Temperature scenarios: shift of the typical weather in °C
+SCENARIOS = {'typical': 0.0, 'cold': -2.0, 'warm': 2.0}
+
+# A device's model is used once it has this many days of data
+MIN_FIT_DAYS = 14
+
+# Devices without data in the last days before the forecast are left out
+ACTIVE_DEVICE_DAYS = 30
+
+# z of the two-sided 90% interval of the forecast consumption
+INTERVAL_Z = 1.645
+
+# COP predictions are kept inside this range
+COP_LIMITS = (1.0, 10.0)
+
+DEFAULT_ELECTRICITY_PRICE = 0.28
+DEFAULT_HEATING_SEASON = ('10-01', '04-30')
+
+# Columns of energy_data the statistics depend on
+STAT_SOURCE_COLUMNS = ('device_id', 'outdoor_temp') + tuple(
+    f'{energy_type}_energy_{kind}' for energy_type in ENERGY_TYPES for kind in ('consumed', 'produced')
+)
+
+BASE_TEMPERATURE_SQL = "(SELECT value FROM sync_state WHERE key = 'forecast_base_temperature')"
+
+def _observations(row):
+    """SQL of the (x, y) points a row (or all of energy_data) adds to each model.
+
+    consumption: daily kWh against heating degree days; cop: daily COP
+    against the outdoor temperature.
+    """
+    source = '' if row in ('NEW', 'OLD') else f' FROM {row}'
+    points = []
+    for energy_type in ENERGY_TYPES:
+        consumed = f'{row}.{energy_type}_energy_consumed'
+        produced = f'{row}.{energy_type}_energy_produced'
+        points.append(
+            f"SELECT {row}.device_id AS device_id, '{energy_type}' AS energy_type, 'consumption' AS model, "
+            f"MAX({BASE_TEMPERATURE_SQL} - {row}.outdoor_temp, 0) AS x, {consumed} AS y{source}"
+        )
+        points.append(
+            f"SELECT {row}.device_id AS device_id, '{energy_type}' AS energy_type, 'cop' AS model, "
+            f"{row}.outdoor_temp AS x, CASE WHEN {consumed} > 0 THEN {produced} / {consumed} END AS y{source}"
+        )
+    return f'''
+    SELECT device_id, energy_type, model, COUNT(*) AS n, SUM(x) AS sx, SUM(y) AS sy,
+           SUM(x * x) AS sxx, SUM(x * y) AS sxy, SUM(y * y) AS syy
+    FROM ({' UNION ALL '.join(points)})
+    WHERE x IS NOT NULL AND y IS NOT NULL
+    GROUP BY device_id, energy_type, model
+    '''
+
+def _apply_observations(row, sign):
+    """SQL adding (sign 1) or removing (sign -1) a row's points from forecast_stats."""
+    return f'''
+    INSERT INTO forecast_stats (device_id, energy_type, model, n, sx, sy, sxx, sxy, syy)
+    SELECT device_id, energy_type, model, {sign} * n, {sign} * sx, {sign} * sy,
+           {sign} * sxx, {sign} * sxy, {sign} * syy
+    FROM ({_observations(row)})
+    WHERE true
+    ON CONFLICT(device_id, energy_type, model) DO UPDATE SET
+        n = n + excluded.n,
+        sx = sx + excluded.sx,
+        sy = sy + excluded.sy,
+        sxx = sxx + excluded.sxx,
+        sxy = sxy + excluded.sxy,
+        syy = syy + excluded.syy;
+    '''
+
+def create_forecast_stats(cursor, base_temperature):
+    """Create forecast_stats and the energy_data triggers that keep it current.
+
+    forecast_stats holds the running sums (n, Σx, Σy, Σx², Σxy, Σy²) of two
+    least-squares models per device and energy type, so fitting one is a
+    handful of arithmetic operations. Every write to energy_data adds the
+    new values of the rows it touched and removes their old ones.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS forecast_stats (
+        device_id INTEGER NOT NULL,
+        energy_type TEXT NOT NULL,
+        model TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        sx REAL NOT NULL,
+        sy REAL NOT NULL,
+        sxx REAL NOT NULL,
+        sxy REAL NOT NULL,
+        syy REAL NOT NULL,
+        PRIMARY KEY (device_id, energy_type, model)
+    )
+    ''')
+
+    changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in STAT_SOURCE_COLUMNS)
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_forecast_insert AFTER INSERT ON energy_data
+    BEGIN
+        {_apply_observations('NEW', 1)}
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_forecast_update AFTER UPDATE ON energy_data
+    WHEN {changed}
+    BEGIN
+        {_apply_observations('OLD', -1)}
+        {_apply_observations('NEW', 1)}
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_forecast_delete AFTER DELETE ON energy_data
+    BEGIN
+        {_apply_observations('OLD', -1)}
+    END
+    ''')
+
+    sync_forecast_base(cursor, base_temperature)
+
+def sync_forecast_base(cursor, base_temperature):
+    """Recompute forecast_stats if they were summed for another HDD base temperature."""
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'forecast_base_temperature'")
+    stored = cursor.fetchone()
+    if stored is not None and stored[0] == base_temperature:
+        return
+    cursor.execute('''
+    INSERT INTO sync_state (key, value) VALUES ('forecast_base_temperature', ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (base_temperature,))
+    cursor.execute('DELETE FROM forecast_stats')
+    cursor.execute(f'''
+    INSERT INTO forecast_stats (device_id, energy_type, model, n, sx, sy, sxx, sxy, syy)
+    SELECT device_id, energy_type, model, n, sx, sy, sxx, sxy, syy
+    FROM ({_observations('energy_data')})
+    ''')
+    logger.info(f"Rebuilt forecast statistics with base temperature {base_temperature}°C")
+
+def fit(n, sx, sy, sxx, sxy, syy):
+    """Fit y = intercept + slope * x from running sums.
+
+    Returns:
+        Dictionary with intercept, slope, residual variance, r2 and days, or
+        None when there are fewer than MIN_FIT_DAYS points
+    """
+    if n < MIN_FIT_DAYS:
+        return None
+    sxx_centered = sxx - sx * sx / n
+    syy_centered = max(syy - sy * sy / n, 0.0)
+    if sxx_centered <= 1e-9:
+        # x never varied (e.g. only summer days): the mean is all we know
+        slope = 0.0
+    else:
+        slope = (sxy - sx * sy / n) / sxx_centered
+    intercept = (sy - slope * sx) / n
+    sse = max(syy_centered - slope * (sxy - sx * sy / n), 0.0)
+    return {
+        'intercept': intercept,
+        'slope': slope,
+        'variance': sse / (n - 2),
+        'r2': 1 - sse / syy_centered if syy_centered > 0 else None,
+        'days': n
+    }
+
+def season_bounds(today):
+    """Return the heating season that today is in, or the next one outside it."""
+    start_md, end_md = (config.get('HEATING_SEASON_START', DEFAULT_HEATING_SEASON[0]),
+                        config.get('HEATING_SEASON_END', DEFAULT_HEATING_SEASON[1]))
+
+    def on(year, month_day):
+        month, day = map(int, month_day.split('-'))
+        return datetime.date(year, month, day)
+
+    start = on(today.year, start_md)
+    if start > today:
+        start = on(today.year - 1, start_md)
+    end = on(start.year + (on(start.year, end_md) < start), end_md)
+    if end < today:
+        start = on(today.year, start_md)
+        end = on(start.year + (on(start.year, end_md) < start), end_md)
+    return start, end
+
+def horizons(today):
+    """Return the (name, start, end) periods forecast: this month and the heating season."""
+    month_end = datetime.date(today.year, today.month, 1) + datetime.timedelta(days=31)
+    month_end = month_end.replace(day=1) - datetime.timedelta(days=1)
+    return [('month', today.replace(day=1), month_end), ('season',) + season_bounds(today)]
+
+def typical_temperatures(db):
+    """Return the mean outdoor temperature of each calendar day ('MM-DD') and month over the years."""
+    cursor = db.get_connection().cursor()
+    cursor.execute("SELECT strftime('%m-%d', date), AVG(outdoor_temp) FROM degree_days GROUP BY 1")
+    by_day = dict(cursor.fetchall())
+    cursor.execute("SELECT CAST(strftime('%m', date) AS INTEGER), AVG(outdoor_temp) FROM degree_days GROUP BY 1")
+    by_month = dict(cursor.fetchall())
+    return by_day, by_month
+
+def _load_models(db, energy_type, device_id, as_of):
+    """Fit the models of the devices forecast, from forecast_stats."""
+    cursor = db.get_connection().cursor()
+    active_since = (as_of - datetime.timedelta(days=ACTIVE_DEVICE_DAYS)).isoformat()
+    cursor.execute('''
+    SELECT device_id, model, n, sx, sy, sxx, sxy, syy
+    FROM forecast_stats
+    WHERE energy_type = ?
+      AND device_id IN (SELECT DISTINCT device_id FROM energy_data WHERE date > ?)
+    ORDER BY device_id
+    ''', (energy_type, active_since))
+
+    models = {}
+    for row in cursor.fetchall():
+        if device_id is not None and row['device_id'] != device_id:
+            continue
+        models.setdefault(row['device_id'], {'consumption': None, 'cop': None})[row['model']] = fit(*row[2:])
+    return {device: fitted for device, fitted in models.items() if fitted['consumption']}
+
+def _actuals(db, start_date, end_date, energy_type, device_id):
+    """Sum the recorded consumption, production and cost of a range.
+
+    The cost of heating or hot water is its share of the day's consumption.
+    """
+    cursor = db.get_connection().cursor()
+    device_filter = 'AND device_id = ?' if device_id is not None else ''
+    cost = 'cost' if energy_type == 'total' else (
+        f'CASE WHEN total_energy_consumed > 0 THEN cost * {energy_type}_energy_consumed / total_energy_consumed END'
+    )
+    cursor.execute(f'''
+    SELECT COALESCE(SUM({energy_type}_energy_consumed), 0), COALESCE(SUM({energy_type}_energy_produced), 0),
+           COALESCE(SUM({cost}), 0), COUNT(DISTINCT date)
+    FROM energy_data
+    WHERE date >= ? AND date <= ? {device_filter}
+    ''', (start_date.isoformat(), end_date.isoformat()) + ((device_id,) if device_id is not None else ()))
+    consumed, produced, cost, days = cursor.fetchone()
+    return {'energy_consumed': consumed, 'energy_produced': produced, 'cost': cost, 'days': days}
+
+_cache = ResultCache()
+
+def forecast(db, today=None, energy_type='total', device_id=None, scenario='typical',
+             temperature_offset=None, temperature=None):
+    """Forecast the consumption and cost of this month and this heating season.
+
+    Each active device has two least-squares models fitted from the running
+    sums in forecast_stats: daily kWh against heating degree days and COP
+    against outdoor temperature. The days after the last recorded one are
+    predicted from a temperature scenario (the typical temperature of each
+    calendar day, shifted by the scenario's offset or temperature_offset, or
+    a fixed temperature) and priced with the monthly electricity prices.
+    Results are cached until the data, the prices or the inputs change.
+
+    Returns:
+        Dictionary with the inputs, the fitted models per device and one
+        entry per horizon with the recorded 'actual', the predicted
+        'forecast' (with a 90% interval of the consumption) and their 'total'
+    """
+    if energy_type not in ENERGY_TYPES:
+        raise ValueError(f"Unknown energy type: {energy_type}")
+    if temperature_offset is None and temperature is None:
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {scenario}: use {', '.join(SCENARIOS)}")
+        temperature_offset = SCENARIOS[scenario]
+    elif temperature is None:
+        scenario = 'custom'
+    else:
+        scenario, temperature_offset = 'fixed', 0.0
+    today = today or datetime.date.today()
+
+    cursor = db.get_connection().cursor()
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'forecast_base_temperature'")
+    base_temperature = cursor.fetchone()[0]
+    key = (db.db_path, db.get_change_watermark(), today, energy_type, device_id, temperature_offset,
+           temperature, base_temperature)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    device_filter = 'WHERE device_id = ?' if device_id is not None else ''
+    cursor.execute(f'SELECT MAX(date) FROM energy_data {device_filter}',
+                   (device_id,) if device_id is not None else ())
+    last_date = cursor.fetchone()[0]
+    as_of = datetime.date.fromisoformat(str(last_date)[:10]) if last_date else today - datetime.timedelta(days=1)
+
+    models = _load_models(db, energy_type, device_id, as_of)
+    by_day, by_month = typical_temperatures(db)
+    fallback_temperature = sum(by_month.values()) / len(by_month) if by_month else 10.0
+    prices = PriceResolver(db)
+    default_price = config.get_float('ELECTRICITY_PRICE', DEFAULT_ELECTRICITY_PRICE)
+
+    def predict_day(day):
+        """Return the predicted (outdoor_temp, consumed, produced, variance, price) of a day."""
+        if temperature is not None:
+            outdoor_temp = temperature
+        else:
+            outdoor_temp = by_day.get(day.strftime('%m-%d'), by_month.get(day.month, fallback_temperature))
+            outdoor_temp += temperature_offset
+        hdd = max(base_temperature - outdoor_temp, 0.0)
+
+        consumed = produced = variance = 0.0
+        for fitted in models.values():
+            device_consumed = max(fitted['consumption']['intercept'] + fitted['consumption']['slope'] * hdd, 0.0)
+            cop_model = fitted['cop']
+            if cop_model:
+                cop = min(max(cop_model['intercept'] + cop_model['slope'] * outdoor_temp, COP_LIMITS[0]), COP_LIMITS[1])
+            else:
+                cop = COP_LIMITS[0]
+            consumed += device_consumed
+            produced += device_consumed * cop
+            variance += fitted['consumption']['variance']
+
+        price_data = prices.for_month(day.year, day.month)
+        price = price_data['electricity_price'] if price_data else default_price
+        return outdoor_temp, consumed, produced, variance, price
+
+    results = []
+    for name, start_date, end_date in horizons(today):
+        actual = _actuals(db, start_date, min(end_date, as_of), energy_type, device_id)
+
+        predicted = {'energy_consumed': 0.0, 'energy_produced': 0.0, 'cost': 0.0, 'days': 0}
+        variance = temperature_sum = 0.0
+        day = max(start_date, as_of + datetime.timedelta(days=1))
+        while day <= end_date and models:
+            outdoor_temp, consumed, produced, day_variance, price = predict_day(day)
+            predicted['energy_consumed'] += consumed
+            predicted['energy_produced'] += produced
+            predicted['cost'] += consumed * price
+            predicted['days'] += 1
+            variance += day_variance
+            temperature_sum += outdoor_temp
+            day += datetime.timedelta(days=1)
+
+        margin = INTERVAL_Z * math.sqrt(variance)
+        predicted['outdoor_temp'] = temperature_sum / predicted['days'] if predicted['days'] else None
+        predicted['energy_consumed_low'] = max(predicted['energy_consumed'] - margin, 0.0)
+        predicted['energy_consumed_high'] = predicted['energy_consumed'] + margin
+
+        total = {metric: actual[metric] + predicted[metric]
+                 for metric in ('energy_consumed', 'energy_produced', 'cost', 'days')}
+        total['energy_consumed_low'] = actual['energy_consumed'] + predicted['energy_consumed_low']
+        total['energy_consumed_high'] = actual['energy_consumed'] + predicted['energy_consumed_high']
+
+        results.append({
+            'horizon': name,
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'actual': actual,
+            'forecast': predicted,
+            'total': total
+        })
+
+    result = {
+        'as_of': as_of.isoformat(),
+        'energy_type': energy_type,
+        'device_id': device_id,
+        'scenario': scenario,
+        'temperature_offset': temperature_offset,
+        'temperature': temperature,
+        'base_temperature': base_temperature,
+        'models': [{'device_id': device, 'consumption': fitted['consumption'], 'cop': fitted['cop']}
+                   for device, fitted in sorted(models.items())],
+        'horizons': results
+    }
+    _cache.put(key, result)
+    return result
@@ -0,0 +1,157 @@
+import bisect
+import logging
+from app.config import config
+from app.db.prices import PriceResolver
+
+
+logger = logging.getLogger(__name__)
+
+class Fuel:
+    """A heating system the heat pump is compared against.
+
+    energy_content is the heat of one unit of fuel in kWh. Fuels with a
+    price_column take their monthly price (and efficiency) from the prices
+    table; the others from fuel_prices. Months without prices use the
+    <SETTING>_PRICE and <SETTING>_EFFICIENCY settings, else the defaults.
+    """
+
+    def __init__(self, key, label, unit, energy_content, price, efficiency, rgb, setting,
+                 price_column=None, efficiency_column=None):
+        self.key = key
+        self.label = label
+        self.unit = unit
+        self.energy_content = energy_content
+        self.price = price
+        self.efficiency = efficiency
+        # Chart colors
+        self.color = f'rgb({rgb})'
+        self.background_color = f'rgba({rgb}, 0.2)'
+        self.setting = setting
+        self.price_column = price_column
+        self.efficiency_column = efficiency_column
+
+    def default_price(self):
+        return config.get_float(f'{self.setting}_PRICE', self.price)
+
+    def default_efficiency(self):
+        return config.get_float(f'{self.setting}_EFFICIENCY', self.efficiency)
+
+    def cost(self, produced, price, efficiency):
+        """Cost of the fuel that would have produced the given heat (kWh).
+
+        Formula from cost_calculations.md:
+        Cost = (Produced / (EFFICIENCY * ENERGY_CONTENT)) * PRICE
+        """
+        if not produced or produced <= 0:
+            return 0
+        return (produced / (efficiency * self.energy_content)) * price
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'label': self.label,
+            'unit': self.unit,
+            'energy_content': self.energy_content,
+            'color': self.color
+        }
+
+# Fuels by key, in the order the charts show them
+FUELS = {fuel.key: fuel for fuel in (
+    Fuel('diesel', 'Diesel', 'L', 10.5, 1.50, 0.85, '255, 159, 64', 'DIESEL',
+         price_column='diesel_price', efficiency_column='diesel_efficiency'),
+    Fuel('lpg', 'GPL', 'L', 6.8, 0.85, 0.90, '153, 102, 255', 'LPG'),
+    Fuel('natural_gas', 'Metano', 'Sm³', 9.6, 1.10, 0.95, '75, 192, 192', 'NATURAL_GAS'),
+    Fuel('pellets', 'Pellet', 'kg', 4.8, 0.40, 0.85, '153, 102, 51', 'PELLETS'),
+    Fuel('electric', 'Elettrico diretto', 'kWh', 1.0, 0.28, 1.0, '255, 99, 132', 'ELECTRICITY',
+         price_column='electricity_price'),
+)}
+
+# Fuels whose prices are kept in fuel_prices
+TABLE_FUELS = tuple(key for key, fuel in FUELS.items() if fuel.price_column is None)
+
+def configured_fuels():
+    """Return the fuels of COMPARISON_FUELS (default: all), always with diesel.
+
+    Diesel stays in because the savings shown across the app are against it.
+    """
+    keys = [key.strip() for key in config.get('COMPARISON_FUELS', ','.join(FUELS)).split(',') if key.strip()]
+    unknown = [key for key in keys if key not in FUELS]
+    if unknown:
+        logger.warning(f"Ignoring unknown fuels in COMPARISON_FUELS: {', '.join(unknown)}")
+    return [fuel for key, fuel in FUELS.items() if key == 'diesel' or key in keys]
+
+def select_fuels(value, available=None):
+    """Return the fuels of a comma-separated list of keys, in registry order.
+
+    Raises ValueError for keys not in available (default: all fuels).
+    """
+    available = available if available is not None else list(FUELS.values())
+    keys = [key.strip() for key in value.split(',') if key.strip()]
+    unknown = [key for key in keys if key not in [fuel.key for fuel in available]]
+    if unknown:
+        raise ValueError(f"Unknown fuels: {', '.join(unknown)}")
+    return [fuel for fuel in available if fuel.key in keys]
+
+class FuelPrices:
+    """Monthly price and efficiency of every fuel, loaded once per request or job.
+
+    Each fuel resolves like PriceResolver: the month's row, else the most
+    recent earlier month, else the latest month on record, else the fuel's
+    default. Pass the PriceResolver of the caller to share its price load.
+    """
+
+    def __init__(self, db, prices=None):
+        """Load the fuel_prices rows of the database."""
+        self.prices = prices if prices is not None else PriceResolver(db)
+        cursor = db.get_connection().cursor()
+        cursor.execute('SELECT fuel, year, month, price, efficiency FROM fuel_prices ORDER BY fuel, year, month')
+        self._rows = {}
+        for row in cursor.fetchall():
+            keys, rows = self._rows.setdefault(row['fuel'], ([], []))
+            keys.append(row['year'] * 12 + row['month'] - 1)
+            rows.append((row['price'], row['efficiency']))
+        self._defaults = {key: (fuel.default_price(), fuel.default_efficiency()) for key, fuel in FUELS.items()}
+        self._months = {}
+
+    def for_month(self, year, month):
+        """Return {fuel key: (price, efficiency)} for a month."""
+        month_key = year * 12 + month - 1
+        if month_key in self._months:
+            return self._months[month_key]
+
+        price_data = self.prices.for_month(year, month)
+        result = {}
+        for key, fuel in FUELS.items():
+            price, efficiency = self._defaults[key]
+            if fuel.price_column:
+                if price_data:
+                    price = price_data[fuel.price_column]
+                    if fuel.efficiency_column:
+                        efficiency = price_data[fuel.efficiency_column]
+            elif key in self._rows:
+                keys, rows = self._rows[key]
+                i = bisect.bisect_right(keys, month_key) - 1
+                price, efficiency = rows[i] if i >= 0 else rows[-1]
+            result[key] = (price, efficiency)
+
+        self._months[month_key] = result
+        return result
+
+def fuel_costs(fuel_prices, series, fuels=None):
+    """Equivalent cost of each fuel over a series of energy produced, in one pass.
+
+    Args:
+        fuel_prices: FuelPrices shared by all fuels
+        series: Iterable of (year, month, kWh produced)
+        fuels: Fuels to cost (default: the configured ones)
+
+    Returns:
+        Dictionary of fuel key -> list with the cost of each item
+    """
+    fuels = fuels if fuels is not None else configured_fuels()
+    costs = {fuel.key: [] for fuel in fuels}
+    for year, month, produced in series:
+        month_prices = fuel_prices.for_month(year, month)
+        for fuel in fuels:
+            costs[fuel.key].append(fuel.cost(produced, *month_prices[fuel.key]))
+    return costs
@@ -3,18 +3,74 @@ import os
 import datetime
 import logging
 from pathlib import Path
+from app.config import config
+from app.db.degree_days import (create_degree_days, get_base_temperature, rebuild_degree_days,
+                                 sync_degree_day_base)
+from app.db.forecast import create_forecast_stats, sync_forecast_base
+from app.db.fuels import FUELS, FuelPrices, fuel_costs
+from app.db.performance import create_cop_bins
+from app.db.prices import PriceResolver
+from app.db.tracing import TracedConnection
+from app.db.writer import (
+    BatchConnection, write_operation, write_queue_enabled, get_write_queue, get_writer_client
+)
 
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever create_tables creates or migrates something new, so existing
+# databases run the schema checks once more
+SCHEMA_VERSION = 8
+
+# data_events rows kept for clients catching up after a reconnect
+DATA_EVENTS_KEEP = 1000
+
+ENERGY_DATA_COLUMNS = '''
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date DATE NOT NULL,
+            heating_energy_consumed REAL,
+            hot_water_energy_consumed REAL,
+            total_energy_consumed REAL,
+            heating_energy_produced REAL,
+            hot_water_energy_produced REAL,
+            total_energy_produced REAL,
+            cop REAL,
+            power_consumption REAL,
+            cost REAL,
+            device_id INTEGER NOT NULL DEFAULT 0,
+            device_name TEXT,
+            operation_mode TEXT,
+            demand_percentage INTEGER,
+            outdoor_temp REAL,
+            change_seq INTEGER,
+            UNIQUE(device_id, date)'''
+
+# Tables whose rows carry a change_seq, with the columns identifying a row
+# (kept in deleted_rows when it is deleted) and the columns whose changes
+# give the row a new change_seq
+CHANGE_TRACKED_TABLES = {
+    'energy_data': (
+        ('device_id', 'date'),
+        ('heating_energy_consumed', 'hot_water_energy_consumed', 'total_energy_consumed',
+         'heating_energy_produced', 'hot_water_energy_produced', 'total_energy_produced',
+         'cop', 'power_consumption', 'cost', 'device_name', 'operation_mode',
+         'demand_percentage', 'outdoor_temp')
+    ),
+    'prices': (
+        ('year', 'month'),
+        ('electricity_price', 'diesel_price', 'diesel_efficiency')
+    )
+}
+
 class Database:
+    # True only for the instance owned by the writer thread
+    _is_writer = False
+
     def __init__(self, db_path=None):
         """Initialize database connection and ensure tables exist."""
         if db_path is None:
             # Default to the path specified in .env or a default location
-            from dotenv import load_dotenv
-            load_dotenv()
-            db_path = os.getenv('DATABASE_PATH', 'app/db/energy_data.db')
+            db_path = config.get('DATABASE_PATH', 'app/db/energy_data.db')
         
         # Ensure directory exists
         Path(os.path.dirname(db_path)).mkdir(parents=True, exist_ok=True)
@@ -24,12 +80,41 @@ class Database:
         self.create_tables()
     
     def get_connection(self):
-        """Get a database connection."""
+        """Get a database connection.
+        
+        Connections use WAL so readers never block on the writer, and wait
+        instead of failing when another process holds the write lock.
+        """
         if self.conn is None:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = sqlite3.connect(self.db_path, timeout=30, factory=TracedConnection)
             self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA busy_timeout=30000')
+            # An INSERT OR REPLACE must fire the delete triggers of the rows it replaces;
+            # writes use upserts instead, so updated rows are not reported as deleted
+            self.conn.execute('PRAGMA recursive_triggers=ON')
         return self.conn
     
+    def run_write(self, fn, operation=None, args=(), kwargs=None):
+        """Run fn(db) as a write on the single writer and return its result.
+        
+        Named operations are forwarded to the DB_WRITER_SOCKET writer when
+        another process serves it; otherwise they go to this process's write
+        queue. With DB_WRITE_QUEUE disabled, fn runs directly on this instance.
+        """
+        if self._is_writer or not write_queue_enabled():
+            return fn(self)
+        
+        if operation is not None:
+            client = get_writer_client(self.db_path)
+            if client is not None:
+                try:
+                    return client.call(operation, args, kwargs or {})
+                except OSError as e:
+                    logger.warning(f"Writer socket unavailable, writing in-process: {e}")
+        
+        return get_write_queue(self.db_path, WriterDatabase).run(fn)
+    
     def close_connection(self):
         """Close the database connection."""
         if self.conn:
@@ -37,33 +122,46 @@ class Database:
             self.conn = None
     
     def create_tables(self):
-        """Create database tables if they don't exist."""
+        """Create database tables if they don't exist.
+        
+        Skipped when the database's user_version says the schema is current.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Energy usage data from MELCloud (with added temperature column)
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
+        
+        # Known heat pump units
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS energy_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date DATE NOT NULL,
-            heating_energy_consumed REAL,
-            hot_water_energy_consumed REAL,
-            total_energy_consumed REAL,
-            heating_energy_produced REAL,
-            hot_water_energy_produced REAL,
-            total_energy_produced REAL,
-            cop REAL,
-            power_consumption REAL,
-            cost REAL,
-            device_id INTEGER,
+        CREATE TABLE IF NOT EXISTS devices (
+            device_id INTEGER PRIMARY KEY,
             device_name TEXT,
-            operation_mode TEXT,
-            demand_percentage INTEGER,
-            outdoor_temp REAL,
-            UNIQUE(date)
+            building_id INTEGER,
+            first_seen DATE,
+            last_seen DATE
+        )
+        ''')
+        
+        # Energy usage data from MELCloud (with added temperature column)
+        # One row per device and day; device_id 0 holds site-level rows
+        # (temperature only, or data collected before devices were tracked)
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS energy_data ({ENERGY_DATA_COLUMNS}
         )
         ''')
         
+        # Migrate databases created before energy_data was keyed by device
+        self._migrate_energy_data_device_key(cursor)
+        
+        # Range scans across all devices (dashboards) use this index;
+        # per-device scans use the (device_id, date) unique index
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_energy_data_date_device
+        ON energy_data(date, device_id)
+        ''')
+        
         # Price information - modified to include year and month
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS prices (
@@ -73,44 +171,367 @@ class Database:
             electricity_price REAL NOT NULL,
             diesel_price REAL NOT NULL,
             diesel_efficiency REAL NOT NULL,
+            change_seq INTEGER,
             UNIQUE(year, month)
         )
         ''')
         
+        # Monthly prices of the comparison fuels not covered by prices
+        # (see TABLE_FUELS in app/db/fuels.py)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fuel_prices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fuel TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            price REAL NOT NULL,
+            efficiency REAL NOT NULL,
+            UNIQUE(fuel, year, month)
+        )
+        ''')
+        
+        # Telemetry of every collector run, with per-source totals
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collector_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            collector TEXT NOT NULL,
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP,
+            duration_seconds REAL,
+            status TEXT NOT NULL,
+            dates_missing INTEGER NOT NULL DEFAULT 0,
+            dates_collected INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+        ''')
+        
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_collector_runs_started
+        ON collector_runs(started_at)
+        ''')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS collector_run_sources (
+            run_id INTEGER NOT NULL REFERENCES collector_runs(run_id) ON DELETE CASCADE,
+            source TEXT NOT NULL,
+            api_calls INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0,
+            retries INTEGER NOT NULL DEFAULT 0,
+            total_ms REAL NOT NULL DEFAULT 0,
+            max_ms REAL NOT NULL DEFAULT 0,
+            rows_inserted INTEGER NOT NULL DEFAULT 0,
+            rows_updated INTEGER NOT NULL DEFAULT 0,
+            rows_unchanged INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (run_id, source)
+        )
+        ''')
+        
+        # One row per committed change of the data, read by the live update stream
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            device_id INTEGER,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        self._create_change_tracking(cursor)
+        
+        # Heating degree days per date (site-wide) and their totals per period,
+        # kept current by triggers on energy_data
+        create_degree_days(cursor, get_base_temperature())
+        
+        # COP per outdoor temperature bin, also kept by triggers
+        create_cop_bins(cursor)
+        
+        # Running sums of the forecast regressions, also kept by triggers
+        create_forecast_stats(cursor, get_base_temperature())
+        
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         conn.commit()
     
+    def _migrate_energy_data_device_key(self, cursor):
+        """Rebuild an energy_data table keyed on UNIQUE(date) as UNIQUE(device_id, date)."""
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'energy_data'")
+        row = cursor.fetchone()
+        if not row or 'UNIQUE(date)' not in ''.join(row[0].split()):
+            return
+        
+        logger.info("Migrating energy_data to a (device_id, date) key")
+        
+        columns = (
+            'id, date, heating_energy_consumed, hot_water_energy_consumed, total_energy_consumed, '
+            'heating_energy_produced, hot_water_energy_produced, total_energy_produced, cop, '
+            'power_consumption, cost, device_id, device_name, operation_mode, demand_percentage, outdoor_temp'
+        )
+        
+        cursor.execute('ALTER TABLE energy_data RENAME TO energy_data_pre_device')
+        cursor.execute(f'CREATE TABLE energy_data ({ENERGY_DATA_COLUMNS}\n)')
+        cursor.execute(f'''
+        INSERT INTO energy_data ({columns})
+        SELECT {columns.replace('device_id', 'COALESCE(device_id, 0)')}
+        FROM energy_data_pre_device
+        ''')
+        cursor.execute('DROP TABLE energy_data_pre_device')
+        
+        # Register the devices already present in the data
+        cursor.execute('''
+        INSERT OR IGNORE INTO devices (device_id, device_name, first_seen, last_seen)
+        SELECT device_id, MAX(device_name), MIN(date), MAX(date)
+        FROM energy_data
+        WHERE device_id != 0
+        GROUP BY device_id
+        ''')
+    
+    def _create_change_tracking(self, cursor):
+        """Give energy_data and prices rows a change_seq kept current by triggers.
+        
+        Every insert, every update that changes a value and every delete takes
+        the next number of the database-wide sequence in sync_state; deletes
+        leave the key of the row in deleted_rows. Triggers cover every write
+        path, including the scripts that write with plain SQL.
+        """
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO sync_state (key, value) VALUES ('change_seq', 0)")
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deleted_rows (
+            change_seq INTEGER PRIMARY KEY,
+            dataset TEXT NOT NULL,
+            device_id INTEGER,
+            date DATE,
+            year INTEGER,
+            month INTEGER,
+            deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        next_seq = "(SELECT value FROM sync_state WHERE key = 'change_seq')"
+        bump_seq = "UPDATE sync_state SET value = value + 1 WHERE key = 'change_seq';"
+        for table, (key_columns, value_columns) in CHANGE_TRACKED_TABLES.items():
+            cursor.execute(f'PRAGMA table_info({table})')
+            if 'change_seq' not in [row['name'] for row in cursor.fetchall()]:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN change_seq INTEGER')
+            
+            # Number the rows written before change tracking existed
+            cursor.execute(f'UPDATE {table} SET change_seq = {next_seq} + id WHERE change_seq IS NULL')
+            cursor.execute(f'''
+            UPDATE sync_state SET value = MAX(value, (SELECT COALESCE(MAX(change_seq), 0) FROM {table}))
+            WHERE key = 'change_seq'
+            ''')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_change_seq ON {table}(change_seq)')
+            
+            changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in key_columns + value_columns)
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_change_insert AFTER INSERT ON {table}
+            BEGIN
+                {bump_seq}
+                UPDATE {table} SET change_seq = {next_seq} WHERE id = NEW.id;
+            END
+            ''')
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_change_update AFTER UPDATE ON {table}
+            WHEN {changed}
+            BEGIN
+                {bump_seq}
+                UPDATE {table} SET change_seq = {next_seq} WHERE id = NEW.id;
+            END
+            ''')
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_change_delete AFTER DELETE ON {table}
+            BEGIN
+                {bump_seq}
+                INSERT INTO deleted_rows (change_seq, dataset, {', '.join(key_columns)})
+                VALUES ({next_seq}, '{table}', {', '.join('OLD.' + column for column in key_columns)});
+            END
+            ''')
+    
+    def get_change_watermark(self):
+        """Get the change_seq of the latest change to energy_data or prices."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'change_seq'")
+        return cursor.fetchone()[0]
+    
+    def _record_data_event(self, cursor, source, start_date, end_date=None, device_id=None):
+        """Record that the data of a date range changed, in the caller's transaction."""
+        cursor.execute('''
+        INSERT INTO data_events (source, start_date, end_date, device_id)
+        VALUES (?, ?, ?, ?)
+        ''', (source, str(start_date), str(end_date or start_date), device_id))
+        cursor.execute('DELETE FROM data_events WHERE event_id <= ?',
+                       (cursor.lastrowid - DATA_EVENTS_KEEP,))
+    
+    @write_operation
+    def register_device(self, device_id, device_name=None, building_id=None, seen_date=None):
+        """Add or update a heat pump unit in the devices table."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        seen_date = seen_date or datetime.date.today()
+        cursor.execute('''
+        INSERT INTO devices (device_id, device_name, building_id, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(device_id) DO UPDATE SET
+            device_name = COALESCE(excluded.device_name, devices.device_name),
+            building_id = COALESCE(excluded.building_id, devices.building_id),
+            first_seen = MIN(COALESCE(devices.first_seen, excluded.first_seen), excluded.first_seen),
+            last_seen = MAX(COALESCE(devices.last_seen, excluded.last_seen), excluded.last_seen)
+        ''', (device_id, device_name, building_id, seen_date, seen_date))
+        conn.commit()
+    
+    def get_devices(self):
+        """Get all known heat pump units ordered by name."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT device_id, device_name, building_id, first_seen, last_seen
+        FROM devices
+        ORDER BY device_name, device_id
+        ''')
+        
+        return cursor.fetchall()
+    
+    @write_operation
     def add_melcloud_data(self, date, heating_consumed, hot_water_consumed, heating_produced, 
                           hot_water_produced, cop, power_consumption, cost, device_id, 
                           device_name, operation_mode, demand_percentage):
-        """Add energy usage data from MELCloud."""
+        """Add energy usage data from MELCloud for one device and day."""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         # Calculate total energy consumed and produced
         total_consumed = (heating_consumed or 0) + (hot_water_consumed or 0)
         total_produced = (heating_produced or 0) + (hot_water_produced or 0)
+        device_id = device_id or 0
         
         try:
+            # Upsert so the outdoor temperature already stored for the day is kept
             cursor.execute('''
-            INSERT OR REPLACE INTO energy_data (
+            INSERT INTO energy_data (
                 date, heating_energy_consumed, hot_water_energy_consumed, 
                 total_energy_consumed, heating_energy_produced, hot_water_energy_produced, 
                 total_energy_produced, cop, power_consumption, cost, 
-                device_id, device_name, operation_mode, demand_percentage
+                device_id, device_name, operation_mode, demand_percentage, outdoor_temp
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                    (SELECT MAX(outdoor_temp) FROM energy_data WHERE date = ?))
+            ON CONFLICT(device_id, date) DO UPDATE SET
+                heating_energy_consumed = excluded.heating_energy_consumed,
+                hot_water_energy_consumed = excluded.hot_water_energy_consumed,
+                total_energy_consumed = excluded.total_energy_consumed,
+                heating_energy_produced = excluded.heating_energy_produced,
+                hot_water_energy_produced = excluded.hot_water_energy_produced,
+                total_energy_produced = excluded.total_energy_produced,
+                cop = excluded.cop,
+                power_consumption = excluded.power_consumption,
+                cost = excluded.cost,
+                device_name = excluded.device_name,
+                operation_mode = excluded.operation_mode,
+                demand_percentage = excluded.demand_percentage
             ''', (
                 date, heating_consumed, hot_water_consumed, 
                 total_consumed, heating_produced, hot_water_produced, 
                 total_produced, cop, power_consumption, cost, 
-                device_id, device_name, operation_mode, demand_percentage
+                device_id, device_name, operation_mode, demand_percentage, date
             ))
+            self._record_data_event(cursor, 'melcloud', date, device_id=device_id)
             conn.commit()
+            
+            if device_id:
+                self.register_device(device_id, device_name, seen_date=date)
             return True
         except sqlite3.IntegrityError as e:
             logger.error(f"Error adding MELCloud data: {e}")
             return False
     
+    @write_operation
+    def bulk_upsert_energy_data(self, records, chunk_size=500):
+        """Insert or update parsed energy values for many dates at once.
+
+        Each record is a dict with date, heating/hot water consumed and produced,
+        cop, cost and device_id. Rows are written with one transaction per chunk;
+        columns not covered by the energy report (temperature, operation mode)
+        are left untouched on existing rows.
+
+        Returns:
+            Number of records written
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        written = 0
+        for i in range(0, len(records), chunk_size):
+            chunk = records[i:i + chunk_size]
+            params = []
+            for record in chunk:
+                heating_consumed = record.get('heating_consumed') or 0
+                hot_water_consumed = record.get('hot_water_consumed') or 0
+                heating_produced = record.get('heating_produced') or 0
+                hot_water_produced = record.get('hot_water_produced') or 0
+                params.append((
+                    record['date'], heating_consumed, hot_water_consumed,
+                    heating_consumed + hot_water_consumed, heating_produced, hot_water_produced,
+                    heating_produced + hot_water_produced, record.get('cop'), record.get('cost'),
+                    record.get('device_id') or 0
+                ))
+
+            try:
+                cursor.executemany('''
+                INSERT INTO energy_data (
+                    date, heating_energy_consumed, hot_water_energy_consumed,
+                    total_energy_consumed, heating_energy_produced, hot_water_energy_produced,
+                    total_energy_produced, cop, cost, device_id
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(device_id, date) DO UPDATE SET
+                    heating_energy_consumed = excluded.heating_energy_consumed,
+                    hot_water_energy_consumed = excluded.hot_water_energy_consumed,
+                    total_energy_consumed = excluded.total_energy_consumed,
+                    heating_energy_produced = excluded.heating_energy_produced,
+                    hot_water_energy_produced = excluded.hot_water_energy_produced,
+                    total_energy_produced = excluded.total_energy_produced,
+                    cop = excluded.cop,
+                    cost = excluded.cost
+                ''', params)
+                dates = [str(record['date']) for record in chunk]
+                devices = {record.get('device_id') or 0 for record in chunk}
+                self._record_data_event(cursor, 'melcloud', min(dates), max(dates),
+                                        devices.pop() if len(devices) == 1 else None)
+                conn.commit()
+                written += len(chunk)
+            except sqlite3.Error as e:
+                logger.error(f"Error bulk upserting energy data: {e}")
+                conn.rollback()
+                raise
+
+        return written
+
+    def get_energy_values(self, start_date, end_date, device_id=0):
+        """Get one device's stored energy values for each date in the range, keyed by date string."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        SELECT date, heating_energy_consumed, hot_water_energy_consumed,
+               heating_energy_produced, hot_water_energy_produced, cop, cost, device_id
+        FROM energy_data
+        WHERE device_id = ? AND date >= ? AND date <= ?
+        ORDER BY date
+        ''', (device_id or 0, start_date, end_date))
+
+        return {str(row['date']): row for row in cursor.fetchall()}
+
+    @write_operation
     def add_energy_data(self, timestamp, power_consumption, energy_consumed, cost):
         """Add energy usage data from MELCloud (legacy method)."""
         conn = self.get_connection()
@@ -126,8 +547,12 @@ class Database:
         
         try:
             cursor.execute('''
-            INSERT OR REPLACE INTO energy_data (date, total_energy_consumed, power_consumption, cost)
+            INSERT INTO energy_data (date, total_energy_consumed, power_consumption, cost)
             VALUES (?, ?, ?, ?)
+            ON CONFLICT(device_id, date) DO UPDATE SET
+                total_energy_consumed = excluded.total_energy_consumed,
+                power_consumption = excluded.power_consumption,
+                cost = excluded.cost
             ''', (date, energy_consumed, power_consumption, cost))
             conn.commit()
             return True
@@ -135,8 +560,13 @@ class Database:
             # Record already exists
             return False
     
+    @write_operation
     def add_temperature_data(self, timestamp, outdoor_temp, indoor_temp=None, flow_temp=None, return_temp=None):
-        """Add temperature data to energy_data table."""
+        """Add temperature data to energy_data table.
+        
+        Returns:
+            'inserted', 'updated' or 'unchanged' for the date's row, or False on error
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -169,33 +599,36 @@ class Database:
             return False
             
         try:
-            # Check if a record exists for this date
-            cursor.execute('SELECT id, outdoor_temp FROM energy_data WHERE date = ?', (date,))
-            existing = cursor.fetchone()
+            # Update the rows of every device for this date that hold another value
+            cursor.execute('''
+            UPDATE energy_data
+            SET outdoor_temp = ?
+            WHERE date = ? AND outdoor_temp IS NOT ?
+            ''', (outdoor_temp, date, outdoor_temp))
             
-            if existing:
-                # Validation: Check if the data is actually different
-                if existing['outdoor_temp'] == outdoor_temp:
-                    logger.info(f"Skipping update for {date}: temperature value unchanged ({outdoor_temp}°C)")
-                    return True
-                    
-                # Update existing record
-                cursor.execute('''
-                UPDATE energy_data 
-                SET outdoor_temp = ?
-                WHERE date = ?
-                ''', (outdoor_temp, date))
-                logger.info(f"Updated temperature for {date}: {outdoor_temp}°C")
+            if cursor.rowcount > 0:
+                logger.info(f"Updated temperature for {date}: {outdoor_temp}°C ({cursor.rowcount} rows)")
+                outcome = 'updated'
             else:
+                cursor.execute('SELECT 1 FROM energy_data WHERE date = ? LIMIT 1', (date,))
+                if cursor.fetchone():
+                    logger.info(f"Skipping update for {date}: temperature value unchanged ({outdoor_temp}°C)")
+                    return 'unchanged'
+                
                 # Insert new record with just temperature data
                 cursor.execute('''
                 INSERT INTO energy_data (date, outdoor_temp)
                 VALUES (?, ?)
                 ''', (date, outdoor_temp))
                 logger.info(f"Added new temperature record for {date}: {outdoor_temp}°C")
-                
+                outcome = 'inserted'
+            
+            # The energy_data triggers updated the degree days; recompute them all if the base changed
+            sync_degree_day_base(cursor, get_base_temperature())
+            sync_forecast_base(cursor, get_base_temperature())
+            self._record_data_event(cursor, 'homeassistant', date)
             conn.commit()
-            return True
+            return outcome
         except sqlite3.IntegrityError as e:
             logger.error(f"Database integrity error adding temperature data: {str(e)}")
             conn.rollback()
@@ -205,20 +638,37 @@ class Database:
             conn.rollback()
             return False
     
+    @write_operation
+    def rebuild_degree_days(self, base_temperature=None):
+        """Recompute all stored degree days, e.g. after changing HDD_BASE_TEMPERATURE.
+        
+        The forecast statistics, which use the same base, follow.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if base_temperature is None:
+            base_temperature = get_base_temperature()
+        rebuild_degree_days(cursor, base_temperature)
+        sync_forecast_base(cursor, base_temperature)
+        conn.commit()
+    
     def get_temperature_data(self, start_date, end_date):
         """Get temperature data for the specified date range."""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Outdoor temperature is site-wide, so collapse the per-device rows
         cursor.execute('''
-        SELECT date, outdoor_temp
+        SELECT date, MAX(outdoor_temp) AS outdoor_temp
         FROM energy_data
         WHERE date >= ? AND date <= ? AND outdoor_temp IS NOT NULL
+        GROUP BY date
         ORDER BY date
         ''', (start_date, end_date))
         
         return cursor.fetchall()
     
+    @write_operation
     def update_prices(self, electricity_price, diesel_price, diesel_efficiency, year=None, month=None):
         """Update price information for a specific month and year.
         
@@ -239,9 +689,16 @@ class Database:
                    f"Efficiency: {diesel_efficiency} (type: {type(diesel_efficiency)})")
         
         cursor.execute('''
-        INSERT OR REPLACE INTO prices (year, month, electricity_price, diesel_price, diesel_efficiency)
+        INSERT INTO prices (year, month, electricity_price, diesel_price, diesel_efficiency)
         VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(year, month) DO UPDATE SET
+            electricity_price = excluded.electricity_price,
+            diesel_price = excluded.diesel_price,
+            diesel_efficiency = excluded.diesel_efficiency
         ''', (year, month, electricity_price, diesel_price, diesel_efficiency))
+        month_start = datetime.date(year, month, 1)
+        month_end = (month_start + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+        self._record_data_event(cursor, 'prices', month_start, month_end)
         conn.commit()
         
         # Verify the insertion
@@ -256,8 +713,52 @@ class Database:
         else:
             logger.warning("Failed to retrieve the last inserted row")
     
-    def get_energy_data(self, start_date, end_date, energy_type='total'):
-        """Get energy data for the specified date range and energy type."""
+    @write_operation
+    def update_fuel_price(self, fuel, price, efficiency, year=None, month=None):
+        """Set the price and efficiency of a fuel of fuel_prices for a month.
+        
+        If year and month are not provided, uses the current month and year.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if year is None or month is None:
+            today = datetime.datetime.now()
+            year = today.year
+            month = today.month
+        
+        cursor.execute('''
+        INSERT INTO fuel_prices (fuel, year, month, price, efficiency)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(fuel, year, month) DO UPDATE SET
+            price = excluded.price,
+            efficiency = excluded.efficiency
+        ''', (fuel, year, month, price, efficiency))
+        month_start = datetime.date(year, month, 1)
+        month_end = (month_start + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+        self._record_data_event(cursor, 'fuel_prices', month_start, month_end)
+        conn.commit()
+        logger.info(f"Updated {fuel} price for {month}/{year}: {price}, efficiency {efficiency}")
+    
+    def get_fuel_prices(self):
+        """Get all fuel_prices records ordered by fuel, year and month."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT * FROM fuel_prices
+        ORDER BY fuel, year DESC, month DESC
+        ''')
+        
+        return cursor.fetchall()
+    
+    def get_energy_data(self, start_date, end_date, energy_type='total', device_id=None):
+        """Get energy data for the specified date range and energy type.
+        
+        With a device_id the rows of that unit are returned; otherwise the
+        values of all units are summed per date (COP is recomputed from the
+        sums when more than one unit reported on a day).
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -272,12 +773,52 @@ class Database:
             energy_consumed_col = 'total_energy_consumed'
             energy_produced_col = 'total_energy_produced'
         
-        cursor.execute(f'''
-        SELECT date, {energy_consumed_col}, {energy_produced_col},
-               cop, power_consumption, cost, operation_mode
-        FROM energy_data
-        WHERE date >= ? AND date <= ?
-        ORDER BY date
+        if device_id is not None:
+            cursor.execute(f'''
+            SELECT date, {energy_consumed_col}, {energy_produced_col},
+                   cop, power_consumption, cost, operation_mode
+            FROM energy_data
+            WHERE device_id = ? AND date >= ? AND date <= ?
+            ORDER BY date
+            ''', (device_id, start_date, end_date))
+        else:
+            cursor.execute(f'''
+            SELECT date,
+                   SUM({energy_consumed_col}) AS {energy_consumed_col},
+                   SUM({energy_produced_col}) AS {energy_produced_col},
+                   CASE
+                       WHEN COUNT(cop) <= 1 THEN MAX(cop)
+                       WHEN SUM(total_energy_consumed) > 0
+                           THEN SUM(total_energy_produced) / SUM(total_energy_consumed)
+                       ELSE AVG(cop)
+                   END AS cop,
+                   SUM(power_consumption) AS power_consumption,
+                   SUM(cost) AS cost,
+                   MAX(operation_mode) AS operation_mode
+            FROM energy_data
+            WHERE date >= ? AND date <= ?
+            GROUP BY date
+            ORDER BY date
+            ''', (start_date, end_date))
+        
+        return cursor.fetchall()
+    
+    def get_device_totals(self, start_date, end_date):
+        """Get consumed/produced energy and cost totals per device for a date range."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT e.device_id, d.device_name,
+               COUNT(e.total_energy_consumed) AS days,
+               SUM(e.total_energy_consumed) AS total_energy_consumed,
+               SUM(e.total_energy_produced) AS total_energy_produced,
+               SUM(e.cost) AS cost
+        FROM devices d
+        JOIN energy_data e ON e.device_id = d.device_id
+        WHERE e.date >= ? AND e.date <= ?
+        GROUP BY e.device_id
+        ORDER BY d.device_name, e.device_id
         ''', (start_date, end_date))
         
         return cursor.fetchall()
@@ -363,50 +904,39 @@ class Database:
         
         return cursor.fetchall()
     
-    def calculate_diesel_cost(self, start_date, end_date):
-        """Calculate hypothetical diesel cost based on energy produced data."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def calculate_fuel_costs(self, start_date, end_date, device_id=None, prices=None, fuels=None):
+        """Calculate the hypothetical cost of each fuel based on energy produced data.
         
-        # Get energy production data for the date range
-        cursor.execute('''
-        SELECT date, total_energy_produced FROM energy_data
-        WHERE date >= ? AND date <= ?
-        ORDER BY date
-        ''', (start_date, end_date))
+        Pass a PriceResolver as prices to reuse one already loaded; fuels
+        defaults to the configured ones.
         
-        energy_data = cursor.fetchall()
+        Returns:
+            Dictionary of fuel key -> total cost
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
-        total_cost = 0
+        # Energy produced per month of the date range
+        device_filter = 'AND device_id = ?' if device_id is not None else ''
+        cursor.execute(f'''
+        SELECT CAST(strftime('%Y', date) AS INTEGER), CAST(strftime('%m', date) AS INTEGER),
+               SUM(total_energy_produced)
+        FROM energy_data
+        WHERE date >= ? AND date <= ? {device_filter}
+        GROUP BY 1, 2
+        ''', (start_date, end_date) + ((device_id,) if device_id is not None else ()))
         
-        for data in energy_data:
-            date_str = data['date']
-            if isinstance(date_str, str):
-                date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-            else:
-                date = date_str
-                
-            year = date.year
-            month = date.month
-            
-            # Get prices for this month
-            price_data = self.get_prices_for_month(year, month)
-            
-            if not price_data:
-                continue  # Skip if no price data available
-                
-            diesel_price = price_data['diesel_price']
-            diesel_efficiency = price_data['diesel_efficiency']
-            
-            # Use formula from the cost_calculations.md document
-            energy_produced = data['total_energy_produced'] or 0
-            diesel_cost = (energy_produced / (diesel_efficiency * 10.5)) * diesel_price
-            
-            total_cost += diesel_cost
+        costs = fuel_costs(FuelPrices(self, prices), cursor.fetchall(), fuels)
+        return {key: sum(values) for key, values in costs.items()}
+    
+    def calculate_diesel_cost(self, start_date, end_date, device_id=None, prices=None):
+        """Calculate hypothetical diesel cost based on energy produced data.
         
-        return total_cost
+        Pass a PriceResolver as prices to reuse one already loaded.
+        """
+        return self.calculate_fuel_costs(start_date, end_date, device_id, prices, [FUELS['diesel']])['diesel']
         
-    def calculate_electricity_cost(self, date, consumed_kwh):
+    def calculate_electricity_cost(self, date, consumed_kwh, prices=None):
         """Calculate electricity cost based on consumption and price for the given date."""
         if isinstance(date, str):
             date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
@@ -415,7 +945,10 @@ class Database:
         month = date.month
         
         # Get prices for this month
-        price_data = self.get_prices_for_month(year, month)
+        if prices is not None:
+            price_data = prices.for_month(year, month)
+        else:
+            price_data = self.get_prices_for_month(year, month)
         
         if not price_data:
             # Default price if no data available
@@ -426,6 +959,7 @@ class Database:
         # Formula from cost_calculations.md: Cost = Consumption * Price
         return consumed_kwh * electricity_price
 
+    @write_operation
     def recalculate_energy_costs(self, start_date=None, end_date=None):
         """Recalculate all energy costs based on current price data."""
         conn = self.get_connection()
@@ -455,6 +989,7 @@ class Database:
         ''', (start_date, end_date))
         
         records = cursor.fetchall()
+        prices = PriceResolver(self)
         
         # Update each record with the new cost
         for record in records:
@@ -462,11 +997,139 @@ class Database:
             date = record['date']
             consumed = record['total_energy_consumed'] or 0
             
-            new_cost = self.calculate_electricity_cost(date, consumed)
+            new_cost = self.calculate_electricity_cost(date, consumed, prices)
             
             cursor.execute('''
             UPDATE energy_data SET cost = ? WHERE id = ?
             ''', (new_cost, record_id))
         
+        self._record_data_event(cursor, 'prices', start_date, end_date)
         conn.commit()
         return True
+
+    @write_operation
+    def add_collector_run(self, run):
+        """Save the telemetry of one collector run.
+        
+        Args:
+            run: Dictionary from CollectorRun.to_dict(), with per-source totals under 'sources'
+        
+        Returns:
+            ID of the saved run
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        INSERT INTO collector_runs (
+            collector, started_at, finished_at, duration_seconds, status,
+            dates_missing, dates_collected, last_error
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            run['collector'], run['started_at'], run.get('finished_at'), run.get('duration_seconds'),
+            run.get('status', 'ok'), run.get('dates_missing', 0), run.get('dates_collected', 0),
+            run.get('last_error')
+        ))
+        run_id = cursor.lastrowid
+        
+        cursor.executemany('''
+        INSERT INTO collector_run_sources (
+            run_id, source, api_calls, failures, retries, total_ms, max_ms,
+            rows_inserted, rows_updated, rows_unchanged
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (run_id, source, totals.get('api_calls', 0), totals.get('failures', 0), totals.get('retries', 0),
+             totals.get('total_ms', 0), totals.get('max_ms', 0), totals.get('rows_inserted', 0),
+             totals.get('rows_updated', 0), totals.get('rows_unchanged', 0))
+            for source, totals in run.get('sources', {}).items()
+        ])
+        
+        conn.commit()
+        return run_id
+    
+    def get_collector_runs(self, limit=100, collector=None):
+        """Get the most recent collector runs, newest first, with totals over all sources."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT r.*,
+               COALESCE(SUM(s.api_calls), 0) AS api_calls,
+               COALESCE(SUM(s.failures), 0) AS failures,
+               COALESCE(SUM(s.retries), 0) AS retries,
+               COALESCE(SUM(s.total_ms), 0) AS api_ms,
+               COALESCE(SUM(s.rows_inserted), 0) AS rows_inserted,
+               COALESCE(SUM(s.rows_updated), 0) AS rows_updated,
+               COALESCE(SUM(s.rows_unchanged), 0) AS rows_unchanged
+        FROM (
+            SELECT * FROM collector_runs
+            WHERE ? IS NULL OR collector = ?
+            ORDER BY started_at DESC
+            LIMIT ?
+        ) r
+        LEFT JOIN collector_run_sources s ON s.run_id = r.run_id
+        GROUP BY r.run_id
+        ORDER BY r.started_at DESC
+        ''', (collector, collector, limit))
+        
+        return cursor.fetchall()
+    
+    def get_collector_names(self):
+        """Get the names of the collectors that have recorded runs."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT collector FROM collector_runs ORDER BY collector')
+        return [row['collector'] for row in cursor.fetchall()]
+    
+    def get_collector_run_sources(self, run_ids):
+        """Get the per-source totals of the given runs."""
+        if not run_ids:
+            return []
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ', '.join('?' * len(run_ids))
+        cursor.execute(f'''
+        SELECT * FROM collector_run_sources
+        WHERE run_id IN ({placeholders})
+        ORDER BY run_id, source
+        ''', list(run_ids))
+        
+        return cursor.fetchall()
+
+    def get_data_events(self, after_id=0, limit=100):
+        """Get the recorded data changes newer than an event ID, oldest first."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT * FROM data_events
+        WHERE event_id > ?
+        ORDER BY event_id
+        LIMIT ?
+        ''', (after_id, limit))
+        return cursor.fetchall()
+    
+    def get_data_event_range(self):
+        """Get the oldest and newest recorded event IDs (None when there are none)."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT MIN(event_id), MAX(event_id) FROM data_events')
+        return tuple(cursor.fetchone())
+
+class WriterDatabase(Database):
+    """Database owned by the writer thread; commits are left to the write queue."""
+    _is_writer = True
+
+    def get_connection(self):
+        """Get the writer connection in manual transaction mode."""
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                        check_same_thread=False, factory=BatchConnection)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA busy_timeout=30000')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('PRAGMA recursive_triggers=ON')
+        return self.conn
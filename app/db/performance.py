@@ -0,0 +1,313 @@
+import math
+import datetime
+import logging
+from app.db.cache import ResultCache
+
+
+logger = logging.getLogger(__name__)
+
+ENERGY_TYPES = ('total', 'heating', 'hot_water')
+RESOLUTIONS = ('day', 'hour')
+
+# Stored bins are 1 °C wide; requests merge them into wider bins
+DEFAULT_BIN_WIDTH = 2
+MAX_BIN_WIDTH = 10
+
+# COP histogram buckets (tenths, capped at MAX_COP) give the per-bin percentiles
+COP_BUCKET_SIZE = 0.1
+MAX_COP = 10
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# Hourly curves are binned from the readings on each request
+HOURLY_MAX_DAYS = 92
+
+# Computed curves kept per (range, filters, data version)
+CACHE_SIZE = 64
+
+# Floor of the temperature (valid above -100 °C) and COP bucket, as SQL
+TEMPERATURE_BIN_SQL = "CAST(outdoor_temp + 100 AS INTEGER) - 100"
+COP_BUCKET_SQL = f"CAST(MIN(produced / consumed, {MAX_COP}) * {round(1 / COP_BUCKET_SIZE)} AS INTEGER)"
+
+# Columns of energy_data the stored bins depend on
+BIN_SOURCE_COLUMNS = ('device_id', 'date', 'outdoor_temp') + tuple(
+    f'{energy_type}_energy_{kind}' for energy_type in ENERGY_TYPES for kind in ('consumed', 'produced')
+)
+
+def _day_contributions(row, where=''):
+    """SQL of a row's (or energy_data's) per-energy-type contribution to the bins."""
+    source = '' if row in ('NEW', 'OLD') else f' FROM {row} {where}'
+    days = ' UNION ALL '.join(
+        f"SELECT {row}.device_id AS device_id, '{energy_type}' AS energy_type, {row}.date AS date, "
+        f"{row}.outdoor_temp AS outdoor_temp, {row}.{energy_type}_energy_consumed AS consumed, "
+        f"{row}.{energy_type}_energy_produced AS produced{source}"
+        for energy_type in ENERGY_TYPES
+    )
+    return f'''
+    SELECT device_id, energy_type, strftime('%Y-%m-01', date) AS month,
+           {TEMPERATURE_BIN_SQL} AS temperature_bin, {COP_BUCKET_SQL} AS cop_bucket,
+           COUNT(*) AS days, SUM(consumed) AS consumed, SUM(produced) AS produced,
+           SUM(produced / consumed) AS cop_sum, SUM(outdoor_temp) AS temperature_sum
+    FROM ({days})
+    WHERE outdoor_temp IS NOT NULL AND consumed > 0 AND produced IS NOT NULL
+    GROUP BY device_id, energy_type, month, temperature_bin, cop_bucket
+    '''
+
+def _apply_contributions(row, sign):
+    """SQL adding (sign 1) or removing (sign -1) a row's contribution to cop_bins."""
+    return f'''
+    INSERT INTO cop_bins (device_id, energy_type, month, temperature_bin, cop_bucket,
+                          days, consumed, produced, cop_sum, temperature_sum)
+    SELECT device_id, energy_type, month, temperature_bin, cop_bucket,
+           {sign} * days, {sign} * consumed, {sign} * produced, {sign} * cop_sum, {sign} * temperature_sum
+    FROM ({_day_contributions(row)})
+    WHERE true
+    ON CONFLICT(device_id, energy_type, month, temperature_bin, cop_bucket) DO UPDATE SET
+        days = days + excluded.days,
+        consumed = consumed + excluded.consumed,
+        produced = produced + excluded.produced,
+        cop_sum = cop_sum + excluded.cop_sum,
+        temperature_sum = temperature_sum + excluded.temperature_sum;
+    '''
+
+def create_cop_bins(cursor):
+    """Create cop_bins and the energy_data triggers that keep it current.
+
+    cop_bins holds, per device, energy type, month, 1 °C outdoor temperature
+    bin and COP bucket, the number of days and their energy. Every write to
+    energy_data moves only the bins of the rows it touched, whichever code
+    path made it. Fills the table from the existing rows when it is new.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cop_bins'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS cop_bins (
+        device_id INTEGER NOT NULL,
+        energy_type TEXT NOT NULL,
+        month DATE NOT NULL,
+        temperature_bin INTEGER NOT NULL,
+        cop_bucket INTEGER NOT NULL,
+        days INTEGER NOT NULL,
+        consumed REAL NOT NULL,
+        produced REAL NOT NULL,
+        cop_sum REAL NOT NULL,
+        temperature_sum REAL NOT NULL,
+        PRIMARY KEY (device_id, energy_type, month, temperature_bin, cop_bucket)
+    )
+    ''')
+
+    changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in BIN_SOURCE_COLUMNS)
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_cop_bins_insert AFTER INSERT ON energy_data
+    BEGIN
+        {_apply_contributions('NEW', 1)}
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_cop_bins_update AFTER UPDATE ON energy_data
+    WHEN {changed}
+    BEGIN
+        {_apply_contributions('OLD', -1)}
+        {_apply_contributions('NEW', 1)}
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS energy_data_cop_bins_delete AFTER DELETE ON energy_data
+    BEGIN
+        {_apply_contributions('OLD', -1)}
+    END
+    ''')
+
+    if not exists:
+        rebuild_cop_bins(cursor)
+
+def rebuild_cop_bins(cursor):
+    """Recompute cop_bins from all of energy_data."""
+    cursor.execute('DELETE FROM cop_bins')
+    cursor.execute(f'''
+    INSERT INTO cop_bins (device_id, energy_type, month, temperature_bin, cop_bucket,
+                          days, consumed, produced, cop_sum, temperature_sum)
+    SELECT device_id, energy_type, month, temperature_bin, cop_bucket,
+           days, consumed, produced, cop_sum, temperature_sum
+    FROM ({_day_contributions('energy_data')})
+    ''')
+    logger.info(f"Rebuilt {cursor.rowcount} COP bins")
+
+def _merge(bins, temperature_bin, bin_width, cop_bucket, days, consumed, produced, cop_sum, temperature_sum):
+    """Add stored or freshly computed 1 °C bin values to the requested wider bin."""
+    if days <= 0:
+        return
+    low = temperature_bin - temperature_bin % bin_width
+    entry = bins.setdefault(low, {'days': 0, 'consumed': 0.0, 'produced': 0.0,
+                                  'cop_sum': 0.0, 'temperature_sum': 0.0, 'histogram': {}})
+    entry['days'] += days
+    entry['consumed'] += consumed
+    entry['produced'] += produced
+    entry['cop_sum'] += cop_sum
+    entry['temperature_sum'] += temperature_sum
+    entry['histogram'][cop_bucket] = entry['histogram'].get(cop_bucket, 0) + days
+
+def _percentile(histogram, count, percentile):
+    """Return the COP below which percentile % of the days fall (bucket midpoint)."""
+    rank = max(math.ceil(count * percentile / 100), 1)
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return round((bucket + 0.5) * COP_BUCKET_SIZE, 2)
+    return None
+
+def _curve(bins, bin_width):
+    """Build the output rows of the merged bins, coldest first."""
+    curve = []
+    for low in sorted(bins):
+        entry = bins[low]
+        count = entry['days']
+        row = {
+            'temperature_min': low,
+            'temperature_max': low + bin_width,
+            'count': count,
+            'outdoor_temp': entry['temperature_sum'] / count,
+            'cop_mean': entry['cop_sum'] / count,
+            'cop': entry['produced'] / entry['consumed'] if entry['consumed'] else None,
+            'energy_consumed': entry['consumed'],
+            'energy_produced': entry['produced']
+        }
+        for percentile in PERCENTILES:
+            row[f'cop_p{percentile}'] = _percentile(entry['histogram'], count, percentile)
+        curve.append(row)
+    return curve
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=31)).replace(day=1)
+
+def _daily_bins(db, start_date, end_date, energy_type, device_id, bin_width):
+    """Bin the days of a range: whole months from cop_bins, the partial ones from energy_data."""
+    cursor = db.get_connection().cursor()
+    bins = {}
+    device_filter = 'AND device_id = :device_id' if device_id is not None else ''
+    params = {'energy_type': energy_type, 'device_id': device_id}
+
+    # Whole months inside the range: first_month <= month < end_month
+    first_month = _month_start(start_date) if start_date.day == 1 else _next_month(start_date)
+    end_month = _month_start(end_date + datetime.timedelta(days=1))
+    if first_month < end_month:
+        cursor.execute(f'''
+        SELECT temperature_bin, cop_bucket, SUM(days), SUM(consumed), SUM(produced),
+               SUM(cop_sum), SUM(temperature_sum)
+        FROM cop_bins
+        WHERE energy_type = :energy_type AND month >= :first_month AND month < :end_month
+              {device_filter}
+        GROUP BY temperature_bin, cop_bucket
+        ''', dict(params, first_month=first_month.isoformat(), end_month=end_month.isoformat()))
+        for row in cursor.fetchall():
+            _merge(bins, row[0], bin_width, *row[1:])
+        edges = [(start_date, first_month - datetime.timedelta(days=1)), (end_month, end_date)]
+    else:
+        edges = [(start_date, end_date)]
+
+    # Days of the months cut by the ends of the range
+    where = 'WHERE date >= :edge_start AND date <= :edge_end'
+    for edge_start, edge_end in edges:
+        if edge_start > edge_end:
+            continue
+        cursor.execute(f'''
+        SELECT temperature_bin, cop_bucket, days, consumed, produced, cop_sum, temperature_sum
+        FROM ({_day_contributions('energy_data', where)})
+        WHERE energy_type = :energy_type {device_filter}
+        ''', dict(params, edge_start=edge_start.isoformat(), edge_end=edge_end.isoformat()))
+        for row in cursor.fetchall():
+            _merge(bins, row[0], bin_width, *row[1:])
+    return bins
+
+def _hourly_bins(db, start_date, end_date, energy_type, device_id, bin_width):
+    """Bin the hours of a range from the high-frequency readings."""
+    # Imported here: readings imports the models, which create cop_bins
+    from app.db.readings import ENERGY_COLUMNS, ReadingsStore
+
+    store = ReadingsStore(db)
+    start_ts = datetime.datetime.combine(start_date, datetime.time(), store.local_timezone)
+    end_ts = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time(), store.local_timezone)
+
+    series_list = store.get_series()
+    temperatures = store.outdoor_temperatures(start_ts, end_ts, 'hour', series_list)
+    energy = {}
+    for series in series_list:
+        column = series['rollup_column']
+        if device_id is not None and series['device_id'] != device_id:
+            continue
+        if column in ENERGY_COLUMNS:
+            kind, metric = ENERGY_COLUMNS[column].rsplit('_', 1)
+            if energy_type != 'total' and kind != energy_type:
+                continue
+            for hour, value in store.resample(series['series_id'], start_ts, end_ts, 'hour', series['agg']):
+                values = energy.setdefault((series['device_id'], hour), {'consumed': 0.0, 'produced': 0.0})
+                values[metric] += value
+
+    bins = {}
+    for (_, hour), values in energy.items():
+        outdoor_temp = temperatures.get(hour)
+        consumed, produced = values['consumed'], values['produced']
+        if outdoor_temp is None or consumed <= 0:
+            continue
+        cop = produced / consumed
+        _merge(bins, math.floor(outdoor_temp), bin_width, int(min(cop, MAX_COP) / COP_BUCKET_SIZE),
+               1, consumed, produced, cop, outdoor_temp)
+    return bins
+
+_cache = ResultCache(CACHE_SIZE)
+
+def cop_curve(db, start_date, end_date, energy_type='total', device_id=None, bin_width=DEFAULT_BIN_WIDTH,
+              resolution='day'):
+    """Return the COP of a date range as a function of the outdoor temperature.
+
+    Days (or, with resolution='hour', hours of the readings) are binned by
+    outdoor temperature into bin_width °C bins. Daily curves add up the
+    cop_bins rows of the whole months in the range, maintained by triggers as
+    data arrives, plus the days of the partial months at its ends. Results
+    are cached per range, filters and change watermark, so a repeated request
+    costs one lookup until the data changes.
+
+    Returns:
+        Dictionary with the request and 'bins': per bin temperature_min,
+        temperature_max, count, mean outdoor_temp, cop_mean (mean of the
+        daily COPs), cop (produced over consumed), cop_p10..cop_p90 and
+        energy_consumed/energy_produced, coldest first
+    """
+    if energy_type not in ENERGY_TYPES:
+        raise ValueError(f"Unknown energy type: {energy_type}")
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    if not isinstance(bin_width, int) or not 1 <= bin_width <= MAX_BIN_WIDTH:
+        raise ValueError(f"The bin width must be a whole number of degrees from 1 to {MAX_BIN_WIDTH}")
+    if start_date > end_date:
+        raise ValueError("The range ends before it starts")
+    if resolution == 'hour' and (end_date - start_date).days >= HOURLY_MAX_DAYS:
+        raise ValueError(f"Hourly curves cover at most {HOURLY_MAX_DAYS} days")
+
+    # Hourly readings are not change-tracked, so only daily curves are cached
+    key = None
+    if resolution == 'day':
+        key = (db.db_path, start_date, end_date, energy_type, device_id, bin_width, db.get_change_watermark())
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    build = _daily_bins if resolution == 'day' else _hourly_bins
+    bins = build(db, start_date, end_date, energy_type, device_id, bin_width)
+    result = {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'energy_type': energy_type,
+        'device_id': device_id,
+        'bin_width': bin_width,
+        'resolution': resolution,
+        'bins': _curve(bins, bin_width)
+    }
+
+    if key is not None:
+        _cache.put(key, result)
+    return result
@@ -0,0 +1,31 @@
+import bisect
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+class PriceResolver:
+    """Monthly prices loaded with one query and resolved in memory.
+
+    for_month() returns the same row as Database.get_prices_for_month: the
+    month's prices, else the most recent earlier month, else the latest month
+    on record. Build one per request or job instead of querying per row.
+    """
+
+    def __init__(self, db):
+        """Load every price row of the database."""
+        cursor = db.get_connection().cursor()
+        cursor.execute('SELECT * FROM prices ORDER BY year, month')
+        self.rows = cursor.fetchall()
+        self._keys = [row['year'] * 12 + row['month'] - 1 for row in self.rows]
+
+    def for_month(self, year, month):
+        """Return the price row that applies to a month, or None if there are no prices."""
+        if not self.rows:
+            return None
+        i = bisect.bisect_right(self._keys, year * 12 + month - 1) - 1
+        return self.rows[i] if i >= 0 else self.rows[-1]
+
+    def for_date(self, date):
+        """Return the price row that applies to a date."""
+        return self.for_month(date.year, date.month)
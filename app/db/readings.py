@@ -0,0 +1,371 @@
+import datetime
+import logging
+from zoneinfo import ZoneInfo
+from app.config import config
+from app.db.models import Database
+from app.db.prices import PriceResolver
+
+
+logger = logging.getLogger(__name__)
+
+# Daily energy_data columns a series can be rolled up into
+ENERGY_COLUMNS = {
+    'heating_energy_consumed': 'heating_consumed',
+    'hot_water_energy_consumed': 'hot_water_consumed',
+    'heating_energy_produced': 'heating_produced',
+    'hot_water_energy_produced': 'hot_water_produced'
+}
+ROLLUP_COLUMNS = set(ENERGY_COLUMNS) | {'outdoor_temp'}
+
+AGGREGATIONS = ('sum', 'mean', 'min', 'max', 'last')
+
+# Series that may all feed outdoor_temp, most trusted first: the Home Assistant
+# daily mean sensor, then the mean of the live samples. Others follow in
+# registration order.
+OUTDOOR_TEMP_PRECEDENCE = (
+    'homeassistant:sensor.temperatura_esterna_media',
+    'homeassistant:sensor.outdoor_temperature'
+)
+
+class ReadingsStore:
+    """High-frequency readings partitioned into one table per month.
+
+    Each partition ``readings_YYYYMM`` is a WITHOUT ROWID table clustered on
+    (series_id, ts), so appends for a series land at the end of its key range
+    and a time range query reads one contiguous slice of each partition it
+    touches. Timestamps are stored as UTC epoch seconds and partitioned by UTC
+    month; days are grouped in LOCAL_TIMEZONE.
+
+    Every series may name the energy_data column it rolls up into, which makes
+    the daily table a derived view of the readings (see rollup_daily).
+    """
+
+    def __init__(self, db=None, local_timezone=None):
+        """Initialize the store on the application database."""
+        self.db = db if db else Database()
+
+        if local_timezone is None:
+            local_timezone = ZoneInfo(config.get('LOCAL_TIMEZONE', 'Europe/Rome'))
+        self.local_timezone = local_timezone
+
+        self._partitions = set()
+        self._series_cache = {}
+        self.create_tables()
+
+    def create_tables(self):
+        """Create the series catalog and load the list of existing partitions."""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS series (
+            series_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            device_id INTEGER NOT NULL DEFAULT 0,
+            unit TEXT,
+            agg TEXT NOT NULL DEFAULT 'mean',
+            rollup_column TEXT,
+            UNIQUE(name, device_id)
+        )
+        ''')
+        conn.commit()
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'readings_[0-9]*'")
+        self._partitions = {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def _partition_name(ts):
+        """Return the partition table holding a UTC epoch timestamp."""
+        moment = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+        return f"readings_{moment.year:04d}{moment.month:02d}"
+
+    def _ensure_partition(self, cursor, name):
+        """Create a monthly partition on first use."""
+        if name in self._partitions:
+            return
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            series_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL,
+            PRIMARY KEY (series_id, ts)
+        ) WITHOUT ROWID
+        ''')
+        self._partitions.add(name)
+
+    def _partitions_between(self, start_ts, end_ts):
+        """Existing partitions overlapping [start_ts, end_ts), oldest first."""
+        first = datetime.datetime.fromtimestamp(start_ts, datetime.timezone.utc)
+        last = datetime.datetime.fromtimestamp(max(start_ts, end_ts - 1), datetime.timezone.utc)
+
+        names = []
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            name = f"readings_{year:04d}{month:02d}"
+            if name in self._partitions:
+                names.append(name)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return names
+
+    def to_timestamp(self, value):
+        """Convert a datetime, date or epoch number to UTC epoch seconds.
+
+        Naive datetimes and dates are taken to be in the local timezone.
+        """
+        if isinstance(value, (int, float)):
+            return int(value)
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time.min)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=self.local_timezone)
+        return int(value.timestamp())
+
+    def _day_bounds(self, start_date, end_date):
+        """UTC epoch range covering whole local days from start_date to end_date inclusive."""
+        return self.to_timestamp(start_date), self.to_timestamp(end_date + datetime.timedelta(days=1))
+
+    def get_series_id(self, name, device_id=0, unit=None, agg='mean', rollup_column=None):
+        """Return the ID of a series, registering it on first use.
+
+        Args:
+            name: Series name, e.g. 'homeassistant:sensor.outdoor_temperature'
+            device_id: Heat pump unit the series belongs to (0 if none)
+            unit: Unit of the values ('kWh', '°C', ...)
+            agg: How readings combine into a day: sum, mean, min, max or last
+            rollup_column: energy_data column fed by rollup_daily(), if any
+        """
+        key = (name, device_id or 0)
+        if key in self._series_cache:
+            return self._series_cache[key]
+
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation: {agg}")
+        if rollup_column is not None and rollup_column not in ROLLUP_COLUMNS:
+            raise ValueError(f"Cannot roll up into column: {rollup_column}")
+
+        def register(db):
+            conn = db.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+            INSERT OR IGNORE INTO series (name, device_id, unit, agg, rollup_column)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (name, device_id or 0, unit, agg, rollup_column))
+            conn.commit()
+
+            cursor.execute('SELECT series_id FROM series WHERE name = ? AND device_id = ?', key)
+            return cursor.fetchone()[0]
+
+        series_id = self.db.run_write(register)
+        self._series_cache[key] = series_id
+        return series_id
+
+    def get_series(self, device_id=None):
+        """List registered series, optionally for one device."""
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        if device_id is None:
+            cursor.execute('SELECT * FROM series ORDER BY device_id, name')
+        else:
+            cursor.execute('SELECT * FROM series WHERE device_id = ? ORDER BY name', (device_id,))
+        return cursor.fetchall()
+
+    def append(self, series_id, readings):
+        """Append readings to a series in a single transaction.
+
+        Args:
+            series_id: ID returned by get_series_id()
+            readings: Iterable of (timestamp, value) pairs; a reading at an
+                existing timestamp replaces the stored value
+
+        Returns:
+            Number of readings written
+        """
+        by_partition = {}
+        for ts, value in readings:
+            ts = self.to_timestamp(ts)
+            by_partition.setdefault(self._partition_name(ts), []).append((series_id, ts, value))
+
+        if not by_partition:
+            return 0
+
+        def write(db):
+            conn = db.get_connection()
+            cursor = conn.cursor()
+            written = 0
+            for name in sorted(by_partition):
+                self._ensure_partition(cursor, name)
+                rows = sorted(by_partition[name], key=lambda row: row[1])
+                cursor.executemany(f'INSERT OR REPLACE INTO {name} (series_id, ts, value) VALUES (?, ?, ?)', rows)
+                written += len(rows)
+            conn.commit()
+            return written
+
+        try:
+            return self.db.run_write(write)
+        except Exception as e:
+            # Partitions created in the failed transaction are gone again
+            self._partitions -= set(by_partition)
+            logger.error(f"Error appending readings to series {series_id}: {str(e)}")
+            return 0
+
+    def bulk_insert(self, cursor, rows):
+        """Insert (series_id, ts, value) rows with an existing cursor.
+
+        For bulk loaders that manage their own transaction; ts must already be
+        UTC epoch seconds. The caller commits.
+
+        Returns:
+            Number of rows inserted
+        """
+        by_partition = {}
+        for row in rows:
+            by_partition.setdefault(self._partition_name(row[1]), []).append(row)
+
+        for name in sorted(by_partition):
+            self._ensure_partition(cursor, name)
+            cursor.executemany(f'INSERT OR REPLACE INTO {name} (series_id, ts, value) VALUES (?, ?, ?)',
+                               by_partition[name])
+        return sum(len(partition) for partition in by_partition.values())
+
+    def query(self, series_id, start, end):
+        """Get the (ts, value) readings of a series in [start, end), oldest first.
+
+        Only the monthly partitions overlapping the range are read.
+        """
+        start_ts, end_ts = self.to_timestamp(start), self.to_timestamp(end)
+        partitions = self._partitions_between(start_ts, end_ts)
+        if not partitions:
+            return []
+
+        selects = ' UNION ALL '.join(
+            f'SELECT ts, value FROM {name} WHERE series_id = ? AND ts >= ? AND ts < ?' for name in partitions
+        )
+        params = [series_id, start_ts, end_ts] * len(partitions)
+
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'{selects} ORDER BY ts', params)
+        return cursor.fetchall()
+
+    def resample(self, series_id, start, end, interval='day', agg='mean'):
+        """Aggregate a series into local hours or days.
+
+        Returns:
+            List of (local datetime or date, value) tuples in time order
+        """
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation: {agg}")
+
+        buckets = {}
+        for ts, value in self.query(series_id, start, end):
+            if value is None:
+                continue
+            moment = datetime.datetime.fromtimestamp(ts, self.local_timezone)
+            key = moment.date() if interval == 'day' else moment.replace(minute=0, second=0, microsecond=0)
+            buckets.setdefault(key, []).append(value)
+
+        result = []
+        for key in sorted(buckets):
+            values = buckets[key]
+            if agg == 'sum':
+                value = sum(values)
+            elif agg == 'mean':
+                value = sum(values) / len(values)
+            elif agg == 'min':
+                value = min(values)
+            elif agg == 'max':
+                value = max(values)
+            else:
+                value = values[-1]
+            result.append((key, value))
+        return result
+
+    def outdoor_temperatures(self, start, end, interval='day', series=None):
+        """Return {local day or hour: outdoor temperature} from the outdoor_temp series.
+
+        When several series have a value for the same day or hour, the one
+        earliest in OUTDOOR_TEMP_PRECEDENCE wins and the differing values it
+        replaces are logged.
+        """
+        if series is None:
+            series = self.get_series()
+
+        def precedence(row):
+            if row['name'] in OUTDOOR_TEMP_PRECEDENCE:
+                return OUTDOOR_TEMP_PRECEDENCE.index(row['name']), row['series_id']
+            return len(OUTDOOR_TEMP_PRECEDENCE), row['series_id']
+
+        temperatures = {}
+        sources = {}
+        ignored = {}
+        for row in sorted((row for row in series if row['rollup_column'] == 'outdoor_temp'), key=precedence):
+            for key, value in self.resample(row['series_id'], start, end, interval, row['agg']):
+                if key not in temperatures:
+                    temperatures[key] = value
+                    sources[key] = row['name']
+                elif value != temperatures[key]:
+                    pair = (row['name'], sources[key])
+                    ignored[pair] = ignored.get(pair, 0) + 1
+
+        for (name, source), count in ignored.items():
+            logger.warning(f"Ignored {count} outdoor temperatures of {name} that differ from those of {source}")
+        return temperatures
+
+    def rollup_daily(self, start_date, end_date, device_id=None):
+        """Rebuild daily energy_data rows from the readings of every rollup series.
+
+        Energy series are summed per local day and upserted together with the
+        derived COP and cost; outdoor temperature series update outdoor_temp
+        (see outdoor_temperatures for days with several).
+
+        Returns:
+            Dictionary with the number of (device, date) energy rows written
+            ('energy_rows') and the temperature days inserted, updated and
+            unchanged ('temperature_days')
+        """
+        start_ts, end_ts = self._day_bounds(start_date, end_date)
+
+        series_list = self.get_series(device_id)
+        temperatures = self.outdoor_temperatures(start_ts, end_ts, 'day', series_list)
+
+        energy = {}
+        for series in series_list:
+            column = series['rollup_column']
+            if column not in ENERGY_COLUMNS:
+                continue
+
+            for day, value in self.resample(series['series_id'], start_ts, end_ts, 'day', series['agg']):
+                values = energy.setdefault((series['device_id'], day), {})
+                values[ENERGY_COLUMNS[column]] = values.get(ENERGY_COLUMNS[column], 0) + value
+
+        prices = PriceResolver(self.db)
+        month_prices = {}
+        records = []
+        for (series_device_id, day), values in sorted(energy.items()):
+            key = (day.year, day.month)
+            if key not in month_prices:
+                price_data = prices.for_month(day.year, day.month)
+                month_prices[key] = price_data['electricity_price'] if price_data else 0.28
+
+            consumed = values.get('heating_consumed', 0) + values.get('hot_water_consumed', 0)
+            produced = values.get('heating_produced', 0) + values.get('hot_water_produced', 0)
+            record = dict(values)
+            record['date'] = day.isoformat()
+            record['device_id'] = series_device_id
+            record['cop'] = produced / consumed if consumed > 0 else 0
+            record['cost'] = consumed * month_prices[key]
+            records.append(record)
+
+        written = self.db.bulk_upsert_energy_data(records) if records else 0
+
+        temperature_days = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for day, value in sorted(temperatures.items()):
+            outcome = self.db.add_temperature_data(day, value)
+            if outcome:
+                temperature_days[outcome] += 1
+
+        logger.info(f"Rolled up {written} energy rows and {len(temperatures)} temperature days "
+                    f"from readings for {start_date} to {end_date}")
+        return {'energy_rows': written, 'temperature_days': temperature_days}
@@ -0,0 +1,231 @@
+import math
+import random
+import logging
+import operator
+from app.db.fuels import FUELS
+from app.db.prices import PriceResolver
+
+
+logger = logging.getLogger(__name__)
+
+ENERGY_TYPES = ('total', 'heating', 'hot_water')
+
+# Monthly prices a scenario sets; the ones it leaves out keep the recorded prices
+PRICE_FIELDS = ('electricity_price', 'diesel_price', 'diesel_efficiency')
+
+DIESEL = FUELS['diesel']
+
+# Options of monte_carlo_paths a request may set besides the count
+MONTE_CARLO_FIELDS = ('seed', 'electricity_volatility', 'diesel_volatility', 'drift', 'correlation')
+
+MAX_SCENARIOS = 10000
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+def monthly_energy(db, start_date, end_date, energy_type='total', device_id=None):
+    """Return the months of a range with their consumed and produced kWh.
+
+    Costs are linear in the monthly prices, so these sums are all a
+    scenario needs: the range is read once, whatever the scenario count.
+    """
+    if energy_type not in ENERGY_TYPES:
+        raise ValueError(f"Unknown energy type: {energy_type}")
+    device_filter = 'AND device_id = ?' if device_id is not None else ''
+    cursor = db.get_connection().cursor()
+    cursor.execute(f'''
+    SELECT CAST(strftime('%Y', date) AS INTEGER), CAST(strftime('%m', date) AS INTEGER),
+           COALESCE(SUM({energy_type}_energy_consumed), 0), COALESCE(SUM({energy_type}_energy_produced), 0)
+    FROM energy_data
+    WHERE date >= ? AND date <= ? {device_filter}
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ''', (start_date.isoformat(), end_date.isoformat()) + ((device_id,) if device_id is not None else ()))
+    rows = cursor.fetchall()
+    return [(row[0], row[1]) for row in rows], [row[2] for row in rows], [row[3] for row in rows]
+
+def recorded_prices(db, months):
+    """Return the recorded price of each month, per price field."""
+    resolver = PriceResolver(db)
+    # Prices of months with nothing on record, as on the cost pages
+    defaults = {
+        'electricity_price': FUELS['electric'].default_price(),
+        'diesel_price': DIESEL.default_price(),
+        'diesel_efficiency': DIESEL.default_efficiency()
+    }
+    prices = {field: [] for field in PRICE_FIELDS}
+    for year, month in months:
+        price_data = resolver.for_month(year, month)
+        for field in PRICE_FIELDS:
+            prices[field].append(price_data[field] if price_data else defaults[field])
+    return prices
+
+def _month_values(name, field, value, months, recorded):
+    """Expand a scenario's value of one price field into one price per month.
+
+    The value is a number for every month, a list with one entry per month,
+    or an object of 'YYYY-MM' keys; missing or null months keep the
+    recorded price.
+    """
+    if value is None:
+        return list(recorded)
+    if isinstance(value, (int, float)):
+        return [float(value)] * len(months)
+    if isinstance(value, list):
+        if len(value) != len(months):
+            raise ValueError(f"Scenario {name}: {field} has {len(value)} prices for {len(months)} months")
+        return [recorded[i] if price is None else float(price) for i, price in enumerate(value)]
+    if isinstance(value, dict):
+        keys = [f"{year:04d}-{month:02d}" for year, month in months]
+        unknown = [key for key in value if key not in keys]
+        if unknown:
+            raise ValueError(f"Scenario {name}: {field} has prices for months outside the range: {', '.join(unknown)}")
+        return [recorded[i] if value.get(key) is None else float(value[key]) for i, key in enumerate(keys)]
+    raise ValueError(f"Scenario {name}: {field} must be a number, a list or an object of monthly prices")
+
+def monte_carlo_paths(recorded, count, seed=None, electricity_volatility=0.05, diesel_volatility=0.05,
+                      drift=0.0, correlation=0.0):
+    """Generate price paths as geometric random walks around the recorded prices.
+
+    Each month moves the electricity and diesel prices by a lognormal factor
+    with the given monthly volatility and drift; correlation links the two
+    shocks. Diesel efficiency keeps its recorded value.
+    """
+    if not -1 <= correlation <= 1:
+        raise ValueError("The correlation must be between -1 and 1")
+    if electricity_volatility < 0 or diesel_volatility < 0:
+        raise ValueError("Volatilities cannot be negative")
+
+    rng = random.Random(seed)
+    independent = math.sqrt(1 - correlation * correlation)
+    electricity_step = drift - electricity_volatility ** 2 / 2
+    diesel_step = drift - diesel_volatility ** 2 / 2
+    months = len(recorded['electricity_price'])
+
+    paths = []
+    for i in range(count):
+        electricity, diesel = [], []
+        electricity_shock = diesel_shock = 0.0
+        for m in range(months):
+            z = rng.gauss(0, 1)
+            electricity_shock += electricity_step + electricity_volatility * z
+            diesel_shock += diesel_step + diesel_volatility * (correlation * z + independent * rng.gauss(0, 1))
+            electricity.append(recorded['electricity_price'][m] * math.exp(electricity_shock))
+            diesel.append(recorded['diesel_price'][m] * math.exp(diesel_shock))
+        paths.append({
+            'name': f'monte_carlo_{i + 1}',
+            'electricity_price': electricity,
+            'diesel_price': diesel,
+            'diesel_efficiency': list(recorded['diesel_efficiency'])
+        })
+    return paths
+
+def _percentile(ordered, percentile):
+    """Linearly interpolated percentile of sorted values."""
+    position = (len(ordered) - 1) * percentile / 100
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def _distribution(values, percentiles):
+    """Summarize the values of one metric over the scenarios."""
+    ordered = sorted(values)
+    mean = sum(ordered) / len(ordered)
+    summary = {
+        'mean': mean,
+        'std': math.sqrt(sum((value - mean) ** 2 for value in ordered) / len(ordered)),
+        'min': ordered[0],
+        'max': ordered[-1]
+    }
+    for percentile in percentiles:
+        summary[f'p{percentile:g}'] = _percentile(ordered, percentile)
+    return summary
+
+def simulate(db, start_date, end_date, scenarios=None, monte_carlo=None, energy_type='total', device_id=None,
+             percentiles=DEFAULT_PERCENTILES):
+    """Evaluate the heat pump and diesel cost of a range under many monthly price scenarios.
+
+    Nothing is written: the consumed and produced kWh of each month are read
+    once, and the cost of every scenario is the dot product of those sums
+    with its monthly prices (diesel cost as in the diesel Fuel of
+    app/db/fuels.py).
+
+    Args:
+        scenarios: List of {'name', 'electricity_price', 'diesel_price',
+            'diesel_efficiency'}, each price a number, a list with one price
+            per month of the range or an object of 'YYYY-MM' prices
+        monte_carlo: Optional {'count', 'seed', 'electricity_volatility',
+            'diesel_volatility', 'drift', 'correlation'} adding generated
+            paths (see monte_carlo_paths)
+        percentiles: Percentiles of the distributions
+
+    Returns:
+        Dictionary with the months and their energy, the cost at the
+        recorded prices, the cost of each named scenario, and the
+        distribution (mean, std, min, max, percentiles) of the heat pump
+        cost, diesel cost and savings over all scenarios, including
+        generated ones
+    """
+    if start_date > end_date:
+        raise ValueError("The range ends before it starts")
+    if any(not 0 <= percentile <= 100 for percentile in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    scenarios = list(scenarios or [])
+    monte_carlo = dict(monte_carlo or {})
+    count = int(monte_carlo.pop('count', 0))
+    unknown = [key for key in monte_carlo if key not in MONTE_CARLO_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown Monte Carlo fields: {', '.join(unknown)}")
+    if count < 0 or len(scenarios) + count > MAX_SCENARIOS:
+        raise ValueError(f"At most {MAX_SCENARIOS} scenarios per simulation")
+    if not scenarios and not count:
+        raise ValueError("Give at least one scenario or a Monte Carlo count")
+
+    months, consumed, produced = monthly_energy(db, start_date, end_date, energy_type, device_id)
+    recorded = recorded_prices(db, months)
+
+    named = []
+    for i, scenario in enumerate(scenarios):
+        if not isinstance(scenario, dict):
+            raise ValueError("Each scenario must be an object")
+        name = str(scenario.get('name') or f'scenario_{i + 1}')
+        unknown = [key for key in scenario if key != 'name' and key not in PRICE_FIELDS]
+        if unknown:
+            raise ValueError(f"Scenario {name}: unknown fields {', '.join(unknown)}")
+        row = {'name': name}
+        for field in PRICE_FIELDS:
+            row[field] = _month_values(name, field, scenario.get(field), months, recorded[field])
+        if any(efficiency <= 0 for efficiency in row['diesel_efficiency']):
+            raise ValueError(f"Scenario {name}: diesel efficiency must be positive")
+        named.append(row)
+    generated = monte_carlo_paths(recorded, count, **monte_carlo) if count else []
+
+    def evaluate(row):
+        heat_pump = sum(map(operator.mul, consumed, row['electricity_price']))
+        diesel = sum(map(DIESEL.cost, produced, row['diesel_price'], row['diesel_efficiency']))
+        return heat_pump, diesel
+
+    costs = [evaluate(row) for row in named + generated]
+    baseline = evaluate(dict(recorded, name='recorded'))
+
+    def result(name, heat_pump, diesel):
+        return {'name': name, 'heat_pump_cost': heat_pump, 'diesel_cost': diesel, 'savings': diesel - heat_pump}
+
+    savings = [diesel - heat_pump for heat_pump, diesel in costs]
+    logger.info(f"Simulated {len(costs)} price scenarios over {len(months)} months")
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'energy_type': energy_type,
+        'device_id': device_id,
+        'months': [f"{year:04d}-{month:02d}" for year, month in months],
+        'energy_consumed': consumed,
+        'energy_produced': produced,
+        'recorded': result('recorded', *baseline),
+        'scenarios': [result(row['name'], *cost) for row, cost in zip(named, costs)],
+        'scenario_count': len(costs),
+        'distribution': {
+            'heat_pump_cost': _distribution([cost[0] for cost in costs], percentiles),
+            'diesel_cost': _distribution([cost[1] for cost in costs], percentiles),
+            'savings': _distribution(savings, percentiles),
+            'savings_probability': sum(1 for value in savings if value > 0) / len(savings)
+        }
+    }
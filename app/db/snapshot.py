@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import mmap
+import zlib
+import array
+import bisect
+import struct
+import datetime
+import logging
+from app.db.degree_days import get_base_temperature, rebuild_degree_days
+from app.db.fuels import FUELS
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EISNAP\x00\x01'
+FORMAT_VERSION = 1
+# Column blocks start on 8-byte boundaries so they can be cast in place
+ALIGNMENT = 8
+
+# Column type -> array typecode. 'date' holds date.toordinal() values and
+# 'dict' holds indexes into the column's list of distinct strings (-1 is NULL).
+TYPECODES = {'f8': 'd', 'i8': 'q', 'date': 'i', 'dict': 'i'}
+
+ENERGY_COLUMNS = [
+    ('date', 'date'),
+    ('device_id', 'i8'),
+    ('device_name', 'dict'),
+    ('heating_energy_consumed', 'f8'),
+    ('hot_water_energy_consumed', 'f8'),
+    ('total_energy_consumed', 'f8'),
+    ('heating_energy_produced', 'f8'),
+    ('hot_water_energy_produced', 'f8'),
+    ('total_energy_produced', 'f8'),
+    ('cop', 'f8'),
+    ('power_consumption', 'f8'),
+    ('cost', 'f8'),
+    ('operation_mode', 'dict'),
+    ('demand_percentage', 'i8'),
+    ('outdoor_temp', 'f8')
+]
+
+PRICE_COLUMNS = [
+    ('year', 'i8'),
+    ('month', 'i8'),
+    ('electricity_price', 'f8'),
+    ('diesel_price', 'f8'),
+    ('diesel_efficiency', 'f8')
+]
+
+TABLES = {
+    'energy_data': (ENERGY_COLUMNS, 'date, device_id'),
+    'prices': (PRICE_COLUMNS, 'year, month')
+}
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _encode_column(kind, values):
+    """Return (typed array, null mask or None, distinct values or None) for a column."""
+    nulls = None
+    distinct = None
+
+    if kind == 'f8':
+        # NULL is stored as NaN
+        data = array.array('d', (float('nan') if value is None else value for value in values))
+    elif kind == 'i8':
+        data = array.array('q', (0 if value is None else value for value in values))
+        if any(value is None for value in values):
+            nulls = bytes(value is None for value in values)
+    elif kind == 'date':
+        data = array.array('i', (datetime.date.fromisoformat(str(value)[:10]).toordinal() for value in values))
+    else:
+        distinct = sorted({value for value in values if value is not None})
+        codes = {value: i for i, value in enumerate(distinct)}
+        data = array.array('i', (-1 if value is None else codes[value] for value in values))
+
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data, nulls, distinct
+
+def write_snapshot(db, path, compress=False, start_date=None, end_date=None):
+    """Write energy_data and prices from the database to a snapshot file.
+
+    Each column is stored as one typed little-endian array. With compress,
+    every column block is zlib-compressed: smaller, but read by decompressing
+    instead of mapping the file.
+
+    Returns:
+        The header written to the file
+    """
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    header = {
+        'version': FORMAT_VERSION,
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'tables': {}
+    }
+    blocks = []
+    offset = 0
+
+    for table, (columns, order) in TABLES.items():
+        conditions, params = [], []
+        if table == 'energy_data':
+            if start_date is not None:
+                conditions.append('date >= ?')
+                params.append(start_date)
+            if end_date is not None:
+                conditions.append('date <= ?')
+                params.append(end_date)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        names = [name for name, _ in columns]
+        cursor.execute(f"SELECT {', '.join(names)} FROM {table} {where} ORDER BY {order}", params)
+        rows = cursor.fetchall()
+
+        table_header = {'rows': len(rows), 'columns': {}}
+        for index, (name, kind) in enumerate(columns):
+            data, nulls, distinct = _encode_column(kind, [row[index] for row in rows])
+            column_header = {'type': kind}
+            if distinct is not None:
+                column_header['values'] = distinct
+
+            for key, payload in (('data', data.tobytes()), ('nulls', nulls)):
+                if payload is None:
+                    continue
+                stored = zlib.compress(payload) if compress else payload
+                column_header[key] = {'offset': offset, 'size': len(stored), 'raw_size': len(payload)}
+                blocks.append((offset, stored))
+                offset = _align(offset + len(stored))
+
+            table_header['columns'][name] = column_header
+        header['tables'][table] = table_header
+
+    header['compression'] = 'zlib' if compress else None
+    encoded = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 4 + len(encoded))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(encoded)))
+        f.write(encoded)
+        for block_offset, stored in blocks:
+            f.write(b'\0' * (data_start + block_offset - f.tell()))
+            f.write(stored)
+    os.replace(tmp_path, path)
+
+    logger.info(f"Wrote snapshot {path}: {header['tables']['energy_data']['rows']} energy rows, "
+                f"{header['tables']['prices']['rows']} prices, {os.path.getsize(path)} bytes")
+    return header
+
+class Snapshot:
+    """Read-only view of a snapshot file.
+
+    Uncompressed columns are typed memoryviews straight over the memory-mapped
+    file, so opening a snapshot reads only its header and columns are paged in
+    as they are used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an energy snapshot")
+        header_length, = struct.unpack_from('<I', self._map, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        self.header = json.loads(self._map[header_start:header_start + header_length])
+        if self.header['version'] > FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Snapshot version {self.header['version']} is newer than supported")
+
+        self._data_start = _align(header_start + header_length)
+        self._columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Release the mapping (columns read from it can no longer be used)."""
+        self._columns.clear()
+        try:
+            self._map.close()
+        except BufferError:
+            # Columns still referenced elsewhere; the mapping goes with them
+            pass
+        self._file.close()
+
+    def rows(self, table):
+        """Number of rows of a table."""
+        return self.header['tables'][table]['rows']
+
+    def _block(self, block):
+        start = self._data_start + block['offset']
+        if self.header.get('compression') == 'zlib':
+            return memoryview(zlib.decompress(self._map[start:start + block['size']]))
+        return memoryview(self._map)[start:start + block['size']]
+
+    def column(self, table, name):
+        """Return a column as a typed sequence (float, int, date ordinal or string code)."""
+        key = (table, name)
+        if key not in self._columns:
+            column_header = self.header['tables'][table]['columns'][name]
+            typecode = TYPECODES[column_header['type']]
+            if sys.byteorder == 'little':
+                values = self._block(column_header['data']).cast(typecode)
+            else:
+                values = array.array(typecode, self._block(column_header['data']).tobytes())
+                values.byteswap()
+            self._columns[key] = values
+        return self._columns[key]
+
+    def values(self, table, name):
+        """Return a column as a list of Python values, with None for NULL."""
+        column_header = self.header['tables'][table]['columns'][name]
+        kind = column_header['type']
+        data = self.column(table, name)
+
+        if kind == 'f8':
+            return [None if value != value else value for value in data]
+        if kind == 'date':
+            return [datetime.date.fromordinal(value) for value in data]
+        if kind == 'dict':
+            distinct = column_header['values']
+            return [None if code < 0 else distinct[code] for code in data]
+        if 'nulls' in column_header:
+            nulls = self._block(column_header['nulls'])
+            return [None if null else value for value, null in zip(data, nulls)]
+        return list(data)
+
+    def energy_rows(self, energy_type='total', device_id=None):
+        """Return energy rows in the layout of Database.get_energy_data.
+
+        Rows are [date, consumed, produced, cop, power_consumption, cost,
+        operation_mode], summed over all devices per date unless a device is
+        given, ready for the dashboard's aggregate_data.
+        """
+        prefix = energy_type if energy_type in ('heating', 'hot_water') else 'total'
+        dates = self.column('energy_data', 'date')
+        devices = self.column('energy_data', 'device_id')
+        consumed = self.column('energy_data', f'{prefix}_energy_consumed')
+        produced = self.column('energy_data', f'{prefix}_energy_produced')
+        total_consumed = self.column('energy_data', 'total_energy_consumed')
+        total_produced = self.column('energy_data', 'total_energy_produced')
+        cops = self.column('energy_data', 'cop')
+        power = self.column('energy_data', 'power_consumption')
+        costs = self.column('energy_data', 'cost')
+        modes = self.values('energy_data', 'operation_mode')
+
+        def add(a, b):
+            # SUM() semantics: NULLs are skipped, all-NULL stays NULL
+            if b != b:
+                return a
+            return b if a is None else a + b
+
+        result = []
+        current = None
+        for i in range(len(dates)):
+            if device_id is not None and devices[i] != device_id:
+                continue
+            if current is None or current[0] != dates[i]:
+                if current is not None:
+                    result.append(self._finish_day(current))
+                # ordinal, consumed, produced, cops, power, cost, mode, total consumed, total produced
+                current = [dates[i], None, None, [], None, None, None, None, None]
+            current[1] = add(current[1], consumed[i])
+            current[2] = add(current[2], produced[i])
+            if cops[i] == cops[i]:
+                current[3].append(cops[i])
+            current[4] = add(current[4], power[i])
+            current[5] = add(current[5], costs[i])
+            if modes[i] is not None and (current[6] is None or modes[i] > current[6]):
+                current[6] = modes[i]
+            current[7] = add(current[7], total_consumed[i])
+            current[8] = add(current[8], total_produced[i])
+        if current is not None:
+            result.append(self._finish_day(current))
+        return result
+
+    @staticmethod
+    def _finish_day(day):
+        """Turn an accumulated day into a get_energy_data row (same COP rule)."""
+        ordinal, consumed, produced, cops, power, cost, mode, total_consumed, total_produced = day
+        if len(cops) <= 1:
+            cop = cops[0] if cops else None
+        elif total_consumed:
+            cop = total_produced / total_consumed
+        else:
+            cop = sum(cops) / len(cops)
+        return [datetime.date.fromordinal(ordinal), consumed, produced, cop, power, cost, mode]
+
+    def price_lookup(self):
+        """Return a function (year, month) -> (electricity, diesel, efficiency) or None.
+
+        Missing months fall back like Database.get_prices_for_month: the most
+        recent earlier month, else the latest month on record.
+        """
+        years = self.column('prices', 'year')
+        months = self.column('prices', 'month')
+        electricity = self.column('prices', 'electricity_price')
+        diesel = self.column('prices', 'diesel_price')
+        efficiency = self.column('prices', 'diesel_efficiency')
+        keys = [year * 12 + month - 1 for year, month in zip(years, months)]
+
+        def lookup(year, month):
+            if not keys:
+                return None
+            i = bisect.bisect_right(keys, year * 12 + month - 1) - 1
+            if i < 0:
+                i = len(keys) - 1
+            return electricity[i], diesel[i], efficiency[i]
+
+        return lookup
+
+    def diesel_cost(self, start_date, end_date, device_id=None):
+        """Hypothetical diesel cost of the energy produced, as Database.calculate_diesel_cost."""
+        dates = self.column('energy_data', 'date')
+        devices = self.column('energy_data', 'device_id')
+        produced = self.column('energy_data', 'total_energy_produced')
+        lookup = self.price_lookup()
+        diesel = FUELS['diesel']
+
+        first = bisect.bisect_left(dates, start_date.toordinal())
+        last = bisect.bisect_right(dates, end_date.toordinal())
+        total_cost = 0
+        month_prices = {}
+        for i in range(first, last):
+            if device_id is not None and devices[i] != device_id:
+                continue
+            energy_produced = produced[i]
+            if energy_produced != energy_produced:
+                energy_produced = 0
+
+            day = datetime.date.fromordinal(dates[i])
+            key = (day.year, day.month)
+            if key not in month_prices:
+                month_prices[key] = lookup(*key) or (None, diesel.default_price(), diesel.default_efficiency())
+            _, diesel_price, diesel_efficiency = month_prices[key]
+
+            total_cost += diesel.cost(energy_produced, diesel_price, diesel_efficiency)
+        return total_cost
+
+def restore_snapshot(snapshot, db):
+    """Upsert the rows of a snapshot into the database, replacing rows with the same key.
+
+    Returns:
+        (energy rows, price rows) written
+    """
+    energy_names = [name for name, _ in ENERGY_COLUMNS]
+    energy_rows = list(zip(*(snapshot.values('energy_data', name) for name in energy_names)))
+    price_names = [name for name, _ in PRICE_COLUMNS]
+    price_rows = list(zip(*(snapshot.values('prices', name) for name in price_names)))
+
+    def restore(db):
+        cursor = db.get_connection().cursor()
+        updates = ', '.join(f'{name} = excluded.{name}' for name in energy_names[2:])
+        cursor.executemany(f'''
+        INSERT INTO energy_data ({', '.join(energy_names)})
+        VALUES ({', '.join('?' * len(energy_names))})
+        ON CONFLICT(device_id, date) DO UPDATE SET {updates}
+        ''', energy_rows)
+
+        updates = ', '.join(f'{name} = excluded.{name}' for name in price_names[2:])
+        cursor.executemany(f'''
+        INSERT INTO prices ({', '.join(price_names)})
+        VALUES ({', '.join('?' * len(price_names))})
+        ON CONFLICT(year, month) DO UPDATE SET {updates}
+        ''', price_rows)
+
+        # Register the devices present in the data
+        cursor.execute('''
+        INSERT OR IGNORE INTO devices (device_id, device_name, first_seen, last_seen)
+        SELECT device_id, MAX(device_name), MIN(date), MAX(date)
+        FROM energy_data
+        WHERE device_id != 0
+        GROUP BY device_id
+        ''')
+        rebuild_degree_days(cursor, get_base_temperature())
+        db.get_connection().commit()
+
+    db.run_write(restore)
+    logger.info(f"Restored {len(energy_rows)} energy rows and {len(price_rows)} prices from {snapshot.path}")
+    return len(energy_rows), len(price_rows)
@@ -0,0 +1,181 @@
+import os
+import re
+import time
+import heapq
+import sqlite3
+import logging
+import contextvars
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# Trace of the request or collector run executing in the current context
+_current_trace = contextvars.ContextVar('sql_trace', default=None)
+
+_WHITESPACE = re.compile(r'\s+')
+
+def tracing_enabled():
+    """Whether SQL tracing is on (SQL_TRACE, default on)."""
+    return os.getenv('SQL_TRACE', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+def query_budget():
+    """Number of queries a single request may run before a warning is logged."""
+    return int(os.getenv('SQL_QUERY_BUDGET', '50'))
+
+def normalize_sql(sql):
+    """Collapse whitespace so the same statement is counted under one key."""
+    return _WHITESPACE.sub(' ', sql).strip()[:300]
+
+class QueryTrace:
+    """Query count, total time, slowest and most repeated statements of one unit of work."""
+
+    def __init__(self, name, keep_slowest=5):
+        self.name = name
+        self.keep_slowest = keep_slowest
+        self.count = 0
+        self.total_ms = 0.0
+        self.rows = 0
+        self.sqlite_statements = 0
+        self.by_statement = {}
+        self._slowest = []
+
+    def record(self, sql, elapsed, rows=1):
+        """Record one timed execute/executemany call."""
+        elapsed_ms = elapsed * 1000
+        key = normalize_sql(sql)
+
+        self.count += 1
+        self.rows += rows
+        self.total_ms += elapsed_ms
+
+        calls, total = self.by_statement.get(key, (0, 0.0))
+        self.by_statement[key] = (calls + 1, total + elapsed_ms)
+
+        entry = (elapsed_ms, self.count, key)
+        if len(self._slowest) < self.keep_slowest:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self):
+        """Return (ms, sql) of the slowest statements, slowest first."""
+        return [(round(ms, 3), sql) for ms, _, sql in sorted(self._slowest, reverse=True)]
+
+    def repeated(self, threshold=5):
+        """Return (calls, total ms, sql) of statements run at least threshold times, most frequent first."""
+        repeated = [(calls, round(total, 3), sql) for sql, (calls, total) in self.by_statement.items()
+                    if calls >= threshold]
+        return sorted(repeated, reverse=True)
+
+    def summary(self):
+        """Return a JSON-serializable summary."""
+        return {
+            'name': self.name,
+            'queries': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'rows': self.rows,
+            'sqlite_statements': self.sqlite_statements,
+            'distinct_statements': len(self.by_statement),
+            'slowest': self.slowest(),
+            'repeated': self.repeated()
+        }
+
+    def log_summary(self, level=logging.INFO):
+        """Log the count, time and the worst offenders."""
+        logger.log(level, f"{self.name}: {self.count} queries in {self.total_ms:.1f} ms "
+                          f"({len(self.by_statement)} distinct)")
+        for calls, total, sql in self.repeated()[:3]:
+            logger.log(level, f"  repeated {calls}x ({total:.1f} ms): {sql[:120]}")
+        for ms, sql in self.slowest()[:3]:
+            logger.log(level, f"  slowest {ms:.1f} ms: {sql[:120]}")
+
+def current_trace():
+    """Return the active trace, or None."""
+    return _current_trace.get()
+
+def start_trace(name):
+    """Start tracing queries in the current context and return (trace, token)."""
+    trace = QueryTrace(name)
+    return trace, _current_trace.set(trace)
+
+def stop_trace(token):
+    """Stop the trace started with start_trace."""
+    _current_trace.reset(token)
+
+@contextmanager
+def traced(name, log_level=logging.INFO):
+    """Trace every query run inside the block and log a summary at the end."""
+    if not tracing_enabled():
+        yield None
+        return
+
+    trace, token = start_trace(name)
+    try:
+        yield trace
+    finally:
+        stop_trace(token)
+        trace.log_summary(log_level)
+
+def _trace_callback(statement):
+    """sqlite3 trace callback: counts every statement SQLite runs, including implicit BEGIN/COMMIT."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.sqlite_statements += 1
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that times execute/executemany into the active trace."""
+
+    def execute(self, sql, parameters=()):
+        trace = _current_trace.get()
+        if trace is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            trace.record(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        trace = _current_trace.get()
+        if trace is None:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            trace.record(sql, time.perf_counter() - started, max(self.rowcount, 0))
+
+    def executescript(self, sql_script):
+        trace = _current_trace.get()
+        if trace is None:
+            return super().executescript(sql_script)
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            trace.record(sql_script, time.perf_counter() - started)
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors (including conn.execute) report to the active trace.
+
+    sqlite3.Connection.execute and friends create a plain cursor internally,
+    so they are overridden to run on a TracedCursor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if tracing_enabled():
+            self.set_trace_callback(_trace_callback)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import queue
+import socket
+import datetime
+import functools
+import contextvars
+import threading
+import socketserver
+import logging
+from concurrent.futures import Future
+from app.db.tracing import TracedConnection
+
+
+logger = logging.getLogger(__name__)
+
+# Longest time the writer waits for more operations before committing a batch
+MAX_BATCH_DELAY = 0.002
+MAX_BATCH_SIZE = 256
+
+# Database methods that may be forwarded to the writer socket by name
+WRITE_METHODS = set()
+
+_queues = {}
+_queues_lock = threading.Lock()
+_served_paths = set()
+# Set on socket handler threads so served operations are never forwarded again
+_handler_state = threading.local()
+
+def write_queue_enabled():
+    """Whether writes go through the single writer (DB_WRITE_QUEUE, default on)."""
+    return os.getenv('DB_WRITE_QUEUE', 'true').lower() not in ('0', 'false', 'no', 'off')
+
+def write_operation(method):
+    """Route a Database write method through the single writer.
+
+    The method body runs on the writer thread against the writer's connection;
+    its own commit() calls are absorbed into the group commit of the batch.
+    """
+    WRITE_METHODS.add(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.run_write(lambda db: method(db, *args, **kwargs), method.__name__, args, kwargs)
+
+    return wrapper
+
+class BatchConnection(TracedConnection):
+    """Writer connection whose commit/rollback act on the current operation only."""
+
+    def commit(self):
+        # The writer commits the whole batch at once
+        pass
+
+    def rollback(self):
+        if self.in_transaction:
+            self.execute('ROLLBACK TO operation')
+
+class WriteQueue:
+    """Single writer thread applying queued operations in order with group commits.
+
+    Each operation runs inside its own savepoint, so a failing operation is
+    rolled back and reported to its caller without affecting the rest of the
+    batch. The batch is committed once, after which every caller is released.
+    """
+
+    def __init__(self, db, max_batch_size=MAX_BATCH_SIZE, max_batch_delay=MAX_BATCH_DELAY):
+        """Start the writer thread on a writer-owned Database."""
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self._queue = queue.Queue()
+
+        self.stats = {
+            'operations': 0,
+            'batches': 0,
+            'failed_operations': 0,
+            'failed_batches': 0,
+            'largest_batch': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        """Queue fn(db) for the writer and return a Future with its result."""
+        future = Future()
+        # Run in the caller's context so its SQL trace sees the writer's queries
+        context = contextvars.copy_context()
+        self._queue.put((lambda db: context.run(fn, db), future, time.perf_counter()))
+        return future
+
+    def run(self, fn):
+        """Run fn(db) on the writer and wait for its batch to be committed."""
+        if threading.current_thread() is self._thread:
+            # Nested write issued by an operation already running on the writer
+            return fn(self.db)
+        return self.submit(fn).result()
+
+    def get_stats(self):
+        """Return counters, including the queue depth and average wait."""
+        stats = dict(self.stats)
+        stats['pending'] = self._queue.qsize()
+        stats['avg_wait_ms'] = stats['total_wait_ms'] / stats['operations'] if stats['operations'] else 0.0
+        return stats
+
+    def _run(self):
+        """Collect operations into batches and apply them forever."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_batch_delay
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._apply(batch)
+
+    def _apply(self, batch):
+        """Apply one batch in a single transaction and resolve its futures."""
+        conn = self.db.get_connection()
+        outcomes = []
+
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, future, queued_at in batch:
+                conn.execute('SAVEPOINT operation')
+                try:
+                    result = fn(self.db)
+                    conn.execute('RELEASE operation')
+                    outcomes.append((future, queued_at, result, None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO operation')
+                    conn.execute('RELEASE operation')
+                    outcomes.append((future, queued_at, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"Write batch of {len(batch)} operations failed: {str(e)}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            self.stats['failed_batches'] += 1
+            for fn, future, queued_at in batch:
+                future.set_exception(e)
+            return
+
+        now = time.perf_counter()
+        self.stats['batches'] += 1
+        self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+        for future, queued_at, result, error in outcomes:
+            wait_ms = (now - queued_at) * 1000
+            self.stats['operations'] += 1
+            self.stats['total_wait_ms'] += wait_ms
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+            if error is not None:
+                self.stats['failed_operations'] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+def get_write_queue(db_path, database_factory):
+    """Return this process's writer for a database file, starting it on first use."""
+    key = (os.getpid(), os.path.abspath(db_path))
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = WriteQueue(database_factory(db_path))
+        return _queues[key]
+
+def _encode(value):
+    """JSON encoder for dates sent over the writer socket."""
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Cannot send {type(value).__name__} to the writer")
+
+def _decode(obj):
+    """JSON object hook reversing _encode."""
+    if '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return datetime.date.fromisoformat(obj['__date__'])
+    return obj
+
+class WriterClient:
+    """Forwards named Database write operations to a writer socket."""
+
+    def __init__(self, socket_path, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def call(self, operation, args, kwargs):
+        """Send one operation and return its result; raises OSError if the writer is unreachable."""
+        message = json.dumps({'operation': operation, 'args': list(args), 'kwargs': kwargs}, default=_encode)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            with sock.makefile('rwb') as stream:
+                stream.write(message.encode('utf-8') + b'\n')
+                stream.flush()
+                reply = stream.readline()
+
+        if not reply:
+            raise ConnectionError("Writer closed the connection")
+
+        response = json.loads(reply, object_hook=_decode)
+        if 'error' in response:
+            raise RuntimeError(f"Writer failed {operation}: {response['error']}")
+        return response.get('result')
+
+def get_writer_client(db_path):
+    """Return a client for DB_WRITER_SOCKET, or None if writes should stay in-process."""
+    socket_path = os.getenv('DB_WRITER_SOCKET')
+    if not socket_path or not hasattr(socket, 'AF_UNIX'):
+        return None
+    if getattr(_handler_state, 'serving', False) or os.path.abspath(db_path) in _served_paths:
+        return None
+    if not os.path.exists(socket_path):
+        return None
+    return WriterClient(socket_path)
+
+class _WriterRequestHandler(socketserver.StreamRequestHandler):
+    """Applies one newline-delimited JSON request per line."""
+
+    def handle(self):
+        _handler_state.serving = True
+        for line in self.rfile:
+            try:
+                request = json.loads(line, object_hook=_decode)
+                operation = request['operation']
+                if operation not in WRITE_METHODS:
+                    raise ValueError(f"Unknown write operation: {operation}")
+                method = getattr(self.server.database, operation)
+                response = {'result': method(*request.get('args', []), **request.get('kwargs', {}))}
+            except Exception as e:
+                logger.error(f"Writer socket request failed: {str(e)}")
+                response = {'error': str(e)}
+
+            self.wfile.write(json.dumps(response, default=_encode).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class _WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def start_writer_server(socket_path, database):
+    """Serve write operations for external processes on a local Unix socket.
+
+    Returns the server, or None if another live process already serves the socket.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        logger.warning("Unix sockets not available, writer socket disabled")
+        return None
+
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            logger.info(f"Writer socket {socket_path} already served by another process")
+            return None
+        except OSError:
+            # Left over from a process that exited
+            os.unlink(socket_path)
+        finally:
+            probe.close()
+
+    try:
+        server = _WriterServer(socket_path, _WriterRequestHandler)
+    except OSError as e:
+        logger.info(f"Writer socket {socket_path} not started: {e}")
+        return None
+
+    os.chmod(socket_path, 0o600)
+    server.database = database
+    _served_paths.add(os.path.abspath(database.db_path))
+
+    thread = threading.Thread(target=server.serve_forever, name='sqlite-writer-socket', daemon=True)
+    thread.start()
+    logger.info(f"Writer socket listening on {socket_path}")
+    return server
@@ -0,0 +1,223 @@
+import json
+import time
+import queue
+import logging
+import datetime
+import threading
+from app.config import config
+from app.db.models import Database
+from app.db.fuels import FuelPrices, configured_fuels
+
+
+logger = logging.getLogger(__name__)
+
+ENERGY_TYPES = ('total', 'heating', 'hot_water')
+
+# Messages a client may fall behind by before its stream is closed (it then
+# reconnects and catches up from data_events)
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Events replayed to a client reconnecting with Last-Event-ID
+REPLAY_LIMIT = 100
+
+class TooManyClients(Exception):
+    """Raised when SSE_MAX_CLIENTS streams are already open."""
+
+def _to_date(value):
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value)[:10])
+
+def build_points(db, start_date, end_date):
+    """Build the daily values of a date range as the day-aggregated charts show them.
+
+    Returns a list of {'date', 'outdoor_temp', 'total': {...}, 'heating': {...},
+    'hot_water': {...}}, where each energy type holds energy_consumed,
+    energy_produced, cop, cost and the <fuel>_cost of every configured fuel
+    (diesel_cost, lpg_cost, ...) summed over all devices.
+    """
+    points = {}
+    for row in db.get_temperature_data(start_date, end_date):
+        points.setdefault(str(row['date']), {'date': str(row['date']), 'outdoor_temp': None})['outdoor_temp'] = row['outdoor_temp']
+
+    prices = FuelPrices(db)
+    fuels = configured_fuels()
+    for energy_type in ENERGY_TYPES:
+        for row in db.get_energy_data(start_date, end_date, energy_type):
+            date_str = str(row[0])
+            point = points.setdefault(date_str, {'date': date_str, 'outdoor_temp': None})
+            day = _to_date(date_str)
+
+            produced = row[2]
+            point[energy_type] = {
+                'energy_consumed': row[1],
+                'energy_produced': produced,
+                'cop': row[3],
+                'cost': row[5]
+            }
+            month_prices = prices.for_month(day.year, day.month)
+            for fuel in fuels:
+                point[energy_type][f'{fuel.key}_cost'] = fuel.cost(produced, *month_prices[fuel.key])
+
+    return [points[date_str] for date_str in sorted(points)]
+
+def build_event(db, row):
+    """Build the payload of one data_events row, with the new values of its dates.
+
+    Ranges longer than LIVE_DELTA_MAX_DAYS (reprocessed history, recalculated
+    costs) carry no points; clients reload instead.
+    """
+    start_date = _to_date(row['start_date'])
+    end_date = _to_date(row['end_date'])
+    max_days = int(config.get_float('LIVE_DELTA_MAX_DAYS', 62))
+
+    event = {
+        'event_id': row['event_id'],
+        'source': row['source'],
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'device_id': row['device_id'],
+        'created_at': row['created_at'],
+        'points': None
+    }
+    if (end_date - start_date).days < max_days:
+        event['points'] = build_points(db, start_date, end_date)
+    return event
+
+def format_message(event):
+    """Encode an event as a Server-Sent Events message."""
+    return f"id: {event['event_id']}\nevent: data\ndata: {json.dumps(event)}\n\n"
+
+def replay_messages(db, last_event_id):
+    """Return the messages a client that saw last_event_id missed.
+
+    When the missed events were pruned or are too many to replay, a single
+    'reset' message tells the client to reload.
+    """
+    oldest, newest = db.get_data_event_range()
+    if newest is None or last_event_id >= newest:
+        return []
+
+    rows = db.get_data_events(last_event_id, REPLAY_LIMIT + 1)
+    if oldest > last_event_id + 1 or len(rows) > REPLAY_LIMIT:
+        return [f"id: {newest}\nevent: reset\ndata: {{}}\n\n"]
+    return [format_message(build_event(db, row)) for row in rows]
+
+def stream_limit():
+    """Return how many streams a process may hold open.
+
+    Each stream occupies one of the GUNICORN_THREADS worker threads, so the
+    limit leaves SSE_RESERVED_THREADS of them for page and API requests;
+    SSE_MAX_CLIENTS can lower it but not raise it past that.
+    """
+    threads = int(config.get_float('GUNICORN_THREADS', 32))
+    available = max(threads - int(config.get_float('SSE_RESERVED_THREADS', 8)), 1)
+    limit = int(config.get_float('SSE_MAX_CLIENTS', available))
+    if limit > available:
+        logger.warning(f"SSE_MAX_CLIENTS={limit} would take every request thread, "
+                       f"limiting live update clients to {available}")
+        return available
+    return limit
+
+class EventBroker:
+    """Fan out data changes to the connected SSE clients.
+
+    One thread per process watches the database with PRAGMA data_version,
+    which changes only when another connection commits, so idle periods
+    cost one tiny query per poll and nothing per client. Each new
+    data_events row is turned into a message once and handed to every
+    client's queue; the streams themselves never touch the database.
+    """
+
+    def __init__(self, db_path=None, poll_interval=None, max_clients=None):
+        self.db_path = db_path
+        self.poll_interval = poll_interval or config.get_float('SSE_POLL_INTERVAL', 2.0)
+        self.max_clients = max_clients or stream_limit()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        """Register a client and return the queue its messages arrive on."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                raise TooManyClients(f"{self.max_clients} live update clients already connected")
+            subscription = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+            self._subscribers.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sse-broker', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Forget a client whose stream ended."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def client_count(self):
+        return len(self._subscribers)
+
+    def publish(self, message):
+        """Hand a message to every client; clients too far behind are disconnected."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(message)
+            except queue.Full:
+                logger.warning("Live update client fell behind, closing its stream")
+                self.unsubscribe(subscription)
+                # Make room for the end-of-stream marker
+                while True:
+                    try:
+                        subscription.get_nowait()
+                    except queue.Empty:
+                        break
+                subscription.put_nowait(None)
+
+    def _run(self):
+        """Poll the database and publish new data_events rows."""
+        db = Database(self.db_path)
+        conn = db.get_connection()
+        last_event_id = db.get_data_event_range()[1] or 0
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        logger.info(f"Live update broker watching {db.db_path} from event {last_event_id}")
+
+        while True:
+            time.sleep(self.poll_interval)
+
+            try:
+                version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if version == data_version:
+                    continue
+                data_version = version
+
+                if not self._subscribers:
+                    # Nobody to tell: skip the events instead of building them all for the
+                    # next client, which replays what it missed from its Last-Event-ID
+                    last_event_id = db.get_data_event_range()[1] or last_event_id
+                    continue
+
+                while True:
+                    rows = db.get_data_events(last_event_id, REPLAY_LIMIT)
+                    for row in rows:
+                        last_event_id = row['event_id']
+                        event = build_event(db, row)
+                        self.publish(format_message(event))
+                        logger.info(f"Published {event['source']} event {last_event_id} for "
+                                    f"{event['start_date']}..{event['end_date']} to {self.client_count} clients")
+                    if len(rows) < REPLAY_LIMIT:
+                        break
+            except Exception as e:
+                logger.error(f"Error publishing live updates: {e}")
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    """Return this process's EventBroker, creating it on first use."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = EventBroker()
+        return _broker
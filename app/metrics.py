@@ -0,0 +1,372 @@
+import os
+import time
+import bisect
+import logging
+import datetime
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import g, has_request_context
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Request phases, in the order they normally run
+PHASES = ('handler', 'db', 'aggregate', 'charts', 'serialize', 'render')
+
+# Rolling window used for the recent quantiles
+ROLLING_WINDOW = 300
+ROLLING_SAMPLES = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    """Cumulative Prometheus-style buckets plus a rolling window of recent samples."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=ROLLING_WINDOW, max_samples=ROLLING_SAMPLES):
+        self.buckets = tuple(buckets)
+        self.window = window
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=max_samples)
+
+    def observe(self, value, now=None):
+        """Add one observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append((now or time.monotonic(), value))
+
+    def quantiles(self, quantiles=QUANTILES, now=None):
+        """Return {quantile: value} over the samples of the rolling window."""
+        cutoff = (now or time.monotonic()) - self.window
+        while self.recent and self.recent[0][0] < cutoff:
+            self.recent.popleft()
+
+        values = sorted(value for _, value in self.recent)
+        if not values:
+            return {}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in quantiles}
+
+class MetricsRegistry:
+    """Thread-safe store of labelled counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        """Set the HELP line of a metric."""
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        """Increase a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Add an observation to a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        """Drop all recorded values."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                self._header(lines, name, 'counter')
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+            now = time.monotonic()
+            for name in sorted({name for name, _ in self.histograms}):
+                self._header(lines, name, 'histogram')
+                recent = []
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else _number(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(histogram.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+                    for q, value in histogram.quantiles(now=now).items():
+                        recent.append(f"{name}_recent{_labels(labels + (('quantile', str(q)),))} {_number(value)}")
+
+                if recent:
+                    lines.append(f"# HELP {name}_recent Quantiles of {name} over the last {ROLLING_WINDOW} seconds")
+                    lines.append(f"# TYPE {name}_recent gauge")
+                    lines.extend(recent)
+
+        return '\n'.join(lines) + '\n'
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append(f"# HELP {name} {self.help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = MetricsRegistry()
+
+registry.describe('energy_insight_requests_total', 'HTTP requests by endpoint and status code')
+registry.describe('energy_insight_request_seconds', 'Total request time by endpoint')
+registry.describe('energy_insight_request_phase_seconds', 'Request time spent in each phase by endpoint')
+registry.describe('energy_insight_request_sql_queries', 'SQL queries run per request by endpoint')
+registry.describe('energy_insight_collector_api_seconds', 'Latency of external API calls by source and call')
+registry.describe('energy_insight_collector_rows_written_total', 'Rows written by the collectors by source')
+registry.describe('energy_insight_collector_failures_total', 'Failed collector calls by source and call')
+registry.describe('energy_insight_collector_retries_total', 'Retried collector calls by source')
+
+# Collector run receiving the API calls and rows of the current context
+_current_run = contextvars.ContextVar('collector_run', default=None)
+
+class RequestPhases:
+    """Splits the time of one request between consecutive phases."""
+
+    def __init__(self, first='handler'):
+        self.durations = {}
+        self.current = first
+        self.started = time.perf_counter()
+
+    def switch(self, name):
+        """End the current phase and start another."""
+        now = time.perf_counter()
+        if self.current is not None:
+            self.durations[self.current] = self.durations.get(self.current, 0.0) + now - self.started
+        self.current = name
+        self.started = now
+
+    @contextmanager
+    def measure(self, name):
+        """Time a block as its own phase, then resume the enclosing one."""
+        previous = self.current
+        self.switch(name)
+        try:
+            yield
+        finally:
+            self.switch(previous)
+
+    def finish(self):
+        """Close the last phase and return {phase: seconds}."""
+        self.switch(None)
+        return self.durations
+
+def start_request():
+    """Start timing the phases of the current request."""
+    g.request_phases = RequestPhases()
+    g.request_started = time.perf_counter()
+
+def phase(name):
+    """Attribute the rest of the current request, until the next phase(), to a phase."""
+    if has_request_context() and 'request_phases' in g:
+        g.request_phases.switch(name)
+
+@contextmanager
+def measure_phase(name):
+    """Time a block of the current request as its own phase."""
+    if not has_request_context() or 'request_phases' not in g:
+        yield
+        return
+    with g.request_phases.measure(name):
+        yield
+
+def finish_request(endpoint, status, sql_queries=None):
+    """Record the phases and total time of the current request."""
+    phases = g.pop('request_phases', None)
+    started = g.pop('request_started', None)
+    if phases is None:
+        return
+
+    endpoint = endpoint or 'unknown'
+    registry.inc('energy_insight_requests_total', endpoint=endpoint, status=str(status))
+    registry.observe('energy_insight_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+    for name, seconds in phases.finish().items():
+        registry.observe('energy_insight_request_phase_seconds', seconds, endpoint=endpoint, phase=name)
+    if sql_queries is not None:
+        registry.observe('energy_insight_request_sql_queries', sql_queries, buckets=QUERY_COUNT_BUCKETS,
+                         endpoint=endpoint)
+
+@contextmanager
+def api_call(source, call):
+    """Time an external API call; exceptions count as failures and are re-raised."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_failure(source, call)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe('energy_insight_collector_api_seconds', elapsed, source=source, call=call)
+        run = _current_run.get()
+        if run is not None:
+            run.record_call(source, elapsed)
+
+def record_failure(source, call, message=None):
+    """Count a failed collector call."""
+    registry.inc('energy_insight_collector_failures_total', source=source, call=call)
+    run = _current_run.get()
+    if run is not None:
+        run.record_error(source, message or f"{call} failed")
+
+def record_retry(source):
+    """Count a retried collector call."""
+    registry.inc('energy_insight_collector_retries_total', source=source)
+    run = _current_run.get()
+    if run is not None:
+        run.source(source)['retries'] += 1
+
+def record_rows_written(source, inserted=0, updated=0, unchanged=0):
+    """Count rows stored by a collector, split into new, changed and unchanged rows."""
+    written = inserted + updated
+    if written:
+        registry.inc('energy_insight_collector_rows_written_total', written, source=source)
+    run = _current_run.get()
+    if run is not None:
+        totals = run.source(source)
+        totals['rows_inserted'] += inserted
+        totals['rows_updated'] += updated
+        totals['rows_unchanged'] += unchanged
+
+class CollectorRun:
+    """Telemetry of one collector run, saved to the collector_runs table when it ends."""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.started_at = datetime.datetime.now()
+        self.finished_at = None
+        self.status = 'running'
+        self.dates_missing = 0
+        self.dates_collected = 0
+        self.last_error = None
+        self.sources = {}
+        self._lock = threading.Lock()
+
+    def source(self, name):
+        """Return the counters of one source, creating them on first use."""
+        with self._lock:
+            if name not in self.sources:
+                self.sources[name] = {
+                    'api_calls': 0, 'failures': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'retries': 0,
+                    'rows_inserted': 0, 'rows_updated': 0, 'rows_unchanged': 0
+                }
+            return self.sources[name]
+
+    def record_call(self, source, seconds):
+        totals = self.source(source)
+        with self._lock:
+            totals['api_calls'] += 1
+            totals['total_ms'] += seconds * 1000
+            totals['max_ms'] = max(totals['max_ms'], seconds * 1000)
+
+    def record_error(self, source, message):
+        totals = self.source(source)
+        with self._lock:
+            totals['failures'] += 1
+            self.last_error = f"{source}: {message}"[:500]
+
+    def finish(self, status=None):
+        """Stop the clock; the status defaults to ok, or partial if any call failed."""
+        self.finished_at = datetime.datetime.now()
+        failures = sum(totals['failures'] for totals in self.sources.values())
+        self.status = status or ('partial' if failures else 'ok')
+
+    def to_dict(self):
+        """Return the run as a plain dictionary for Database.add_collector_run."""
+        return {
+            'collector': self.collector,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration_seconds': ((self.finished_at or datetime.datetime.now()) - self.started_at).total_seconds(),
+            'status': self.status,
+            'dates_missing': self.dates_missing,
+            'dates_collected': self.dates_collected,
+            'last_error': self.last_error,
+            'sources': {name: dict(totals) for name, totals in self.sources.items()}
+        }
+
+def current_run():
+    """Return the active collector run, or None."""
+    return _current_run.get()
+
+@contextmanager
+def collector_run(collector, db=None):
+    """Record the API calls, rows and errors of the block as one collector run.
+
+    The run is saved with db (a Database) when the block ends, also when it fails.
+    """
+    run = CollectorRun(collector)
+    token = _current_run.set(run)
+    try:
+        yield run
+        run.finish()
+    except Exception as e:
+        run.last_error = f"{type(e).__name__}: {e}"[:500]
+        run.finish('failed')
+        raise
+    finally:
+        _current_run.reset(token)
+        if db is not None:
+            try:
+                db.add_collector_run(run.to_dict())
+            except Exception as e:
+                logger.error(f"Could not save {collector} run telemetry: {str(e)}")
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def start_metrics_server(port, host=None):
+    """Serve /metrics from a background thread, for processes without the web app."""
+    host = host or os.getenv('METRICS_HOST', '127.0.0.1')
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    except OSError as e:
+        logger.warning(f"Metrics server not started on {host}:{port}: {e}")
+        return None
+
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    return server
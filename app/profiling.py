@@ -0,0 +1,239 @@
+import io
+import os
+import sys
+import hmac
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import parse_qs
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ('top', 'save')
+DEFAULT_TOP = 40
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+def profiling_enabled():
+    """Whether requests may ask to be profiled (PROFILING_ENABLED, default off)."""
+    return os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+def profile_dir():
+    """Directory for saved profiles (PROFILE_DIR, default logs)."""
+    return os.getenv('PROFILE_DIR', 'logs')
+
+def _profile_path(name, extension):
+    """Return a new timestamped file path for a profile."""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name).strip('_') or 'profile'
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return os.path.join(directory, f"{safe_name}-{timestamp}.{extension}")
+
+def format_stats(profiler, top=DEFAULT_TOP, sort='cumulative'):
+    """Return the top entries of a cProfile profile as text."""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+    return stream.getvalue()
+
+def _is_streamed(headers):
+    """Whether response headers belong to a stream (SSE, or a body without Content-Length).
+
+    Flask sets Content-Length on every buffered response; generators such as
+    /data/events and /data/export may never end and must not be buffered.
+    """
+    names = {name.lower(): value for name, value in headers}
+    return names.get('content-type', '').startswith('text/event-stream') or 'content-length' not in names
+
+class RequestProfiler:
+    """WSGI middleware that runs requests under cProfile when asked to.
+
+    A request is profiled when it carries ``X-Profile: top|save`` or
+    ``?_profile=top|save`` and profiling is enabled. If PROFILING_TOKEN is set,
+    the same value must be sent in ``X-Profile-Token`` or ``?_profile_token=``.
+
+    - ``top`` replaces the response with the top cumulative-time entries.
+    - ``save`` returns the normal response and writes a ``.prof`` file to
+      PROFILE_DIR, named in the ``X-Profile-File`` header.
+
+    Streamed responses (e.g. /data/events) are profiled up to the start of
+    the response and then handed to the client unbuffered.
+    """
+
+    def __init__(self, wsgi_app, top=DEFAULT_TOP):
+        self.wsgi_app = wsgi_app
+        self.top = top
+        self.token = os.getenv('PROFILING_TOKEN')
+        # cProfile cannot profile two requests of the same process at once
+        self._lock = threading.Lock()
+
+    def _requested_mode(self, environ):
+        """Return the profile mode asked for by the request, or None."""
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        mode = environ.get('HTTP_X_PROFILE') or query.get('_profile', [None])[0]
+        if mode not in PROFILE_MODES:
+            return None
+
+        if self.token:
+            supplied = environ.get('HTTP_X_PROFILE_TOKEN') or query.get('_profile_token', [''])[0]
+            if not hmac.compare_digest(supplied.encode('utf-8'), self.token.encode('utf-8')):
+                logger.warning(f"Rejected profiling request for {environ.get('PATH_INFO')}: bad token")
+                return None
+        return mode
+
+    def __call__(self, environ, start_response):
+        mode = self._requested_mode(environ)
+        if mode is None or not self._lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            response = {}
+
+            def capture_start_response(status, headers, exc_info=None):
+                response['status'] = status
+                response['headers'] = headers
+                return lambda data: response.setdefault('written', []).append(data)
+
+            def run():
+                app_iter = self.wsgi_app(environ, capture_start_response)
+                if 'headers' in response and _is_streamed(response['headers']):
+                    # Left to the client: only the work up to the start of the response is profiled
+                    return app_iter
+                try:
+                    return b''.join(response.get('written', [])) + b''.join(app_iter)
+                finally:
+                    if hasattr(app_iter, 'close'):
+                        app_iter.close()
+
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            body = profiler.runcall(run)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        finally:
+            self._lock.release()
+
+        path = environ.get('PATH_INFO', '/')
+        streamed = not isinstance(body, bytes)
+        logger.info(f"Profiled {environ.get('REQUEST_METHOD')} {path} ({mode}) in {elapsed_ms:.1f} ms"
+                    + (" up to the start of its streamed response" if streamed else ""))
+
+        if mode == 'top':
+            if streamed and hasattr(body, 'close'):
+                body.close()
+            summary = (f"{environ.get('REQUEST_METHOD')} {path} -> {response['status']} in {elapsed_ms:.1f} ms"
+                       + (" (streamed response, profiled up to its start)" if streamed else "") + "\n\n"
+                       + format_stats(profiler, self.top))
+            body = summary.encode('utf-8')
+            start_response('200 OK', [('Content-Type', 'text/plain; charset=utf-8'),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+
+        filename = _profile_path(f"request{path.replace('/', '-')}", 'prof')
+        profiler.dump_stats(filename)
+        if streamed:
+            start_response(response['status'], response['headers'] + [('X-Profile-File', filename)])
+            return body
+        headers = [(name, value) for name, value in response['headers'] if name.lower() != 'content-length']
+        headers += [('Content-Length', str(len(body))), ('X-Profile-File', filename)]
+        start_response(response['status'], headers)
+        return [body]
+
+class SamplingProfiler:
+    """Low-overhead statistical profiler for long-running jobs.
+
+    A background thread snapshots the stacks of the profiled threads every
+    interval. Only the thread that started the profiler and threads started
+    while it runs (e.g. fetch workers) are sampled, so idle service threads
+    don't drown out the job.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._ignored = set()
+        self._target = None
+
+    def start(self):
+        """Start sampling the calling thread and the threads it starts."""
+        self._target = threading.get_ident()
+        self._ignored = {thread.ident for thread in threading.enumerate()} - {self._target}
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or ident in self._ignored:
+                    continue
+                if ident not in names:
+                    thread = threading._active.get(ident)
+                    names[ident] = thread.name if thread else str(ident)
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names[ident])
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def top_functions(self, top=20):
+        """Return (function, inclusive samples, self samples), most inclusive first."""
+        inclusive = Counter()
+        own = Counter()
+        for stack, count in self.stacks.items():
+            for function in set(stack[1:]):
+                inclusive[function] += count
+            own[stack[-1]] += count
+        return [(function, count, own[function]) for function, count in inclusive.most_common(top)]
+
+    def summary(self, top=20):
+        """Return a text report of the hottest functions."""
+        total = sum(self.stacks.values()) or 1
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f} ms",
+                 f"{'incl %':>7} {'self %':>7}  function"]
+        for function, inclusive, own in self.top_functions(top):
+            lines.append(f"{inclusive / total * 100:7.1f} {own / total * 100:7.1f}  {function}")
+        return '\n'.join(lines)
+
+    def write_folded(self, filename):
+        """Write the stacks in the folded format read by flamegraph.pl and speedscope."""
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(';'.join(stack) + f" {count}\n")
+
+@contextmanager
+def sampling_profile(name, enabled=True, interval=DEFAULT_SAMPLE_INTERVAL, top=20):
+    """Sample the block, log the hottest functions and save the stacks to PROFILE_DIR."""
+    if not enabled:
+        yield None
+        return
+
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        filename = _profile_path(name, 'folded')
+        profiler.write_folded(filename)
+        logger.info(f"Sampling profile of {name}:\n{profiler.summary(top)}")
+        logger.info(f"Stacks saved to {filename}")
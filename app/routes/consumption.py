@@ -5,11 +5,24 @@ from datetime import datetime, timedelta, date
 import calendar
 import math
 from app.db.models import Database
-from app.routes.dashboard import get_date_range, determine_aggregation, aggregate_data
+from app.db.batch import period_key
+from app.db.degree_days import get_base_temperature, get_degree_days, normalized_consumption
+from app.metrics import phase, measure_phase
+from app.routes.dashboard import get_date_range, determine_aggregation, aggregate_data, get_device_filter
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('consumption', __name__)
 
+def row_period(value, aggregation):
+    """Return the degree-day period key of an aggregated energy row's date field."""
+    if isinstance(value, int):
+        return f"{value:04d}"
+    if isinstance(value, str):
+        if '-Q' in value:
+            return value
+        value = datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return period_key(value, aggregation, value)
+
 @bp.route('/')
 def index():
     """Energy consumption view showing energy usage data."""
@@ -19,6 +32,9 @@ def index():
     # Get energy type selection
     energy_type = request.args.get('energy_type', default='total')
     
+    # Weather normalization: add consumption per heating degree day
+    normalize = request.args.get('normalize', default='')
+    
     # Get date range
     start_date, end_date = get_date_range(time_range)
     
@@ -37,13 +53,16 @@ def index():
         aggregation = calculated_aggregation
     
     # Get data from database
+    phase('db')
     db = Database()
-    energy_data = db.get_energy_data(start_date, end_date, energy_type)
+    device_id = get_device_filter()
+    energy_data = db.get_energy_data(start_date, end_date, energy_type, device_id)
     
     # Debug: Log the data retrieved
     logger.info(f"Retrieved {len(energy_data) if energy_data else 0} energy data points")
     
     # Aggregate data if needed
+    phase('aggregate')
     logger.info(f"Using aggregation: {aggregation}")
     if aggregation != 'day':
         logger.info(f"Aggregating data with method: {aggregation}")
@@ -52,6 +71,7 @@ def index():
         logger.info(f"After aggregation: {len(energy_data) if energy_data else 0} energy data points")
     
     # Create chart data
+    phase('charts')
     charts = {}
     
     # Italian day and month names
@@ -227,7 +247,7 @@ def index():
                 else:
                     # If still no match, log and use None
                     if i < 5:  # Only log first few to avoid spam
-                        logger.info(f"No temperature match for date: {date_val}, original: {original_date}")
+                        logger.debug(f"No temperature match for date: {date_val}, original: {original_date}")
                     aligned_temps.append(None)
             
             # If we have no aligned temperatures, use the original temperature data
@@ -307,7 +327,43 @@ def index():
             # Update chart title to indicate both metrics
             energy_chart['options']['plugins']['title']['text'] = f'{energy_type.capitalize()} Energy & Temperature'
         
-        charts['energy_chart'] = json.dumps(energy_chart)
+        # Consumption per heating degree day, from the precomputed degree days
+        if normalize == 'hdd':
+            hdd_by_period = {row['period']: row['hdd'] for row in get_degree_days(db, start_date, end_date, aggregation)}
+            normalized_values = [
+                normalized_consumption(row[1], hdd_by_period.get(row_period(row[0], aggregation)))
+                for row in energy_data
+            ]
+            energy_chart['data']['datasets'].append({
+                'label': 'Consumo per grado giorno (kWh/HDD)',
+                'data': normalized_values,
+                'backgroundColor': 'rgba(255, 159, 64, 0)',
+                'borderColor': 'rgb(255, 159, 64)',
+                'borderWidth': 2,
+                'type': 'line',
+                'yAxisID': 'y2',
+                'tension': 0.1,
+                'pointRadius': 3,
+                'fill': False,
+                'spanGaps': True,
+                'order': 0
+            })
+            energy_chart['options']['scales']['y2'] = {
+                'type': 'linear',
+                'display': True,
+                'position': 'right',
+                'beginAtZero': True,
+                'title': {
+                    'display': True,
+                    'text': 'kWh/HDD'
+                },
+                'grid': {
+                    'drawOnChartArea': False
+                }
+            }
+        
+        with measure_phase('serialize'):
+            charts['energy_chart'] = json.dumps(energy_chart)
         logger.info(f"Energy chart data created with {len(timestamps)} points")
     else:
         logger.warning("No energy data available to create chart")
@@ -317,6 +373,10 @@ def index():
         'charts': charts,
         'time_range': time_range,
         'energy_type': energy_type,
+        'normalize': normalize,
+        'base_temperature': get_base_temperature(),
+        'device_id': device_id,
+        'devices': db.get_devices(),
         'aggregation': aggregation,
         'start_date': start_date,
         'end_date': end_date,
@@ -326,4 +386,5 @@ def index():
     # Clean up
     db.close_connection()
     
+    phase('render')
     return render_template('consumption/index.html', **context)
@@ -4,14 +4,16 @@ import logging
 from datetime import datetime, timedelta, date
 import calendar
 from app.db.models import Database
-from app.routes.dashboard import get_date_range, determine_aggregation, aggregate_data
+from app.db.fuels import FUELS, FuelPrices, configured_fuels, fuel_costs
+from app.metrics import phase, measure_phase
+from app.routes.dashboard import get_date_range, determine_aggregation, aggregate_data, get_device_filter, get_fuel_filter
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('costs', __name__)
 
 @bp.route('/')
 def index():
-    """Cost analysis view showing cost comparison between heat pump and diesel."""
+    """Cost analysis view comparing the heat pump with diesel and the other picked fuels."""
     # Get time range from request
     time_range = request.args.get('time_range', default='7d')
     
@@ -36,13 +38,19 @@ def index():
         aggregation = calculated_aggregation
     
     # Get data from database
+    phase('db')
     db = Database()
-    energy_data = db.get_energy_data(start_date, end_date, energy_type)
+    device_id = get_device_filter()
+    fuels = get_fuel_filter()
+    energy_data = db.get_energy_data(start_date, end_date, energy_type, device_id)
+    # Monthly prices of every fuel for the comparison
+    prices = FuelPrices(db)
     
     # Debug: Log the data retrieved
     logger.info(f"Retrieved {len(energy_data) if energy_data else 0} energy data points")
     
     # Aggregate data if needed
+    phase('aggregate')
     logger.info(f"Using aggregation: {aggregation}")
     if aggregation != 'day':
         logger.info(f"Aggregating data with method: {aggregation}")
@@ -51,6 +59,7 @@ def index():
         logger.info(f"After aggregation: {len(energy_data) if energy_data else 0} energy data points")
     
     # Create chart data
+    phase('charts')
     charts = {}
     
     # Italian day and month names
@@ -66,7 +75,7 @@ def index():
         # Prepare data for chart
         timestamps = []
         electricity_costs = []
-        diesel_costs = []
+        produced_series = []
         cop_values = []
         
         for row in energy_data:
@@ -132,28 +141,15 @@ def index():
             cop = float(row[3] or 3.5)  # COP value, default to 3.5 if None
             cop_values.append(cop)
             
-            # Get prices for this month/year
+            # Prices of the row's month/year
             year = row[0].year if isinstance(row[0], date) else current_date.year
             month = row[0].month if isinstance(row[0], date) else current_date.month
-            
-            price_data = db.get_prices_for_month(year, month)
-            
-            if price_data:
-                diesel_price = price_data['diesel_price']
-                diesel_efficiency = price_data['diesel_efficiency']
-            else:
-                # Default values if no price data
-                diesel_price = 1.50
-                diesel_efficiency = 0.85
-            
-            # Calculate diesel cost using the formula from cost_calculations.md
-            # Cost = (Produced / (DIESEL_EFFICIENCY * 10.5)) * DIESEL_PRICE
-            if energy_produced > 0:
-                diesel_cost = (energy_produced / (diesel_efficiency * 10.5)) * diesel_price
-            else:
-                diesel_cost = 0
-            
-            diesel_costs.append(diesel_cost)
+            produced_series.append((year, month, energy_produced))
+        
+        # Equivalent cost of the picked fuels (and diesel, for the savings) in one pass
+        cost_fuels = [fuel for fuel in FUELS.values() if fuel in fuels or fuel.key == 'diesel']
+        costs = fuel_costs(prices, produced_series, cost_fuels)
+        diesel_costs = costs['diesel']
         
         # Cumulative costs
         cum_electricity = [sum(electricity_costs[:i+1]) for i in range(len(electricity_costs))]
@@ -194,15 +190,17 @@ def index():
                         'pointRadius': 3,
                         'pointHoverRadius': 5
                     },
+                ] + [
                     {
-                        'label': 'Diesel Cost (€)',
-                        'data': diesel_costs,
-                        'borderColor': 'rgb(255, 159, 64)',
-                        'backgroundColor': 'rgba(255, 159, 64, 0.2)',
+                        'label': f'{fuel.label} Cost (€)',
+                        'data': costs[fuel.key],
+                        'borderColor': fuel.color,
+                        'backgroundColor': fuel.background_color,
                         'tension': 0.1,
                         'pointRadius': 3,
                         'pointHoverRadius': 5
                     }
+                    for fuel in fuels
                 ]
             },
             'options': {
@@ -228,7 +226,8 @@ def index():
                 }
             }
         }
-        charts['cost_chart'] = json.dumps(cost_chart)
+        with measure_phase('serialize'):
+            charts['cost_chart'] = json.dumps(cost_chart)
         logger.info(f"Cost chart data created with {len(timestamps)} points")
         
         # Calculate savings
@@ -248,6 +247,24 @@ def index():
                 'diesel': cum_diesel[-1] if cum_diesel else 0
             }
         }
+        
+        # Totals and savings against every picked fuel, with the latest month's prices
+        last_prices = prices.for_month(*produced_series[-1][:2])
+        fuel_summary = []
+        for fuel in fuels:
+            total_fuel_cost = sum(costs[fuel.key])
+            fuel_savings = total_fuel_cost - total_electricity_cost
+            fuel_summary.append({
+                'label': fuel.label,
+                'unit': fuel.unit,
+                'energy_content': fuel.energy_content,
+                'price': last_prices[fuel.key][0],
+                'efficiency': last_prices[fuel.key][1],
+                'cost': round(total_fuel_cost, 2),
+                'savings': round(fuel_savings, 2),
+                'percentage': round(fuel_savings / total_fuel_cost * 100, 2) if total_fuel_cost > 0 else 0
+            })
+        charts['fuels'] = fuel_summary
     else:
         logger.warning("No energy data available to create cost chart")
     
@@ -256,6 +273,10 @@ def index():
         'charts': charts,
         'time_range': time_range,
         'energy_type': energy_type,
+        'device_id': device_id,
+        'devices': db.get_devices(),
+        'fuels': fuels,
+        'available_fuels': configured_fuels(),
         'aggregation': aggregation,
         'start_date': start_date,
         'end_date': end_date,
@@ -265,4 +286,5 @@ def index():
     # Clean up
     db.close_connection()
     
+    phase('render')
     return render_template('costs/index.html', **context)
@@ -5,6 +5,11 @@ import math
 from datetime import datetime, timedelta, date
 import calendar
 from app.db.models import Database
+from app.db.comparison import compare_periods
+from app.db.forecast import forecast
+from app.db.fuels import FuelPrices, configured_fuels, fuel_costs
+from app.db.prices import PriceResolver
+from app.metrics import phase, measure_phase
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('dashboard', __name__)
@@ -56,6 +61,23 @@ def get_date_range(time_range):
     
     return start_date, end_date
 
+def get_device_filter():
+    """Return the device ID selected in the filter bar, or None for all devices."""
+    device = request.args.get('device', default='')
+    try:
+        return int(device) if device not in ('', 'all') else None
+    except ValueError:
+        return None
+
+def get_fuel_filter():
+    """Return the fuels picked for the cost charts (?fuels=diesel,lpg), default all configured.
+    
+    Unknown or unconfigured fuels are ignored.
+    """
+    available = configured_fuels()
+    keys = request.args.get('fuels', default='').split(',')
+    return [fuel for fuel in available if fuel.key in keys] or available
+
 def aggregate_data(data, aggregation, date_key=0, avg_keys=None):
     """Aggregate data by day, week, month, quarter, or year.
     
@@ -188,15 +210,21 @@ def index():
         aggregation = calculated_aggregation
     
     # Get data from database
+    phase('db')
     db = Database()
-    energy_data = db.get_energy_data(start_date, end_date, energy_type)
+    device_id = get_device_filter()
+    fuels = get_fuel_filter()
+    energy_data = db.get_energy_data(start_date, end_date, energy_type, device_id)
     temp_data = db.get_temperature_data(start_date, end_date)
+    # Monthly prices for the cost chart and the diesel comparison
+    prices = PriceResolver(db)
     
     # Debug: Log the data retrieved
     logger.info(f"Retrieved {len(energy_data) if energy_data else 0} energy data points")
     logger.info(f"Retrieved {len(temp_data) if temp_data else 0} temperature data points")
     
     # Aggregate data if needed
+    phase('aggregate')
     logger.info(f"Using aggregation: {aggregation}")
     if aggregation != 'day':
         logger.info(f"Aggregating data with method: {aggregation}")
@@ -207,6 +235,7 @@ def index():
         logger.info(f"After aggregation: {len(energy_data) if energy_data else 0} energy data points, {len(temp_data) if temp_data else 0} temperature data points")
     
     # Create chart data
+    phase('charts')
     charts = {}
     
     # Italian day and month names
@@ -216,19 +245,19 @@ def index():
     
     # Log the first few data points to understand their structure
     if energy_data and len(energy_data) > 0:
-        logger.info(f"First data point type: {type(energy_data[0])}")
-        logger.info(f"First date type: {type(energy_data[0][0])}")
-        logger.info(f"First date value: {energy_data[0][0]}")
+        logger.debug(f"First data point type: {type(energy_data[0])}")
+        logger.debug(f"First date type: {type(energy_data[0][0])}")
+        logger.debug(f"First date value: {energy_data[0][0]}")
         
         # If it's a string, try to parse it
         if isinstance(energy_data[0][0], str):
-            logger.info(f"Date is a string: {energy_data[0][0]}")
+            logger.debug(f"Date is a string: {energy_data[0][0]}")
             try:
                 # Try to parse as date
                 parsed_date = datetime.strptime(energy_data[0][0], '%Y-%m-%d').date()
-                logger.info(f"Parsed date: {parsed_date}")
+                logger.debug(f"Parsed date: {parsed_date}")
             except ValueError as e:
-                logger.info(f"Could not parse date: {e}")
+                logger.debug(f"Could not parse date: {e}")
     
     # Energy chart
     if energy_data:
@@ -264,14 +293,14 @@ def index():
         for i, row in enumerate(energy_data):
             # Log a few rows to see what's happening
             if i < 5:
-                logger.info(f"Processing row {i}: {row}")
-                logger.info(f"Date type: {type(row[0])}")
+                logger.debug(f"Processing row {i}: {row}")
+                logger.debug(f"Date type: {type(row[0])}")
                 if isinstance(row[0], str):
-                    logger.info(f"Date string: {row[0]}")
+                    logger.debug(f"Date string: {row[0]}")
                 elif isinstance(row[0], date):
-                    logger.info(f"Date object: {row[0]}")
+                    logger.debug(f"Date object: {row[0]}")
                 else:
-                    logger.info(f"Unknown date type: {row[0]}")
+                    logger.debug(f"Unknown date type: {row[0]}")
             
             # Format date labels based on aggregation
             if isinstance(row[0], date):
@@ -283,33 +312,33 @@ def index():
                     formatted_date = f"{day_of_week}, {date_obj.day} {month_name}"
                     timestamps.append(formatted_date)
                     if i < 5:
-                        logger.info(f"Formatted daily date: {formatted_date}")
+                        logger.debug(f"Formatted daily date: {formatted_date}")
                 elif aggregation == 'week':
                     # Get ISO week number
                     year, week_num, _ = date_obj.isocalendar()
                     formatted_date = f"Settimana {week_num}, {year}"
                     timestamps.append(formatted_date)
                     if i < 5:
-                        logger.info(f"Formatted weekly date: {formatted_date}")
+                        logger.debug(f"Formatted weekly date: {formatted_date}")
                 elif aggregation == 'month':
                     # Format as "Mese YYYY"
                     month_name = italian_months[date_obj.month - 1]
                     formatted_date = f"{month_name} {date_obj.year}"
                     timestamps.append(formatted_date)
                     if i < 5:
-                        logger.info(f"Formatted monthly date: {formatted_date}")
+                        logger.debug(f"Formatted monthly date: {formatted_date}")
                 elif aggregation == 'year':
                     # Just show the year
                     formatted_date = f"Anno {date_obj.year}"
                     timestamps.append(formatted_date)
                     if i < 5:
-                        logger.info(f"Formatted yearly date: {formatted_date}")
+                        logger.debug(f"Formatted yearly date: {formatted_date}")
                 else:
                     # Default format
                     formatted_date = date_obj.strftime('%Y-%m-%d')
                     timestamps.append(formatted_date)
                     if i < 5:
-                        logger.info(f"Formatted default date: {formatted_date}")
+                        logger.debug(f"Formatted default date: {formatted_date}")
             elif isinstance(row[0], str):
                 if '-Q' in row[0]:
                     # Handle quarter format
@@ -318,11 +347,11 @@ def index():
                         formatted_date = f"Trimestre {parts[1]} {parts[0]}"
                         timestamps.append(formatted_date)
                         if i < 5:
-                            logger.info(f"Formatted quarterly date: {formatted_date}")
+                            logger.debug(f"Formatted quarterly date: {formatted_date}")
                     else:
                         timestamps.append(row[0])
                         if i < 5:
-                            logger.info(f"Using original string date: {row[0]}")
+                            logger.debug(f"Using original string date: {row[0]}")
                 else:
                     # Try to parse the date string
                     try:
@@ -334,22 +363,22 @@ def index():
                             formatted_date = f"{day_of_week}, {date_obj.day} {month_name}"
                             timestamps.append(formatted_date)
                             if i < 5:
-                                logger.info(f"Formatted daily date from string: {formatted_date}")
+                                logger.debug(f"Formatted daily date from string: {formatted_date}")
                         else:
                             # Use original string for other aggregations
                             timestamps.append(row[0])
                             if i < 5:
-                                logger.info(f"Using original string date: {row[0]}")
+                                logger.debug(f"Using original string date: {row[0]}")
                     except ValueError:
                         # If can't parse, use as is
                         timestamps.append(row[0])
                         if i < 5:
-                            logger.info(f"Could not parse date string, using as is: {row[0]}")
+                            logger.debug(f"Could not parse date string, using as is: {row[0]}")
             else:
                 # Use as is if not a date object or string
                 timestamps.append(str(row[0]))
                 if i < 5:
-                    logger.info(f"Using unknown date type as string: {str(row[0])}")
+                    logger.debug(f"Using unknown date type as string: {str(row[0])}")
             
             # Energy values
             consumed_values.append(float(row[1] or 0))  # Consumption
@@ -406,10 +435,10 @@ def index():
             aligned_temps = []
             
             # Debug temperature data
-            logger.info(f"Temperature data points: {len(temp_data)}")
+            logger.debug(f"Temperature data points: {len(temp_data)}")
             if len(temp_data) > 0:
-                logger.info(f"First temperature data point: {temp_data[0]}")
-                logger.info(f"Temperature data structure: {[type(row) for row in temp_data[:3]]}")
+                logger.debug(f"First temperature data point: {temp_data[0]}")
+                logger.debug(f"Temperature data structure: {[type(row) for row in temp_data[:3]]}")
             
             # Create a dictionary of temperature data by date for easy lookup
             temp_dict = {}
@@ -420,8 +449,8 @@ def index():
                 else:
                     temp_dict[str(date_key)] = outdoor_temps[i]
             
-            logger.info(f"Temperature dictionary keys: {list(temp_dict.keys())[:5]}")
-            logger.info(f"Energy timestamps: {timestamps[:5]}")
+            logger.debug(f"Temperature dictionary keys: {list(temp_dict.keys())[:5]}")
+            logger.debug(f"Energy timestamps: {timestamps[:5]}")
             
             # For each energy timestamp, find the corresponding temperature
             for i, date_val in enumerate(timestamps):
@@ -441,12 +470,12 @@ def index():
                 else:
                     # If still no match, log and use None
                     if i < 5:  # Only log first few to avoid spam
-                        logger.info(f"No temperature match for date: {date_val}, original: {original_date}")
+                        logger.debug(f"No temperature match for date: {date_val}, original: {original_date}")
                     aligned_temps.append(None)
             
-            logger.info(f"Aligned temperatures: {aligned_temps[:5]}")
-            logger.info(f"Number of aligned temperatures: {len(aligned_temps)}")
-            logger.info(f"Number of non-None temperatures: {sum(1 for t in aligned_temps if t is not None)}")
+            logger.debug(f"Aligned temperatures: {aligned_temps[:5]}")
+            logger.debug(f"Number of aligned temperatures: {len(aligned_temps)}")
+            logger.debug(f"Number of non-None temperatures: {sum(1 for t in aligned_temps if t is not None)}")
             
             # If we have no aligned temperatures, use the original temperature data
             if sum(1 for t in aligned_temps if t is not None) == 0:
@@ -532,7 +561,8 @@ def index():
             
             logger.info(f"Added temperature data to energy chart with {len(aligned_temps)} points")
         
-        charts['energy_chart'] = json.dumps(energy_chart)
+        with measure_phase('serialize'):
+            charts['energy_chart'] = json.dumps(energy_chart)
         logger.info(f"Energy chart data created with {len(timestamps)} points")
     else:
         logger.warning("No energy data available to create chart")
@@ -545,7 +575,7 @@ def index():
         # Prepare data for chart
         timestamps = []
         electricity_costs = []
-        diesel_costs = []
+        produced_series = []
         cop_values = []
         
         for row in energy_data:
@@ -591,32 +621,17 @@ def index():
             cop = float(row[3] or 3.5)  # COP value, default to 3.5 if None
             cop_values.append(cop)
             
-            # Get prices for this month/year
+            # Prices of the row's month/year
             year = row[0].year if isinstance(row[0], date) else current_date.year
             month = row[0].month if isinstance(row[0], date) else current_date.month
-            
-            price_data = db.get_prices_for_month(year, month)
-            
-            if price_data:
-                diesel_price = price_data['diesel_price']
-                diesel_efficiency = price_data['diesel_efficiency']
-            else:
-                # Default values if no price data
-                diesel_price = 1.50
-                diesel_efficiency = 0.85
-            
-            # Calculate diesel cost using the formula from cost_calculations.md
-            # Cost = (Produced / (DIESEL_EFFICIENCY * 10.5)) * DIESEL_PRICE
-            if energy_produced > 0:
-                diesel_cost = (energy_produced / (diesel_efficiency * 10.5)) * diesel_price
-            else:
-                diesel_cost = 0
-            
-            diesel_costs.append(diesel_cost)
+            produced_series.append((year, month, energy_produced))
+        
+        # Equivalent cost of each picked fuel, in one pass with shared prices
+        costs = fuel_costs(FuelPrices(db, prices), produced_series, fuels)
         
         # Cumulative costs
         cum_electricity = [sum(electricity_costs[:i+1]) for i in range(len(electricity_costs))]
-        cum_diesel = [sum(diesel_costs[:i+1]) for i in range(len(diesel_costs))]
+        cum_fuels = {key: [sum(values[:i+1]) for i in range(len(values))] for key, values in costs.items()}
         
         # Get period description for the chart title
         if time_range == 'ytd':
@@ -651,13 +666,15 @@ def index():
                         'backgroundColor': 'rgba(54, 162, 235, 0.2)',
                         'tension': 0.1
                     },
+                ] + [
                     {
-                        'label': 'Diesel Cost (€)',
-                        'data': cum_diesel,
-                        'borderColor': 'rgb(255, 159, 64)',
-                        'backgroundColor': 'rgba(255, 159, 64, 0.2)',
+                        'label': f'{fuel.label} Cost (€)',
+                        'data': cum_fuels[fuel.key],
+                        'borderColor': fuel.color,
+                        'backgroundColor': fuel.background_color,
                         'tension': 0.1
                     }
+                    for fuel in fuels
                 ]
             },
             'options': {
@@ -688,7 +705,8 @@ def index():
                 }
             }
         }
-        charts['cost_chart'] = json.dumps(cost_chart)
+        with measure_phase('serialize'):
+            charts['cost_chart'] = json.dumps(cost_chart)
         logger.info(f"Cost chart data created with {len(timestamps)} points")
     else:
         logger.warning("No cost data available to create chart")
@@ -698,6 +716,8 @@ def index():
         'charts': charts,
         'time_range': time_range,
         'energy_type': energy_type,
+        'device_id': device_id,
+        'devices': db.get_devices(),
         'aggregation': aggregation,
         'start_date': start_date,
         'end_date': end_date
@@ -714,7 +734,8 @@ def index():
         context['total_cost'] = round(total_cost, 2)
         
         # Calculate equivalent diesel cost
-        diesel_cost = db.calculate_diesel_cost(start_date, end_date)
+        with measure_phase('db'):
+            diesel_cost = db.calculate_diesel_cost(start_date, end_date, device_id, prices)
         context['diesel_cost'] = round(diesel_cost, 2)
         
         # Calculate savings
@@ -732,7 +753,87 @@ def index():
             avg_temp = sum(valid_temps) / len(valid_temps)
             context['avg_temperature'] = round(avg_temp, 1)
     
+    # Comparison mode: the same metrics for an earlier range, period by period
+    compare = request.args.get('compare', default='')
+    context['compare'] = compare
+    if compare:
+        phase('compare')
+        try:
+            comparison = compare_periods(db, start_date, end_date, compare, aggregation, energy_type, device_id)
+            context['comparison'] = comparison
+            charts['comparison_chart'] = json.dumps(build_comparison_chart(comparison))
+        except ValueError as e:
+            context['comparison_error'] = str(e)
+    
+    # Month-end and season-end forecasts, independent of the selected range
+    forecast_scenario = request.args.get('forecast', default='typical')
+    context['forecast_scenario'] = forecast_scenario
+    phase('forecast')
+    try:
+        context['forecast'] = forecast(db, energy_type=energy_type, device_id=device_id, scenario=forecast_scenario)
+    except ValueError as e:
+        context['forecast_error'] = str(e)
+    
     # Clean up
     db.close_connection()
     
+    phase('render')
     return render_template('dashboard/index.html', **context)
+
+def build_comparison_chart(comparison):
+    """Chart.js configuration of the consumption of two compared ranges, period by period."""
+    periods = comparison['periods']
+    return {
+        'type': 'bar',
+        'data': {
+            'labels': [period['period'] for period in periods],
+            'datasets': [
+                {
+                    'label': f"Consumo {comparison['start_date']} - {comparison['end_date']} (kWh)",
+                    'data': [period['energy_consumed']['current'] for period in periods],
+                    'backgroundColor': 'rgba(255, 99, 132, 0.5)',
+                    'borderColor': 'rgb(255, 99, 132)',
+                    'borderWidth': 1,
+                    'yAxisID': 'y'
+                },
+                {
+                    'label': f"Consumo {comparison['compare_start_date']} - {comparison['compare_end_date']} (kWh)",
+                    'data': [period['energy_consumed']['previous'] for period in periods],
+                    'backgroundColor': 'rgba(201, 203, 207, 0.5)',
+                    'borderColor': 'rgb(201, 203, 207)',
+                    'borderWidth': 1,
+                    'yAxisID': 'y'
+                },
+                {
+                    'label': 'Variazione consumo per grado giorno (%)',
+                    'data': [period['consumed_per_hdd']['delta_pct'] for period in periods],
+                    'borderColor': 'rgb(54, 162, 235)',
+                    'backgroundColor': 'rgba(54, 162, 235, 0)',
+                    'type': 'line',
+                    'yAxisID': 'y1',
+                    'tension': 0.1
+                }
+            ]
+        },
+        'options': {
+            'responsive': True,
+            'scales': {
+                'y': {
+                    'beginAtZero': True,
+                    'title': {'display': True, 'text': 'Energia (kWh)'},
+                    'position': 'left'
+                },
+                'y1': {
+                    'title': {'display': True, 'text': 'Variazione (%)'},
+                    'position': 'right',
+                    'grid': {'drawOnChartArea': False}
+                }
+            },
+            'plugins': {
+                'title': {
+                    'display': True,
+                    'text': 'Confronto consumi per periodo'
+                }
+            }
+        }
+    }
@@ -1,34 +1,74 @@
-from flask import Blueprint, jsonify, request
+import json
+import queue
+import base64
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app.config import config
 from app.db.models import Database
+from app.db.batch import run_batch
+from app.db.changes import MAX_CHANGES, fetch_changes
+from app.db.comparison import compare_periods
+from app.db.degree_days import ROLLUP_AGGREGATIONS, get_base_temperature, get_degree_days
+from app.db.export import FORMATS, export_data, fetch_page, get_export_range
+from app.db.forecast import forecast
+from app.db.fuels import FuelPrices, configured_fuels
+from app.db.performance import DEFAULT_BIN_WIDTH, cop_curve
+from app.db.scenarios import DEFAULT_PERCENTILES, simulate
+from app.events import TooManyClients, get_broker, replay_messages
+from app.metrics import phase
+from app.routes.dashboard import determine_aggregation, get_date_range
 from datetime import datetime, timedelta
 
 bp = Blueprint('data', __name__)
 
+# Rows per page of the v2 API
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Seconds between keepalive comments on idle live update streams
+SSE_KEEPALIVE_SECONDS = 15
+
+# Fields returned by the v2 API when none are requested
+DEFAULT_V2_FIELDS = {
+    'energy': ['energy_consumed', 'energy_produced', 'cop', 'power_consumption', 'cost'],
+    'temperature': None,
+    'prices': None
+}
+
 # Exempt API endpoints from CSRF protection
 @bp.route('/energy', methods=['GET'])
 def get_energy_data():
     """API endpoint for energy consumption data."""
     days = request.args.get('days', default=7, type=int)
+    device_id = request.args.get('device_id', default=None, type=int)
     
     # Calculate date range
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
     
-    # Get data from database
+    # Get data from database (summed over all devices unless one is requested)
+    phase('db')
     db = Database()
-    energy_data = db.get_energy_data(start_date, end_date)
+    # The response only changes with the data, so clients polling with
+    # If-None-Match get a 304 until something is written
+    etag = f"energy-{db.get_change_watermark()}-{end_date.date()}-{days}-{device_id}"
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    energy_data = db.get_energy_data(start_date, end_date, device_id=device_id)
     
     # Format data for API response
     result = []
     for row in energy_data:
         result.append({
-            'timestamp': row[0].isoformat(),
-            'power_consumption': row[1],
-            'energy_consumed': row[2],
-            'cost': row[3]
+            'timestamp': str(row['date']),
+            'power_consumption': row['power_consumption'],
+            'energy_consumed': row['total_energy_consumed'],
+            'cost': row['cost']
         })
     
-    return jsonify(result)
+    phase('serialize')
+    response = jsonify(result)
+    response.set_etag(etag)
+    return response
 
 @bp.route('/temperature', methods=['GET'])
 def get_temperature_data():
@@ -40,33 +80,534 @@ def get_temperature_data():
     start_date = end_date - timedelta(days=days)
     
     # Get data from database
+    phase('db')
     db = Database()
+    etag = f"temperature-{db.get_change_watermark()}-{end_date.date()}-{days}"
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
     temp_data = db.get_temperature_data(start_date, end_date)
     
     # Format data for API response
     result = []
     for row in temp_data:
+        # Only the outdoor temperature is stored
         result.append({
-            'timestamp': row[0].isoformat(),
-            'indoor_temp': row[1],
-            'outdoor_temp': row[2]
+            'timestamp': str(row['date']),
+            'indoor_temp': None,
+            'outdoor_temp': row['outdoor_temp']
         })
     
+    phase('serialize')
+    response = jsonify(result)
+    response.set_etag(etag)
+    return response
+
+def not_modified(etag):
+    """Return an empty 304 response for a client that already has the current data."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+@bp.route('/changes', methods=['GET'])
+def get_changes():
+    """API endpoint for the energy and price rows changed since a watermark.
+    
+    Query parameters: since (the watermark of the previous call, 0 or absent
+    for the whole history), limit and datasets (comma-separated: energy,
+    prices). Deleted rows come back as keys under 'deleted'. Call again with
+    the returned watermark until 'more' is false.
+    """
+    # Parsed by hand: type=int would turn a malformed watermark into 0, the whole history
+    try:
+        since = int(request.args.get('since') or 0)
+    except ValueError:
+        return jsonify({'error': 'since must be a change watermark (0 or more)'}), 400
+    limit = min(max(request.args.get('limit', default=1000, type=int), 1), MAX_CHANGES)
+    datasets = [name.strip() for name in request.args.get('datasets', '').split(',') if name.strip()]
+    if since < 0:
+        return jsonify({'error': 'since must be a change watermark (0 or more)'}), 400
+    
+    phase('db')
+    db = Database()
+    try:
+        changes = fetch_changes(db, since, limit, datasets)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
+    changes['since'] = since
+    return jsonify(changes)
+
+def parse_date_arg(name):
+    """Return a YYYY-MM-DD query parameter as a date, or None if it is missing."""
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+@bp.route('/export/<dataset>.<fmt>', methods=['GET'])
+def export(dataset, fmt):
+    """Stream energy, temperature or price history as CSV or NDJSON.
+    
+    Query parameters: start_date and end_date (YYYY-MM-DD, default the whole
+    history), fields (comma-separated), aggregation (none, day, week, month,
+    quarter, year or auto, as on the dashboard) and device_id.
+    """
+    try:
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
+    
+    fields = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+    aggregation = request.args.get('aggregation', default='none')
+    device_id = request.args.get('device_id', default=None, type=int)
+    
+    phase('db')
+    db = Database()
+    if aggregation == 'auto':
+        aggregation = determine_aggregation(*get_export_range(db, start_date, end_date))
+    
+    try:
+        chunks = export_data(db, dataset, fmt, start_date, end_date, fields, aggregation, device_id)
+    except ValueError as e:
+        db.close_connection()
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            db.close_connection()
+    
+    phase('serialize')
+    filename = f"{dataset}{'-' + aggregation if aggregation != 'none' else ''}.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=FORMATS[fmt][1],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def encode_cursor(key):
+    """Opaque page cursor for the key of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Key values from a page cursor; raises ValueError if it is malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid page cursor")
+    # Only scalar key values may reach the query; booleans are ints to isinstance
+    if not isinstance(key, list) or any(isinstance(value, bool) or not isinstance(value, (str, int, float))
+                                        for value in key):
+        raise ValueError("Invalid page cursor")
+    return key
+
+@bp.route('/v2/<dataset>', methods=['GET'])
+def get_page(dataset):
+    """Paged energy, temperature or price data.
+    
+    Query parameters: start_date and end_date (YYYY-MM-DD), fields
+    (comma-separated), aggregation (none, day, week, month, quarter, year or
+    auto), energy_type (total, heating or hot_water; picks the columns of the
+    energy_consumed and energy_produced fields), device_id, limit, cursor
+    (next_cursor of the previous page) and format (rows or columnar).
+    
+    Pages are read with keyset pagination on (date), (device_id, date) or the
+    period, so every page costs the same however deep into the history it is.
+    """
+    try:
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
+    
+    fields = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+    if not fields:
+        fields = DEFAULT_V2_FIELDS.get(dataset)
+    aggregation = request.args.get('aggregation', default='none')
+    energy_type = request.args.get('energy_type', default='total')
+    device_id = request.args.get('device_id', default=None, type=int)
+    limit = min(max(request.args.get('limit', default=DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    columnar = request.args.get('format', default='rows') == 'columnar'
+    
+    phase('db')
+    db = Database()
+    try:
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        if aggregation == 'auto':
+            aggregation = determine_aggregation(*get_export_range(db, start_date, end_date))
+        columns, rows, next_key = fetch_page(db, dataset, limit, after, start_date=start_date, end_date=end_date,
+                                             fields=fields, aggregation=aggregation, device_id=device_id,
+                                             energy_type=energy_type)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
+    if columnar:
+        data = {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+    else:
+        data = [dict(zip(columns, row)) for row in rows]
+    
+    return jsonify({
+        'fields': columns,
+        'aggregation': aggregation,
+        'count': len(rows),
+        'data': data,
+        'next_cursor': encode_cursor(next_key) if next_key is not None else None
+    })
+
+def parse_series_request(spec):
+    """Turn one series of a batch request body into run_batch arguments."""
+    if not isinstance(spec, dict):
+        raise ValueError("Each series must be an object")
+    series = dict(spec)
+    
+    if spec.get('time_range') and not spec.get('start_date'):
+        series['start_date'], series['end_date'] = get_date_range(spec['time_range'])
+    else:
+        try:
+            series['start_date'] = datetime.strptime(spec.get('start_date') or '', '%Y-%m-%d').date()
+            series['end_date'] = datetime.strptime(spec.get('end_date') or '', '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError("Each series needs a time_range or start_date and end_date (YYYY-MM-DD)")
+    series.pop('time_range', None)
+    
+    if series.get('aggregation', 'auto') == 'auto':
+        series['aggregation'] = determine_aggregation(series['start_date'], series['end_date'])
+    if series.get('device_id') is not None:
+        series['device_id'] = int(series['device_id'])
+    return series
+
+@bp.route('/batch', methods=['POST'])
+def batch():
+    """Several named series (range, aggregation, metrics) in one request.
+    
+    The body is {"series": {"<name>": {"time_range": "30d"} or
+    {"start_date": ..., "end_date": ...}, plus optional "aggregation",
+    "metrics", "energy_type" and "device_id"}}. All series share one scan of
+    energy_data and one load of the monthly prices.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('series'), dict):
+        return jsonify({'error': 'Expected a JSON object with a "series" object'}), 400
+    
+    phase('db')
+    db = Database()
+    try:
+        requests = {name: parse_series_request(spec) for name, spec in body['series'].items()}
+        results = run_batch(db, requests)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
+    return jsonify({'series': results})
+
+@bp.route('/events', methods=['GET'])
+def events():
+    """Server-Sent Events stream of data changes.
+    
+    Every commit of the collectors or of the price settings becomes one
+    'data' event carrying its source, the changed date range and the new
+    daily values of those dates. Clients reconnecting with Last-Event-ID
+    (or ?last_event_id=) first receive the events they missed.
+    """
+    broker = get_broker()
+    try:
+        subscription = broker.subscribe()
+    except TooManyClients as e:
+        return jsonify({'error': str(e)}), 503
+    
+    replay = []
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id and last_event_id.isdigit():
+        phase('db')
+        db = Database()
+        replay = replay_messages(db, int(last_event_id))
+        db.close_connection()
+    
+    def generate():
+        try:
+            yield f"retry: {int(broker.poll_interval * 1000) + 1000}\n\n"
+            yield from replay
+            while True:
+                try:
+                    message = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Keeps proxies from closing the idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            broker.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/compare', methods=['GET'])
+def compare():
+    """API endpoint comparing a date range with an earlier one, period by aligned period.
+    
+    Query parameters: start_date and end_date (YYYY-MM-DD) or time_range (as
+    on the dashboard), offset (previous, year or e.g. 7d, 4w, 3m, 1y),
+    aggregation (day, week, month, quarter, year, total or auto),
+    energy_type, device_id and base_temperature (of the degree days).
+    """
+    try:
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
+    if start_date is None or end_date is None:
+        start_date, end_date = get_date_range(request.args.get('time_range', default='30d'))
+    
+    aggregation = request.args.get('aggregation', default='total')
+    if aggregation == 'auto':
+        aggregation = determine_aggregation(start_date, end_date)
+    
+    phase('db')
+    db = Database()
+    try:
+        comparison = compare_periods(
+            db, start_date, end_date,
+            offset=request.args.get('offset', default='previous'),
+            aggregation=aggregation,
+            energy_type=request.args.get('energy_type', default='total'),
+            device_id=request.args.get('device_id', default=None, type=int),
+            base_temperature=request.args.get('base_temperature', default=None, type=float)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
+    return jsonify(comparison)
+
+@bp.route('/degree-days', methods=['GET'])
+def degree_days():
+    """API endpoint for heating degree days per day or period.
+    
+    Query parameters: start_date and end_date (YYYY-MM-DD) or time_range,
+    aggregation (day, week, month, quarter, year or auto) and
+    base_temperature (default HDD_BASE_TEMPERATURE).
+    """
+    try:
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
+    if start_date is None or end_date is None:
+        start_date, end_date = get_date_range(request.args.get('time_range', default='30d'))
+    
+    aggregation = request.args.get('aggregation', default='day')
+    if aggregation == 'auto':
+        aggregation = determine_aggregation(start_date, end_date)
+    if aggregation != 'day' and aggregation not in ROLLUP_AGGREGATIONS:
+        return jsonify({'error': f'Unknown aggregation: {aggregation}'}), 400
+    base_temperature = request.args.get('base_temperature', default=None, type=float)
+    
+    phase('db')
+    db = Database()
+    try:
+        periods = get_degree_days(db, start_date, end_date, aggregation, base_temperature)
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
+    return jsonify({
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'aggregation': aggregation,
+        'base_temperature': base_temperature if base_temperature is not None else get_base_temperature(),
+        'periods': periods
+    })
+
+@bp.route('/cop-curve', methods=['GET'])
+def get_cop_curve():
+    """API endpoint for COP as a function of the outdoor temperature.
+    
+    Query parameters: start_date and end_date (YYYY-MM-DD) or time_range,
+    bin_width (°C), resolution (day or hour), energy_type and device_id.
+    """
+    try:
+        start_date = parse_date_arg('start_date')
+        end_date = parse_date_arg('end_date')
+    except ValueError:
+        return jsonify({'error': 'Dates must use the YYYY-MM-DD format'}), 400
+    if start_date is None or end_date is None:
+        start_date, end_date = get_date_range(request.args.get('time_range', default='1y'))
+    
+    phase('db')
+    db = Database()
+    try:
+        curve = cop_curve(
+            db, start_date, end_date,
+            energy_type=request.args.get('energy_type', default='total'),
+            device_id=request.args.get('device_id', default=None, type=int),
+            bin_width=request.args.get('bin_width', default=DEFAULT_BIN_WIDTH, type=int),
+            resolution=request.args.get('resolution', default='day')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
+    return jsonify(curve)
+
+@bp.route('/forecast', methods=['GET'])
+def get_forecast():
+    """API endpoint for the month-end and heating-season-end consumption and cost forecast.
+    
+    Query parameters: energy_type, device_id and the temperature scenario:
+    scenario (typical, cold or warm), temperature_offset (°C added to the
+    typical weather) or temperature (a fixed daily mean).
+    """
+    phase('db')
+    db = Database()
+    try:
+        result = forecast(
+            db,
+            energy_type=request.args.get('energy_type', default='total'),
+            device_id=request.args.get('device_id', default=None, type=int),
+            scenario=request.args.get('scenario', default='typical'),
+            temperature_offset=request.args.get('temperature_offset', default=None, type=float),
+            temperature=request.args.get('temperature', default=None, type=float)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
+    return jsonify(result)
+
+@bp.route('/scenarios', methods=['POST'])
+def price_scenarios():
+    """Heat pump vs diesel cost of a range under many monthly price scenarios.
+    
+    The body is {"time_range": "1y"} or {"start_date": ..., "end_date": ...},
+    plus "scenarios" (a list of {"name", "electricity_price", "diesel_price",
+    "diesel_efficiency"}, each price a number, a list with one price per month
+    or an object of "YYYY-MM" prices), "monte_carlo" ({"count", "seed",
+    "electricity_volatility", "diesel_volatility", "drift", "correlation"}),
+    and optional "energy_type", "device_id" and "percentiles". Nothing is
+    written to the database.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    
+    phase('db')
+    db = Database()
+    try:
+        if body.get('time_range') and not body.get('start_date'):
+            start_date, end_date = get_date_range(body['time_range'])
+        else:
+            try:
+                start_date = datetime.strptime(body.get('start_date') or '', '%Y-%m-%d').date()
+                end_date = datetime.strptime(body.get('end_date') or '', '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError("Expected a time_range or start_date and end_date (YYYY-MM-DD)")
+        if body.get('monte_carlo') is not None and not isinstance(body['monte_carlo'], dict):
+            raise ValueError("monte_carlo must be an object")
+        if body.get('scenarios') is not None and not isinstance(body['scenarios'], list):
+            raise ValueError("scenarios must be a list")
+        result = simulate(
+            db, start_date, end_date,
+            scenarios=body.get('scenarios'),
+            monte_carlo=body.get('monte_carlo'),
+            energy_type=body.get('energy_type', 'total'),
+            device_id=int(body['device_id']) if body.get('device_id') is not None else None,
+            percentiles=[float(p) for p in body.get('percentiles', DEFAULT_PERCENTILES)]
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        db.close_connection()
+    
+    phase('serialize')
     return jsonify(result)
 
 @bp.route('/prices', methods=['GET'])
 def get_prices():
-    """API endpoint for current energy prices."""
-    import os
-    from dotenv import load_dotenv
-    
-    # Load current prices from .env
-    load_dotenv()
+    """API endpoint for current energy prices.
     
+    'fuels' lists the configured comparison fuels with this month's price
+    and efficiency.
+    """
+    # Current prices from .env
     prices = {
-        'electricity': float(os.getenv('ELECTRICITY_PRICE', '0.28')),
-        'diesel': float(os.getenv('DIESEL_PRICE', '1.50')),
-        'diesel_efficiency': float(os.getenv('DIESEL_EFFICIENCY', '0.85'))
+        'electricity': config.get_float('ELECTRICITY_PRICE', '0.28'),
+        'diesel': config.get_float('DIESEL_PRICE', '1.50'),
+        'diesel_efficiency': config.get_float('DIESEL_EFFICIENCY', '0.85')
     }
     
+    phase('db')
+    db = Database()
+    today = datetime.now()
+    month_prices = FuelPrices(db).for_month(today.year, today.month)
+    db.close_connection()
+    prices['fuels'] = [
+        dict(fuel.to_dict(), price=month_prices[fuel.key][0], efficiency=month_prices[fuel.key][1])
+        for fuel in configured_fuels()
+    ]
+    
+    phase('serialize')
     return jsonify(prices)
+
+@bp.route('/collector-runs', methods=['GET'])
+def get_collector_runs():
+    """API endpoint for the telemetry of recent collector runs, oldest first."""
+    limit = min(request.args.get('limit', default=100, type=int), 1000)
+    collector = request.args.get('collector', default=None)
+    
+    phase('db')
+    db = Database()
+    runs = db.get_collector_runs(limit, collector)
+    sources = {}
+    for row in db.get_collector_run_sources([run['run_id'] for run in runs]):
+        sources.setdefault(row['run_id'], {})[row['source']] = {
+            'api_calls': row['api_calls'],
+            'failures': row['failures'],
+            'retries': row['retries'],
+            'avg_latency_ms': round(row['total_ms'] / row['api_calls'], 1) if row['api_calls'] else None,
+            'max_latency_ms': round(row['max_ms'], 1),
+            'rows_inserted': row['rows_inserted'],
+            'rows_updated': row['rows_updated'],
+            'rows_unchanged': row['rows_unchanged']
+        }
+    db.close_connection()
+    
+    # Format data for API response
+    result = []
+    for run in reversed(runs):
+        duration = run['duration_seconds'] or 0
+        rows = run['rows_inserted'] + run['rows_updated'] + run['rows_unchanged']
+        result.append({
+            'run_id': run['run_id'],
+            'collector': run['collector'],
+            'started_at': str(run['started_at']),
+            'finished_at': str(run['finished_at']) if run['finished_at'] else None,
+            'duration_seconds': round(duration, 3),
+            'status': run['status'],
+            'dates_missing': run['dates_missing'],
+            'dates_collected': run['dates_collected'],
+            'api_calls': run['api_calls'],
+            'failures': run['failures'],
+            'retries': run['retries'],
+            'rows_inserted': run['rows_inserted'],
+            'rows_updated': run['rows_updated'],
+            'rows_unchanged': run['rows_unchanged'],
+            'rows_per_second': round(rows / duration, 2) if duration > 0 else None,
+            'last_error': run['last_error'],
+            'sources': sources.get(run['run_id'], {})
+        })
+    
+    phase('serialize')
+    return jsonify(result)
@@ -1,13 +1,13 @@
 from flask import (
     Blueprint, render_template, request, redirect, url_for, flash, jsonify
 )
-import os
 import asyncio
 import logging
 import datetime
-from dotenv import load_dotenv, set_key
+from dotenv import set_key
+from app.config import config
 from app.db.models import Database
-from app.data_fetchers import update_prices
+from app.db.fuels import FUELS, TABLE_FUELS
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('settings', __name__)
@@ -20,9 +20,6 @@ def index():
 @bp.route('/prices', methods=('GET', 'POST'))
 def prices():
     """Settings page for configuring prices."""
-    # Load current settings from .env
-    load_dotenv()
-    
     # Add debug logging
     logger.info(f"Request method: {request.method}")
     if request.method == 'POST':
@@ -82,10 +79,11 @@ def prices():
                     # Update current prices in .env file if this is the current month
                     current_date = datetime.datetime.now()
                     if year == current_date.year and month == current_date.month:
-                        dotenv_path = os.path.join(os.getcwd(), '.env')
+                        dotenv_path = config.env_path
                         set_key(dotenv_path, 'ELECTRICITY_PRICE', str(electricity_price))
                         set_key(dotenv_path, 'DIESEL_PRICE', str(diesel_price))
                         set_key(dotenv_path, 'DIESEL_EFFICIENCY', str(diesel_efficiency))
+                        config.refresh(force=True)
                     
                     # Trigger recalculation of energy costs
                     start_date = datetime.date(year, month, 1)
@@ -102,6 +100,30 @@ def prices():
                     logger.error(f"Error updating price row: {str(e)}")
                     flash(f'Errore durante l\'aggiornamento dei prezzi: {str(e)}', 'danger')
         
+        # Monthly price of one of the other comparison fuels
+        elif 'update_fuel_price' in request.form:
+            fuel = request.form.get('fuel', '')
+            try:
+                year = int(request.form.get('fuel_year', ''))
+                month = int(request.form.get('fuel_month', ''))
+                price = float(request.form.get('fuel_price', ''))
+                efficiency = float(request.form.get('fuel_efficiency', ''))
+            except ValueError:
+                flash('Invalid numeric values', 'danger')
+            else:
+                if fuel not in TABLE_FUELS or year < 2000 or year > 2100 or month < 1 or month > 12 or \
+                   price <= 0 or not (0 < efficiency <= 1.2):
+                    flash('Invalid values', 'danger')
+                else:
+                    try:
+                        db = Database()
+                        db.update_fuel_price(fuel, price, efficiency, year, month)
+                        db.close_connection()
+                        flash(f'Prezzo {FUELS[fuel].label} per {month}/{year} aggiornato con successo', 'success')
+                    except Exception as e:
+                        logger.error(f"Error updating fuel price: {str(e)}")
+                        flash(f'Errore durante l\'aggiornamento dei prezzi: {str(e)}', 'danger')
+        
         # Legacy price update (for current month)
         elif 'update_prices' in request.form:
             electricity_price = request.form.get('electricity_price', '')
@@ -135,10 +157,11 @@ def prices():
             if not errors:
                 try:
                     # Update .env file
-                    dotenv_path = os.path.join(os.getcwd(), '.env')
+                    dotenv_path = config.env_path
                     set_key(dotenv_path, 'ELECTRICITY_PRICE', str(electricity_price))
                     set_key(dotenv_path, 'DIESEL_PRICE', str(diesel_price))
                     set_key(dotenv_path, 'DIESEL_EFFICIENCY', str(diesel_efficiency))
+                    config.refresh(force=True)
                     
                     # Log the values being passed to update_prices
                     logger.info(f"Calling update_prices with - Electricity: {electricity_price}, Diesel: {diesel_price}, Efficiency: {diesel_efficiency}")
@@ -167,6 +190,18 @@ def prices():
     # Get price history from database
     db = Database()
     price_history = db.get_all_prices()
+    fuel_price_history = [
+        {
+            'fuel': row['fuel'],
+            'label': FUELS[row['fuel']].label if row['fuel'] in FUELS else row['fuel'],
+            'unit': FUELS[row['fuel']].unit if row['fuel'] in FUELS else '',
+            'year': row['year'],
+            'month': row['month'],
+            'price': row['price'],
+            'efficiency': row['efficiency']
+        }
+        for row in db.get_fuel_prices()
+    ]
     db.close_connection()
     
     # Format monthly prices for display
@@ -185,9 +220,9 @@ def prices():
     
     # Load settings from .env
     settings = {
-        'electricity_price': os.getenv('ELECTRICITY_PRICE', '0.25'),
-        'diesel_price': os.getenv('DIESEL_PRICE', '1.5'),
-        'diesel_efficiency': os.getenv('DIESEL_EFFICIENCY', '0.85'),
+        'electricity_price': config.get('ELECTRICITY_PRICE', '0.25'),
+        'diesel_price': config.get('DIESEL_PRICE', '1.5'),
+        'diesel_efficiency': config.get('DIESEL_EFFICIENCY', '0.85'),
         'current_year': current_date.year,
         'current_month': current_date.month
     }
@@ -195,14 +230,13 @@ def prices():
     return render_template('settings/prices.html', 
                            settings=settings, 
                            price_history=formatted_price_history,
+                           fuels=[FUELS[key] for key in TABLE_FUELS],
+                           fuel_price_history=fuel_price_history,
                            current_date=current_date)
 
 @bp.route('/connections', methods=('GET', 'POST'))
 def connections():
     """Settings page for configuring data source connections."""
-    # Load current settings from .env
-    load_dotenv()
-    
     # Add debug logging
     logger.info(f"Request method: {request.method}")
     if request.method == 'POST':
@@ -223,9 +257,10 @@ def connections():
             if not errors:
                 try:
                     # Update .env file
-                    dotenv_path = os.path.join(os.getcwd(), '.env')
+                    dotenv_path = config.env_path
                     set_key(dotenv_path, 'MELCLOUD_USERNAME', melcloud_username)
                     set_key(dotenv_path, 'MELCLOUD_PASSWORD', melcloud_password)
+                    config.refresh(force=True)
                     
                     flash('MELCloud credentials updated successfully', 'success')
                     logger.info("MELCloud credentials updated successfully")
@@ -248,9 +283,10 @@ def connections():
             if not errors:
                 try:
                     # Update .env file
-                    dotenv_path = os.path.join(os.getcwd(), '.env')
+                    dotenv_path = config.env_path
                     set_key(dotenv_path, 'HASS_URL', hass_url)
                     set_key(dotenv_path, 'HASS_TOKEN', hass_token)
+                    config.refresh(force=True)
                     
                     flash('Home Assistant configuration updated successfully', 'success')
                     logger.info("Home Assistant configuration updated successfully")
@@ -263,16 +299,31 @@ def connections():
     
     # Load settings from .env
     settings = {
-        'melcloud_username': os.getenv('MELCLOUD_USERNAME', ''),
-        'melcloud_password': os.getenv('MELCLOUD_PASSWORD', ''),
-        'hass_url': os.getenv('HASS_URL', ''),
-        'hass_token': os.getenv('HASS_TOKEN', '')
+        'melcloud_username': config.get('MELCLOUD_USERNAME', ''),
+        'melcloud_password': config.get('MELCLOUD_PASSWORD', ''),
+        'hass_url': config.get('HASS_URL', ''),
+        'hass_token': config.get('HASS_TOKEN', '')
     }
     
     return render_template('settings/connections.html', 
                            settings=settings,
                            current_date=current_date)
 
+@bp.route('/collector-runs')
+def collector_runs():
+    """History of the collector runs: duration, throughput, API calls and errors."""
+    collector = request.args.get('collector') or None
+    
+    db = Database()
+    runs = db.get_collector_runs(50, collector)
+    collectors = db.get_collector_names()
+    db.close_connection()
+    
+    return render_template('settings/collector_runs.html',
+                           runs=runs,
+                           collectors=collectors,
+                           collector=collector)
+
 @bp.route('/test-connection', methods=['POST'])
 def test_connection():
     """Test connections to MELCloud and Home Assistant."""
@@ -280,10 +331,8 @@ def test_connection():
     
     if service == 'melcloud':
         try:
-            # Load credentials from .env
-            load_dotenv()
-            username = os.getenv('MELCLOUD_USERNAME')
-            password = os.getenv('MELCLOUD_PASSWORD')
+            username = config.get('MELCLOUD_USERNAME')
+            password = config.get('MELCLOUD_PASSWORD')
             
             if not username or not password:
                 flash('MELCloud credentials not configured', 'warning')
@@ -300,10 +349,8 @@ def test_connection():
     
     elif service == 'homeassistant':
         try:
-            # Load credentials from .env
-            load_dotenv()
-            hass_url = os.getenv('HASS_URL')
-            hass_token = os.getenv('HASS_TOKEN')
+            hass_url = config.get('HASS_URL')
+            hass_token = config.get('HASS_TOKEN')
             
             if not hass_url or not hass_token:
                 flash('Home Assistant configuration not complete', 'warning')
@@ -1,10 +1,11 @@
 from flask import Blueprint, render_template, request
-import plotly.graph_objects as go
 import json
 import logging
 from datetime import datetime, timedelta, date
 from app.db.models import Database
-from app.routes.dashboard import get_date_range, determine_aggregation, aggregate_data
+from app.db.performance import DEFAULT_BIN_WIDTH, cop_curve
+from app.metrics import phase, measure_phase
+from app.routes.dashboard import get_date_range, determine_aggregation, aggregate_data, get_device_filter
 
 logger = logging.getLogger(__name__)
 bp = Blueprint('temperature', __name__)
@@ -36,17 +37,20 @@ def index():
         aggregation = calculated_aggregation
     
     # Get data from database
+    phase('db')
     db = Database()
     temp_data = db.get_temperature_data(start_date, end_date)
     
     # Get energy data for COP
-    energy_data = db.get_energy_data(start_date, end_date, energy_type)
+    device_id = get_device_filter()
+    energy_data = db.get_energy_data(start_date, end_date, energy_type, device_id)
     
     # Debug: Log the data retrieved
     logger.info(f"Retrieved {len(temp_data) if temp_data else 0} temperature data points")
     logger.info(f"Retrieved {len(energy_data) if energy_data else 0} energy data points")
     
     # Aggregate data if needed
+    phase('aggregate')
     logger.info(f"Using aggregation: {aggregation}")
     if aggregation != 'day':
         logger.info(f"Aggregating data with method: {aggregation}")
@@ -57,6 +61,7 @@ def index():
         logger.info(f"After aggregation: {len(temp_data) if temp_data else 0} temperature data points, {len(energy_data) if energy_data else 0} energy data points")
     
     # Create graphs
+    phase('charts')
     charts = {}
     
     # Italian day and month names
@@ -276,7 +281,8 @@ def index():
             }
         }
         
-        charts['combined_chart'] = json.dumps(combined_chart)
+        with measure_phase('serialize'):
+            charts['combined_chart'] = json.dumps(combined_chart)
         logger.info(f"Combined chart data created with {len(temp_timestamps)} points")
     else:
         logger.warning("Insufficient data to create combined chart")
@@ -376,7 +382,8 @@ def index():
                     }
                 }
             }
-            charts['temp_chart'] = json.dumps(temp_chart)
+            with measure_phase('serialize'):
+                charts['temp_chart'] = json.dumps(temp_chart)
             logger.info(f"Temperature chart data created with {len(temp_timestamps)} points")
         
         if energy_data:
@@ -476,7 +483,8 @@ def index():
                     }
                 }
             }
-            charts['cop_chart'] = json.dumps(cop_chart)
+            with measure_phase('serialize'):
+                charts['cop_chart'] = json.dumps(cop_chart)
             logger.info(f"COP chart data created with {len(cop_timestamps)} points")
     
     # Prepare context for the template
@@ -484,6 +492,8 @@ def index():
         'charts': charts,
         'time_range': time_range,
         'energy_type': energy_type,
+        'device_id': device_id,
+        'devices': db.get_devices(),
         'aggregation': aggregation,
         'start_date': start_date,
         'end_date': end_date,
@@ -493,8 +503,121 @@ def index():
     # Clean up
     db.close_connection()
     
+    phase('render')
     return render_template('temperature/index.html', **context)
 
+@bp.route('/performance')
+def performance():
+    """COP as a function of the outdoor temperature, binned by temperature."""
+    time_range = request.args.get('time_range', default='1y')
+    energy_type = request.args.get('energy_type', default='total')
+    start_date, end_date = get_date_range(time_range)
+    bin_width = request.args.get('bin_width', default=DEFAULT_BIN_WIDTH, type=int)
+    resolution = request.args.get('resolution', default='day')
+    
+    phase('db')
+    db = Database()
+    device_id = get_device_filter()
+    error = None
+    try:
+        curve = cop_curve(db, start_date, end_date, energy_type, device_id, bin_width, resolution)
+    except ValueError as e:
+        logger.warning(f"Cannot build the COP curve: {e}")
+        curve = {'bins': []}
+        error = str(e)
+    
+    phase('charts')
+    charts = {}
+    bins = curve['bins']
+    if bins:
+        labels = [f"{row['temperature_min']} / {row['temperature_max']} °C" for row in bins]
+        
+        def line(label, key, color, **extra):
+            dataset = {
+                'label': label,
+                'data': [round(row[key], 2) if row[key] is not None else None for row in bins],
+                'type': 'line',
+                'borderColor': color,
+                'backgroundColor': color,
+                'borderWidth': 2,
+                'pointRadius': 3,
+                'fill': False,
+                'yAxisID': 'y',
+                'order': 0
+            }
+            dataset.update(extra)
+            return dataset
+        
+        curve_chart = {
+            'type': 'bar',
+            'data': {
+                'labels': labels,
+                'datasets': [
+                    line('COP mediano', 'cop_p50', 'rgb(75, 192, 192)', borderWidth=3),
+                    line('COP medio', 'cop_mean', 'rgb(54, 162, 235)'),
+                    line('10° percentile', 'cop_p10', 'rgba(255, 159, 64, 0.8)', borderDash=[6, 4], pointRadius=0),
+                    line('90° percentile', 'cop_p90', 'rgba(255, 159, 64, 0.8)', borderDash=[6, 4], pointRadius=0,
+                         fill='-1', backgroundColor='rgba(255, 159, 64, 0.1)'),
+                    {
+                        'label': 'Giorni' if resolution == 'day' else 'Ore',
+                        'data': [row['count'] for row in bins],
+                        'backgroundColor': 'rgba(201, 203, 207, 0.5)',
+                        'borderColor': 'rgb(201, 203, 207)',
+                        'borderWidth': 1,
+                        'yAxisID': 'y1',
+                        'order': 1
+                    }
+                ]
+            },
+            'options': {
+                'responsive': True,
+                'maintainAspectRatio': False,
+                'scales': {
+                    'x': {
+                        'title': {'display': True, 'text': 'Temperatura esterna (°C)'}
+                    },
+                    'y': {
+                        'beginAtZero': True,
+                        'position': 'left',
+                        'title': {'display': True, 'text': 'COP'}
+                    },
+                    'y1': {
+                        'beginAtZero': True,
+                        'position': 'right',
+                        'title': {'display': True, 'text': 'Giorni' if resolution == 'day' else 'Ore'},
+                        'grid': {'drawOnChartArea': False}
+                    }
+                },
+                'plugins': {
+                    'title': {
+                        'display': True,
+                        'text': f'COP per temperatura esterna ({start_date} - {end_date})'
+                    }
+                }
+            }
+        }
+        with measure_phase('serialize'):
+            charts['curve_chart'] = json.dumps(curve_chart)
+    
+    context = {
+        'charts': charts,
+        'bins': bins,
+        'error': error,
+        'time_range': time_range,
+        'energy_type': energy_type,
+        'device_id': device_id,
+        'devices': db.get_devices(),
+        'bin_width': bin_width,
+        'resolution': resolution,
+        'start_date': start_date,
+        'end_date': end_date,
+        'active_page': 'temperature'
+    }
+    db.close_connection()
+    
+    phase('render')
+    return render_template('temperature/performance.html', **context)
+
 @bp.route('/edit', methods=('GET', 'POST'))
 def edit():
     """Settings page for editing temperature data."""
@@ -618,6 +741,7 @@ def edit():
     # Clean up
     db.close_connection()
     
+    phase('render')
     return render_template('temperature/edit.html', 
                            temp_data=formatted_temp_data,
                            years=years_list,
@@ -11,3 +11,126 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 5000);
     });
 });
+
+// Live updates: one EventSource on /data/events per page. Charts showing
+// daily values get the new points of each event appended or replaced in
+// place; anything else (aggregated or per-device charts, summary cards)
+// shows a notice offering to reload the page.
+window.EnergyInsight = (function() {
+    const ITALIAN_DAYS = ['Domenica', 'Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato'];
+    const ITALIAN_MONTHS = ['Gennaio', 'Febbraio', 'Marzo', 'Aprile', 'Maggio', 'Giugno',
+                            'Luglio', 'Agosto', 'Settembre', 'Ottobre', 'Novembre', 'Dicembre'];
+    const SOURCES = {melcloud: 'MELCloud', homeassistant: 'Home Assistant', prices: 'prezzi'};
+
+    const charts = [];
+    let range = null;
+    let source = null;
+    let lastEventId = 0;
+
+    // Same label as the day aggregation of the chart views ("Lunedì, 5 Maggio")
+    function dayLabel(dateString) {
+        const parts = dateString.split('-').map(Number);
+        const day = new Date(parts[0], parts[1] - 1, parts[2]);
+        return ITALIAN_DAYS[day.getDay()] + ', ' + day.getDate() + ' ' + ITALIAN_MONTHS[day.getMonth()];
+    }
+
+    function inRange(startDate, endDate) {
+        return !range || (startDate <= range.endDate && endDate >= range.startDate);
+    }
+
+    function showNotice(event) {
+        let notice = document.getElementById('live-update-notice');
+        if (!notice) {
+            notice = document.createElement('div');
+            notice.id = 'live-update-notice';
+            notice.className = 'alert alert-info shadow position-fixed bottom-0 end-0 m-3';
+            notice.style.zIndex = 1050;
+            document.body.appendChild(notice);
+        }
+        const period = event.start_date === event.end_date ? event.start_date : event.start_date + ' - ' + event.end_date;
+        notice.innerHTML = 'Nuovi dati disponibili (' + (SOURCES[event.source] || event.source) + ', ' + period + '). ' +
+            '<a href="#" class="alert-link" onclick="window.location.reload(); return false;">Aggiorna</a>';
+    }
+
+    function applyPoints(entry, points) {
+        const chart = entry.chart;
+        const labels = chart.data.labels;
+        points.forEach(point => {
+            if (point.date < entry.startDate || point.date > entry.endDate) {
+                return;
+            }
+            const values = point[entry.energyType] || {};
+            let index = labels.indexOf(dayLabel(point.date));
+            if (index < 0) {
+                labels.push(dayLabel(point.date));
+                chart.data.datasets.forEach(dataset => dataset.data.push(null));
+                index = labels.length - 1;
+            }
+            entry.datasets.forEach((spec, i) => {
+                if (!spec || !chart.data.datasets[i]) {
+                    return;
+                }
+                const value = spec.metric === 'outdoor_temp' ? point.outdoor_temp : values[spec.metric];
+                chart.data.datasets[i].data[index] = value === null || value === undefined ? spec.fallback : value;
+            });
+        });
+        chart.update('none');
+    }
+
+    function handleEvent(message) {
+        const eventId = Number(message.lastEventId);
+        if (eventId && eventId <= lastEventId) {
+            return;  // Already applied (replayed after a reconnect)
+        }
+        lastEventId = eventId || lastEventId;
+
+        const event = JSON.parse(message.data);
+        if (!inRange(event.start_date, event.end_date)) {
+            return;
+        }
+
+        let applied = false;
+        charts.forEach(entry => {
+            if (event.points && entry.aggregation === 'day' && entry.deviceId === null) {
+                applyPoints(entry, event.points);
+                applied = true;
+            }
+        });
+        if (!applied) {
+            showNotice(event);
+        }
+    }
+
+    function connect() {
+        if (source || !window.EventSource) {
+            return;
+        }
+        source = new window.EventSource('/data/events');
+        source.addEventListener('data', handleEvent);
+        source.addEventListener('reset', () => window.location.reload());
+    }
+
+    return {
+        // Listen for changes of the dates shown on the page (YYYY-MM-DD strings)
+        watch: function(startDate, endDate) {
+            range = {startDate: startDate, endDate: endDate};
+            connect();
+        },
+
+        // Keep a Chart.js chart current. options: aggregation, startDate,
+        // endDate, energyType, deviceId and datasets, one entry per chart
+        // dataset: {metric, fallback} or null to leave the dataset alone
+        liveChart: function(chart, options) {
+            charts.push({
+                chart: chart,
+                aggregation: options.aggregation,
+                startDate: options.startDate,
+                endDate: options.endDate,
+                energyType: options.energyType || 'total',
+                deviceId: options.deviceId === undefined ? null : options.deviceId,
+                datasets: options.datasets
+            });
+            this.watch(options.startDate, options.endDate);
+        }
+    };
+})();
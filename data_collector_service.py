@@ -21,6 +21,9 @@ import datetime
 import argparse
 from dotenv import load_dotenv
 from app.db.models import Database
+from app.db.tracing import traced
+from app.profiling import sampling_profile
+from app.metrics import api_call, record_failure, start_metrics_server, collector_run
 from daily_energy_collector import MELCloudCollector
 from daily_temperature_collector import HomeAssistantFetcher
 
@@ -168,13 +171,13 @@ class DataCollectorService:
             logger.error("Failed to get MELCloud devices")
             return False
         
-        # Get energy data for the date
-        energy_data = self.melcloud.get_device_data_for_date(target_date)
+        # Get energy data for the date from every device
+        data_list = self.melcloud.get_all_devices_data_for_date_range(target_date, target_date)
         
-        if energy_data:
+        if data_list:
             # Store data in database
-            if self.melcloud.store_data_in_db(energy_data):
-                logger.info(f"Successfully collected and stored energy data for {target_date}")
+            if all([self.melcloud.store_data_in_db(energy_data) for energy_data in data_list]):
+                logger.info(f"Successfully collected and stored energy data for {target_date} ({len(data_list)} device(s))")
                 return True
             else:
                 logger.error(f"Failed to store energy data for {target_date}")
@@ -199,12 +202,15 @@ class DataCollectorService:
         logger.info(f"Collecting temperature data for {target_date}")
         
         # Fetch temperature data for the date
-        temp, timestamp = self.hass.fetch_data_for_date(target_date)
+        with api_call('homeassistant', 'history'):
+            temp, timestamp = self.hass.fetch_data_for_date(target_date)
         
         if temp is not None:
+            # The fetcher counted the day's row as inserted, updated or unchanged
             logger.info(f"Successfully collected temperature data for {target_date}: {temp}°C")
             return True
         else:
+            record_failure('homeassistant', 'history', f"No temperature for {target_date}")
             logger.error(f"Failed to collect temperature data for {target_date}")
             return False
     
@@ -257,55 +263,61 @@ class DataCollectorService:
                 days_to_check = 180
                 retry_hours = 2
                 check_interval_hours = 24
+                profile = False
             args = Args()
         
         logger.info("Starting data collector service")
         
         while True:
             try:
-                # Check and ensure monthly prices exist
-                self.ensure_monthly_prices()
-                
-                # Check for missing data
-                missing_data = self.check_missing_data(days_to_check=args.days_to_check)
-                
-                if not missing_data:
-                    logger.info(f"No missing data found in the last {args.days_to_check} days")
-                else:
-                    # Process missing dates, starting with the most recent
-                    missing_dates = sorted(missing_data.keys(), reverse=True)
-                    
-                    logger.info(f"Attempting to collect data for {len(missing_dates)} dates with missing data")
-                    
-                    success_count = 0
-                    
-                    for date in missing_dates:
-                        missing_types = missing_data[date]
-                        logger.info(f"Processing {date} - Missing data: {', '.join(missing_types)}")
-                        
-                        success = True
-                        
-                        # Collect missing energy data
-                        if "energy" in missing_types:
-                            if self.collect_energy_data(date):
-                                logger.info(f"Successfully collected energy data for {date}")
-                            else:
-                                logger.error(f"Failed to collect energy data for {date}")
-                                success = False
-                        
-                        # Collect missing temperature data
-                        if "temperature" in missing_types:
-                            if self.collect_temperature_data(date):
-                                logger.info(f"Successfully collected temperature data for {date}")
-                            else:
-                                logger.error(f"Failed to collect temperature data for {date}")
-                                success = False
-                        
-                        if success:
-                            success_count += 1
-                    
-                    logger.info(f"Collected data for {success_count} out of {len(missing_dates)} missing dates")
-                
+                # Trace the queries of every collection run, save its telemetry and sample it when profiling
+                with traced("collector run"), collector_run("data_collector_service", self.db) as run, \
+                        sampling_profile("collector-run", enabled=args.profile):
+                    # Check and ensure monthly prices exist
+                    self.ensure_monthly_prices()
+
+                    # Check for missing data
+                    missing_data = self.check_missing_data(days_to_check=args.days_to_check)
+
+                    if not missing_data:
+                        logger.info(f"No missing data found in the last {args.days_to_check} days")
+                    else:
+                        # Process missing dates, starting with the most recent
+                        missing_dates = sorted(missing_data.keys(), reverse=True)
+                        run.dates_missing = len(missing_dates)
+
+                        logger.info(f"Attempting to collect data for {len(missing_dates)} dates with missing data")
+
+                        success_count = 0
+
+                        for date in missing_dates:
+                            missing_types = missing_data[date]
+                            logger.info(f"Processing {date} - Missing data: {', '.join(missing_types)}")
+
+                            success = True
+
+                            # Collect missing energy data
+                            if "energy" in missing_types:
+                                if self.collect_energy_data(date):
+                                    logger.info(f"Successfully collected energy data for {date}")
+                                else:
+                                    logger.error(f"Failed to collect energy data for {date}")
+                                    success = False
+
+                            # Collect missing temperature data
+                            if "temperature" in missing_types:
+                                if self.collect_temperature_data(date):
+                                    logger.info(f"Successfully collected temperature data for {date}")
+                                else:
+                                    logger.error(f"Failed to collect temperature data for {date}")
+                                    success = False
+
+                            if success:
+                                success_count += 1
+                                run.dates_collected = success_count
+
+                        logger.info(f"Collected data for {success_count} out of {len(missing_dates)} missing dates")
+
                 # Calculate time until next check
                 next_check = datetime.datetime.now() + datetime.timedelta(hours=args.check_interval_hours)
                 logger.info(f"Next data check scheduled for {next_check}")
@@ -329,13 +341,21 @@ class DataCollectorService:
 
 def main():
     """Main function to run the service."""
+    load_dotenv()
     parser = argparse.ArgumentParser(description="Service to collect daily energy and temperature data.")
     parser.add_argument("--debug", help="Enable debug mode", action="store_true")
     parser.add_argument("--days-to-check", help="Number of days to check for missing data", type=int, default=180)
     parser.add_argument("--retry-hours", help="Hours to wait before retrying if collection fails", type=int, default=2)
     parser.add_argument("--check-interval-hours", help="Hours between data checks", type=int, default=24)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this port (default: COLLECTOR_METRICS_PORT)",
+                        type=int, default=int(os.getenv("COLLECTOR_METRICS_PORT", "0")))
+    parser.add_argument("--profile", help="Sample every collection run and save its stacks under PROFILE_DIR",
+                        action="store_true", default=os.getenv("COLLECTOR_PROFILE", "false").lower() in ("1", "true", "yes", "on"))
     args = parser.parse_args()
     
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    
     # Create and run the service
     service = DataCollectorService(debug_mode=args.debug)
     service.run_service(args)
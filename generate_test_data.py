@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Generate realistic synthetic heat pump data for demos, benchmarks and load tests.
+
+Daily energy_data rows are derived from a seasonal outdoor temperature model:
+heating demand follows the degree-days below 18°C, COP rises with outdoor
+temperature, and hot water adds a roughly constant baseline. With --hourly the
+same days are also split into hourly readings (with a diurnal temperature
+swing and load shape) whose daily sums match the daily rows exactly.
+
+Rows are bulk-inserted with executemany in large transactions on a dedicated
+connection, so millions of readings load in seconds.
+
+Usage:
+    python generate_test_data.py --years 2
+    python generate_test_data.py --years 20 --devices 50 --hourly --db-path /tmp/load.db
+"""
+
+import sys
+import math
+import time
+import random
+import logging
+import argparse
+import datetime
+from app.db.models import Database
+from app.db.readings import ReadingsStore
+
+logger = logging.getLogger(__name__)
+
+# Heating demand starts below this outdoor temperature (°C)
+HEATING_BASE_TEMP = 18.0
+
+# Share of the daily heating and hot water energy used in each local hour
+HEATING_SHAPE = [5, 5, 5, 5, 5, 6, 7, 6, 4, 3, 3, 3, 3, 3, 3, 3, 4, 5, 5, 5, 5, 5, 5, 5]
+HOT_WATER_SHAPE = [0, 0, 0, 0, 0, 2, 10, 14, 8, 4, 3, 3, 4, 3, 2, 2, 3, 6, 10, 10, 7, 5, 3, 1]
+
+ENERGY_COLUMNS = ('heating_energy_consumed', 'hot_water_energy_consumed', 'total_energy_consumed',
+                  'heating_energy_produced', 'hot_water_energy_produced', 'total_energy_produced',
+                  'cop', 'cost', 'device_name', 'operation_mode', 'outdoor_temp')
+
+# Upsert rather than INSERT OR REPLACE, so re-running on an existing database
+# only fires the energy_data update triggers and records no deleted rows
+ENERGY_UPSERT = f'''
+INSERT INTO energy_data (
+    date, heating_energy_consumed, hot_water_energy_consumed, total_energy_consumed,
+    heating_energy_produced, hot_water_energy_produced, total_energy_produced,
+    cop, cost, device_id, device_name, operation_mode, outdoor_temp
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(device_id, date) DO UPDATE SET
+    {', '.join(f'{column} = excluded.{column}' for column in ENERGY_COLUMNS)}
+'''
+
+def seasonal_temperature(day, rng, mean=12.0, amplitude=10.0):
+    """Daily mean outdoor temperature: coldest mid-January, plus day-to-day noise."""
+    phase = 2 * math.pi * (day.timetuple().tm_yday - 15) / 365.25
+    return mean - amplitude * math.cos(phase) + rng.gauss(0, 2.0)
+
+def cop_at(outdoor_temp, rng):
+    """Heating COP of an air-to-water heat pump at an outdoor temperature."""
+    return max(1.6, min(5.5, 3.1 + 0.075 * outdoor_temp + rng.gauss(0, 0.1)))
+
+def month_range(start_date, end_date):
+    """Yield (year, month) for every month touched by the date range."""
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+def generate_prices(start_date, end_date, rng):
+    """Monthly price history with a slow drift and seasonal variation."""
+    prices = []
+    electricity = 0.22
+    diesel = 1.45
+    for year, month in month_range(start_date, end_date):
+        electricity = max(0.12, electricity + rng.gauss(0.0005, 0.006))
+        diesel = max(0.9, diesel + rng.gauss(0.001, 0.03))
+        winter = 0.01 if month in (12, 1, 2) else 0.0
+        prices.append((year, month, round(electricity + winter, 4), round(diesel, 3), 0.85))
+    return prices
+
+def generate_day(rng, outdoor_temp, size):
+    """Energy figures for one device and day; size scales the unit's demand."""
+    heating_consumed = max(0.0, (HEATING_BASE_TEMP - outdoor_temp) * 0.85 * size + rng.gauss(0, 0.4))
+    hot_water_consumed = max(0.5, 2.4 * size + rng.gauss(0, 0.3))
+    heating_cop = cop_at(outdoor_temp, rng)
+    hot_water_cop = max(1.5, heating_cop - 0.8)
+    return heating_consumed, hot_water_consumed, heating_consumed * heating_cop, hot_water_consumed * hot_water_cop
+
+def hourly_shares(shape, hours):
+    """Normalize an hourly shape to a day of 23, 24 or 25 hours (DST changes)."""
+    shape = shape[:hours] if hours <= len(shape) else shape + shape[-1:] * (hours - len(shape))
+    total = sum(shape)
+    return [value / total for value in shape]
+
+def generate(db_path=None, years=2, devices=1, hourly=False, seed=42, end_date=None, batch_size=50000):
+    """Fill a database with synthetic data.
+
+    Args:
+        db_path: Database file (defaults to DATABASE_PATH)
+        years: Length of the history ending at end_date
+        devices: Number of heat pump units
+        hourly: Also write hourly readings that roll up into the daily rows
+        seed: Random seed, so the same arguments give the same data
+        end_date: Last day generated (defaults to yesterday)
+        batch_size: Rows per transaction
+
+    Returns:
+        Dictionary with the number of days, energy rows, readings and prices written
+    """
+    rng = random.Random(seed)
+    end_date = end_date or datetime.date.today() - datetime.timedelta(days=1)
+    start_date = end_date - datetime.timedelta(days=int(round(365.25 * years)) - 1)
+    days = [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+    db = Database(db_path)
+    store = ReadingsStore(db) if hourly else None
+
+    # Bulk loading bypasses the write queue on a connection tuned for throughput
+    conn = db.get_connection()
+    conn.execute('PRAGMA synchronous=OFF')
+    cursor = conn.cursor()
+
+    prices = generate_prices(start_date, end_date, rng)
+    cursor.executemany('''
+    INSERT INTO prices (year, month, electricity_price, diesel_price, diesel_efficiency)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(year, month) DO UPDATE SET
+        electricity_price = excluded.electricity_price,
+        diesel_price = excluded.diesel_price,
+        diesel_efficiency = excluded.diesel_efficiency
+    ''', prices)
+    price_by_month = {(year, month): electricity for year, month, electricity, _, _ in prices}
+
+    cursor.executemany('''
+    INSERT INTO devices (device_id, device_name, building_id, first_seen, last_seen)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(device_id) DO UPDATE SET
+        device_name = excluded.device_name,
+        building_id = excluded.building_id,
+        first_seen = excluded.first_seen,
+        last_seen = excluded.last_seen
+    ''', [(d, f"Pompa di calore {d}", 1, start_date, end_date) for d in range(1, devices + 1)])
+    conn.commit()
+
+    temperatures = {day: seasonal_temperature(day, rng) for day in days}
+    sizes = {d: rng.uniform(0.7, 1.4) for d in range(1, devices + 1)}
+
+    energy_rows = 0
+    readings = 0
+    batch = []
+    hourly_rows = []
+
+    def flush_readings():
+        nonlocal readings
+        readings += store.bulk_insert(cursor, hourly_rows)
+        hourly_rows.clear()
+        conn.commit()
+
+    if hourly:
+        temp_series = store.get_series_id('demo:outdoor_temperature', 0, '°C', 'mean', 'outdoor_temp')
+        series = {
+            d: [store.get_series_id(f'demo:{metric}', d, 'kWh', 'sum', column) for metric, column in (
+                ('heating_consumed', 'heating_energy_consumed'),
+                ('hot_water_consumed', 'hot_water_energy_consumed'),
+                ('heating_produced', 'heating_energy_produced'),
+                ('hot_water_produced', 'hot_water_energy_produced'))]
+            for d in range(1, devices + 1)
+        }
+        # Local midnight and hourly shares of every day
+        day_hours = {}
+        for day in days:
+            midnight = store.to_timestamp(day)
+            hours = (store.to_timestamp(day + datetime.timedelta(days=1)) - midnight) // 3600
+            day_hours[day] = (midnight, hourly_shares(HEATING_SHAPE, hours), hourly_shares(HOT_WATER_SHAPE, hours))
+
+        # Hourly temperatures swing around the daily mean, coldest before dawn
+        for day in days:
+            midnight = day_hours[day][0]
+            for hour in range(len(day_hours[day][1])):
+                ts = midnight + hour * 3600
+                value = temperatures[day] - 4 * math.cos(2 * math.pi * (hour - 3) / 24)
+                hourly_rows.append((temp_series, ts, round(value, 2)))
+
+    for device_id in range(1, devices + 1):
+        for day in days:
+            outdoor = temperatures[day]
+            heating_consumed, hot_water_consumed, heating_produced, hot_water_produced = generate_day(
+                rng, outdoor, sizes[device_id])
+            consumed = heating_consumed + hot_water_consumed
+            produced = heating_produced + hot_water_produced
+            batch.append((
+                day, heating_consumed, hot_water_consumed, consumed, heating_produced, hot_water_produced,
+                produced, produced / consumed, consumed * price_by_month[(day.year, day.month)],
+                device_id, f"Pompa di calore {device_id}", "Heat", round(outdoor, 2)
+            ))
+
+            if hourly:
+                midnight, heating_shares, hot_water_shares = day_hours[day]
+                for hour, (heating_share, hot_water_share) in enumerate(zip(heating_shares, hot_water_shares)):
+                    ts = midnight + hour * 3600
+                    heating_id, hot_water_id, heating_produced_id, hot_water_produced_id = series[device_id]
+                    hourly_rows.append((heating_id, ts, heating_consumed * heating_share))
+                    hourly_rows.append((hot_water_id, ts, hot_water_consumed * hot_water_share))
+                    hourly_rows.append((heating_produced_id, ts, heating_produced * heating_share))
+                    hourly_rows.append((hot_water_produced_id, ts, hot_water_produced * hot_water_share))
+
+            if len(batch) >= batch_size:
+                cursor.executemany(ENERGY_UPSERT, batch)
+                energy_rows += len(batch)
+                batch = []
+                conn.commit()
+
+            if len(hourly_rows) >= batch_size:
+                flush_readings()
+
+    if batch:
+        cursor.executemany(ENERGY_UPSERT, batch)
+        energy_rows += len(batch)
+    conn.commit()
+
+    if hourly:
+        flush_readings()
+
+    db.rebuild_degree_days()
+    db.close_connection()
+
+    return {"days": len(days), "energy_rows": energy_rows, "readings": readings, "prices": len(prices)}
+
+def main():
+    """Main function."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Generate synthetic heat pump data.")
+    parser.add_argument("--db-path", help="Database file (default: DATABASE_PATH)", default=None)
+    parser.add_argument("--years", help="Years of history to generate", type=float, default=2)
+    parser.add_argument("--devices", help="Number of heat pump units", type=int, default=1)
+    parser.add_argument("--hourly", help="Also generate hourly readings", action="store_true")
+    parser.add_argument("--seed", help="Random seed", type=int, default=42)
+    parser.add_argument("--end-date", help="Last generated date (format: YYYY-MM-DD, default: yesterday)", default=None)
+    parser.add_argument("--batch-size", help="Rows per transaction", type=int, default=50000)
+    args = parser.parse_args()
+
+    end_date = datetime.datetime.strptime(args.end_date, "%Y-%m-%d").date() if args.end_date else None
+
+    started = time.perf_counter()
+    counts = generate(args.db_path, args.years, args.devices, args.hourly, args.seed, end_date, args.batch_size)
+    elapsed = time.perf_counter() - started
+
+    print(f"Generated {counts['days']} days for {args.devices} device(s): "
+          f"{counts['energy_rows']} energy rows, {counts['readings']} hourly readings, "
+          f"{counts['prices']} monthly prices in {elapsed:.1f}s")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
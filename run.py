@@ -45,7 +45,8 @@ try:
         logger.info("Database appears empty. Attempting to generate test data...")
         try:
             import generate_test_data
-            logger.info("Test data generated successfully!")
+            counts = generate_test_data.generate(years=1)
+            logger.info(f"Test data generated successfully! ({counts['energy_rows']} days of energy data)")
         except ImportError as e:
             logger.warning(f"Could not import generate_test_data module: {e}")
         except Exception as e:
@@ -73,7 +74,7 @@ ERROR: {e}
 It looks like you're missing some required dependencies. 
 Try installing the minimal dependencies with:
 
-pip install flask flask-wtf python-dotenv requests plotly
+pip install flask flask-wtf python-dotenv requests
 
 or all dependencies with:
 
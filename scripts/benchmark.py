@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Database methods and the blueprint views on synthetic datasets.
+
+Datasets are built once per size under benchmarks/data/ and reused; results
+are written as JSON named after the current commit so runs can be compared.
+
+Usage:
+    python scripts/benchmark.py
+    python scripts/benchmark.py --years 1 5 20 --devices 1 50 --hourly
+    python scripts/benchmark.py --compare benchmarks/results/abc1234.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import platform
+import statistics
+import subprocess
+
+# Configure logging
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join("benchmarks", "data")
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+ROUTES = ["/dashboard/", "/consumption/", "/costs/", "/temperature/"]
+TIME_RANGES = ["30d", "1y", "5y"]
+
+def dataset_path(years, devices, hourly):
+    """Return the cached database file for a dataset size."""
+    name = f"energy_{years}y_{devices}d{'_hourly' if hourly else ''}.db"
+    return os.path.join(DATA_DIR, name)
+
+def build_dataset(path, years, devices, hourly, seed=42):
+    """Create a synthetic database with the shared test data generator."""
+    from generate_test_data import generate
+
+    generate(path, years=years, devices=devices, hourly=hourly, seed=seed)
+
+def time_call(fn, repeat):
+    """Run fn once to warm up, then repeat times, and return timing stats in milliseconds."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.mean(samples), 3),
+        "max_ms": round(samples[-1], 3),
+        "repeat": repeat
+    }
+
+def benchmark_database(path, years, hourly, repeat):
+    """Time the Database methods used by the views."""
+    from app.db.models import Database
+
+    db = Database(path)
+    end_date = datetime.date.today()
+    ranges = {"30d": end_date - datetime.timedelta(days=30),
+              f"{years}y": end_date - datetime.timedelta(days=int(365.25 * years))}
+
+    results = {}
+    for label, start_date in ranges.items():
+        results[f"get_energy_data[{label}]"] = time_call(lambda: db.get_energy_data(start_date, end_date), repeat)
+        results[f"get_energy_data[{label},device]"] = time_call(
+            lambda: db.get_energy_data(start_date, end_date, device_id=1), repeat)
+        results[f"get_temperature_data[{label}]"] = time_call(lambda: db.get_temperature_data(start_date, end_date), repeat)
+        results[f"calculate_diesel_cost[{label}]"] = time_call(
+            lambda: db.calculate_diesel_cost(start_date, end_date), repeat)
+
+    month_start = end_date - datetime.timedelta(days=30)
+    results["recalculate_energy_costs[30d]"] = time_call(
+        lambda: db.recalculate_energy_costs(month_start, end_date), max(1, repeat // 5))
+
+    try:
+        from app.routes.dashboard import aggregate_data
+        rows = db.get_energy_data(ranges[f"{years}y"], end_date)
+        for aggregation in ("week", "month", "year"):
+            results[f"aggregate_data[{aggregation}]"] = time_call(
+                lambda: aggregate_data(rows, aggregation, avg_keys=[3]), repeat)
+    except ImportError as e:
+        logger.warning(f"Skipping aggregate_data: {e}")
+
+    if hourly:
+        from app.db.readings import ReadingsStore
+        store = ReadingsStore(db)
+        series_id = store.get_series_id("demo:heating_consumed", 1, "kWh", "sum", "heating_energy_consumed")
+        results["readings.query[30d]"] = time_call(lambda: store.query(series_id, month_start, end_date), repeat)
+        results["readings.resample[30d,hour]"] = time_call(
+            lambda: store.resample(series_id, month_start, end_date, "hour", "sum"), repeat)
+        results["readings.rollup_daily[30d]"] = time_call(
+            lambda: store.rollup_daily(month_start, end_date), max(1, repeat // 5))
+
+    db.close_connection()
+    return results
+
+def benchmark_routes(path, repeat):
+    """Time every blueprint index view through the Flask test client."""
+    os.environ["DATABASE_PATH"] = path
+    try:
+        from app import create_app
+    except ImportError as e:
+        logger.warning(f"Skipping route benchmarks: {e}")
+        return {}
+
+    app = create_app()
+    client = app.test_client()
+
+    results = {}
+    for route in ROUTES:
+        for time_range in TIME_RANGES:
+            url = f"{route}?time_range={time_range}&aggregation=auto&is_auto_aggregation=true"
+
+            def request():
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} returned {response.status_code}")
+
+            results[f"GET {route}[{time_range}]"] = time_call(request, repeat)
+    return results
+
+def current_commit():
+    """Return the short hash of HEAD, marked dirty if the tree has changes."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"]) != 0
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results, baseline_file):
+    """Print the median change of every benchmark against a previous results file."""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+
+    print(f"\n=== Compared to {baseline.get('commit', baseline_file)} ===")
+    for dataset, benchmarks in results["datasets"].items():
+        previous = baseline.get("datasets", {}).get(dataset)
+        if not previous:
+            continue
+        print(f"\n{dataset}")
+        for name, stats in benchmarks.items():
+            if name not in previous:
+                continue
+            old = previous[name]["median_ms"]
+            new = stats["median_ms"]
+            change = (new - old) / old * 100 if old else 0
+            marker = "  <-- slower" if change > 20 else ""
+            print(f"  {name:45s} {old:10.2f} -> {new:10.2f} ms ({change:+.0f}%){marker}")
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Benchmark database methods and views on synthetic datasets.")
+    parser.add_argument("--years", help="Dataset lengths in years", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--devices", help="Number of devices per dataset", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--hourly", help="Also build and benchmark hourly readings", action="store_true")
+    parser.add_argument("--repeat", help="Timed runs per benchmark", type=int, default=10)
+    parser.add_argument("--skip-routes", help="Only benchmark Database methods", action="store_true")
+    parser.add_argument("--rebuild", help="Rebuild cached datasets", action="store_true")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>.json)", default=None)
+    parser.add_argument("--compare", help="Previous results file to compare against", default=None)
+    args = parser.parse_args()
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+
+    commit = current_commit()
+    results = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "datasets": {}
+    }
+
+    for years in args.years:
+        for devices in args.devices:
+            path = dataset_path(years, devices, args.hourly)
+            if args.rebuild and os.path.exists(path):
+                os.remove(path)
+            if not os.path.exists(path):
+                print(f"Building dataset: {years} years, {devices} devices{' with hourly readings' if args.hourly else ''}")
+                started = time.perf_counter()
+                build_dataset(path, years, devices, args.hourly)
+                print(f"  built in {time.perf_counter() - started:.1f}s")
+
+            key = os.path.splitext(os.path.basename(path))[0]
+            print(f"Benchmarking {key}")
+            benchmarks = benchmark_database(path, years, args.hourly, args.repeat)
+            if not args.skip_routes:
+                benchmarks.update(benchmark_routes(path, args.repeat))
+            results["datasets"][key] = benchmarks
+
+            for name, stats in benchmarks.items():
+                print(f"  {name:45s} median {stats['median_ms']:10.2f} ms")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
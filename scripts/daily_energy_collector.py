@@ -4,8 +4,13 @@ import requests
 import datetime
 import logging
 import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from app.db.models import Database
+from app.db.archive import RawArchive
+from app.db.tracing import traced
+from app.metrics import api_call, record_failure, record_retry, record_rows_written, collector_run, current_run
 import sys
 
 # Configure logging
@@ -19,6 +24,176 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Upper bound on concurrent MELCloud requests when several devices are fetched
+MAX_FETCH_WORKERS = 4
+
+# Maps parser result keys to the energy_data columns they are stored in
+ENERGY_FIELD_COLUMNS = {
+    "heating_consumed": "heating_energy_consumed",
+    "hot_water_consumed": "hot_water_energy_consumed",
+    "heating_produced": "heating_energy_produced",
+    "hot_water_produced": "hot_water_energy_produced",
+    "cop": "cop",
+    "cost": "cost"
+}
+
+def parse_report_date_range(energy_data):
+    """Return the (from_date, to_date) covered by an energy report, None where missing."""
+    from_date_str = energy_data.get("FromDate", "")
+    to_date_str = energy_data.get("ToDate", "")
+    
+    try:
+        # Parse the dates from the report
+        if from_date_str and "T" in from_date_str:
+            from_date = datetime.datetime.strptime(from_date_str.split("T")[0], "%Y-%m-%d").date()
+        else:
+            logger.debug(f"Invalid FromDate in energy report: {from_date_str}")
+            from_date = None
+            
+        if to_date_str and "T" in to_date_str:
+            to_date = datetime.datetime.strptime(to_date_str.split("T")[0], "%Y-%m-%d").date()
+        else:
+            logger.debug(f"Invalid ToDate in energy report: {to_date_str}")
+            to_date = None
+    except Exception as e:
+        logger.error(f"Error parsing dates from energy report: {e}")
+        from_date = None
+        to_date = None
+    
+    return from_date, to_date
+
+def _report_value(energy_data, key, index):
+    """Read a numeric value from one of the report arrays, 0 if missing."""
+    if key not in energy_data or index >= len(energy_data[key]):
+        return 0
+    
+    item = energy_data[key][index]
+    if isinstance(item, (int, float)):
+        return item
+    elif isinstance(item, dict) and "Value" in item:
+        return item.get("Value", 0) or 0
+    return 0
+
+def changed_fields(row, values):
+    """Compare parsed values against a stored energy_data row.
+
+    Returns:
+        Dictionary of the fields that differ, with their old and new value
+    """
+    changes = {}
+    for field, column in ENERGY_FIELD_COLUMNS.items():
+        old = row[column]
+        new = values.get(field)
+        if old is None and new is None:
+            continue
+        if old is None or new is None or abs(float(old) - float(new)) > 1e-6:
+            changes[field] = {"old": old, "new": new}
+    return changes
+
+def extract_energy_values(energy_data, target_date):
+    """Extract the energy values for a specific date from a raw MELCloud energy report.
+    
+    This is a pure function of the report so archived reports can be
+    re-parsed offline without any API call.
+    
+    Returns:
+        Dictionary with heating/hot water consumed and produced values and COP,
+        or None if the date is not present in the report
+    """
+    if not energy_data:
+        return None
+    
+    date_str = target_date.strftime("%Y-%m-%d")
+    target_day = target_date.day
+    target_month = target_date.month
+    target_year = target_date.year
+    
+    from_date, to_date = parse_report_date_range(energy_data)
+    
+    # Find the target date in the Labels array
+    labels = energy_data.get("Labels", [])
+    
+    if not labels:
+        logger.warning(f"No Labels array found in energy report for {date_str}")
+        return None
+    
+    target_index = None
+    
+    # Determine if labels are dates or day numbers
+    is_date_format = False
+    for label in labels:
+        if isinstance(label, str) and "-" in label:
+            is_date_format = True
+            break
+    
+    # First check: direct match in Labels array
+    if is_date_format:
+        # Labels are date strings
+        for i, label in enumerate(labels):
+            if isinstance(label, str) and date_str in label:
+                target_index = i
+                logger.debug(f"Found direct date match {date_str} at index {i}")
+                break
+    else:
+        # Labels may be day numbers (most common case)
+        for i, label in enumerate(labels):
+            if isinstance(label, (int, float)) and int(label) == target_day:
+                # Need to verify we're talking about the same month
+                if from_date and from_date.month == target_month and from_date.year == target_year:
+                    target_index = i
+                    logger.debug(f"Found day {target_day} at index {i} with matching month/year")
+                    break
+                elif i < len(labels) - 1 and labels[i+1] == target_day + 1:
+                    # Sequential days, likely the right date
+                    target_index = i
+                    logger.debug(f"Found sequential day {target_day} at index {i}")
+                    break
+    
+    # Second check: calculate index based on date offset from from_date
+    if target_index is None and from_date and to_date:
+        if from_date <= target_date <= to_date:
+            # Target date is in range of the report
+            offset = (target_date - from_date).days
+            if 0 <= offset < len(labels):
+                target_index = offset
+                logger.debug(f"Calculated index {target_index} based on date offset from {from_date}")
+            else:
+                logger.debug(f"Date offset {offset} out of range for labels array length {len(labels)}")
+    
+    if target_index is None:
+        # If date not found in report, log a message
+        if from_date and to_date:
+            date_range_msg = f"The report only contains data from {from_date} to {to_date}"
+        else:
+            date_range_msg = "Could not determine the date range in the report"
+        logger.warning(f"Date {date_str} not found in energy report. {date_range_msg}")
+        return None
+    
+    heating_consumed = _report_value(energy_data, "Heating", target_index)
+    hot_water_consumed = _report_value(energy_data, "HotWater", target_index)
+    heating_produced = _report_value(energy_data, "ProducedHeating", target_index)
+    hot_water_produced = _report_value(energy_data, "ProducedHotWater", target_index)
+    
+    # Use COP from report if available, otherwise calculate it
+    cop = None
+    if "CoP" in energy_data and target_index < len(energy_data["CoP"]):
+        cop_item = energy_data["CoP"][target_index]
+        if isinstance(cop_item, (int, float)):
+            cop = cop_item
+    
+    if cop is None:
+        total_consumed = heating_consumed + hot_water_consumed
+        total_produced = heating_produced + hot_water_produced
+        cop = total_produced / total_consumed if total_consumed > 0 else 0
+    
+    return {
+        "heating_consumed": heating_consumed,
+        "hot_water_consumed": hot_water_consumed,
+        "heating_produced": heating_produced,
+        "hot_water_produced": hot_water_produced,
+        "cop": cop
+    }
+
 class MELCloudCollector:
     def __init__(self, target_device_id=None, target_device_name=None, debug_mode=False):
         """Initialize the MELCloud data collector.
@@ -32,7 +207,9 @@ class MELCloudCollector:
         self.target_device_name = target_device_name
         self.debug_mode = debug_mode
         
-        # Will be set after device list is retrieved
+        # Will be set after device list is retrieved; device_id/device_name/building_id
+        # refer to the first device in self.devices
+        self.devices = []
         self.device_id = None
         self.device_name = None
         self.building_id = None
@@ -43,6 +220,13 @@ class MELCloudCollector:
         # Initialize DB connection
         self.db = Database()
         
+        # Raw responses are always archived so they can be re-parsed offline
+        try:
+            self.archive = RawArchive()
+        except Exception as e:
+            logger.warning(f"Raw response archive unavailable: {e}")
+            self.archive = None
+        
         # Load environment variables
         load_dotenv()
         
@@ -74,6 +258,18 @@ class MELCloudCollector:
             self.db.update_prices(electricity_price, diesel_price, diesel_efficiency)
             logger.info(f"Added default prices: Electricity: {electricity_price} €/kWh, Diesel: {diesel_price} €/L, Efficiency: {diesel_efficiency}")
 
+    def _archive_response(self, kind, payload, device_id=None, start_date=None, end_date=None):
+        """Store a raw MELCloud response in the archive without failing the collection."""
+        if self.archive is None:
+            return None
+        
+        try:
+            return self.archive.store("melcloud", kind, payload, device_id=device_id,
+                                      start_date=start_date, end_date=end_date)
+        except Exception as e:
+            logger.warning(f"Failed to archive MELCloud {kind} response: {e}")
+            return None
+
     def authenticate(self):
         """Authenticate with MELCloud API."""
         logger.info(f"Authenticating with MELCloud as {self.username}")
@@ -82,6 +278,8 @@ class MELCloudCollector:
         app_versions = ["1.23.4.0", "1.19.1.1", "1.25.0.0"]
         
         for app_version in app_versions:
+            if app_version != app_versions[0]:
+                record_retry("melcloud")
             logger.info(f"Trying authentication with AppVersion: {app_version}")
             
             auth_url = "https://app.melcloud.com/Mitsubishi.Wifi.Client/Login/ClientLogin"
@@ -95,9 +293,11 @@ class MELCloudCollector:
             }
             
             try:
-                response = requests.post(auth_url, json=auth_data)
+                with api_call("melcloud", "login"):
+                    response = requests.post(auth_url, json=auth_data)
                 
                 if response.status_code != 200:
+                    record_failure("melcloud", "login", f"HTTP {response.status_code}")
                     logger.warning(f"Authentication failed with status code: {response.status_code}")
                     continue
                 
@@ -128,6 +328,7 @@ class MELCloudCollector:
                 logger.error(f"Error during authentication: {str(e)}")
         
         logger.error("All authentication attempts failed")
+        record_failure("melcloud", "login", "All authentication attempts failed")
         return False
 
     def get_devices(self):
@@ -144,13 +345,16 @@ class MELCloudCollector:
         }
         
         try:
-            response = requests.get(url, headers=headers)
+            with api_call("melcloud", "list_devices"):
+                response = requests.get(url, headers=headers)
             
             if response.status_code != 200:
+                record_failure("melcloud", "list_devices", f"HTTP {response.status_code}")
                 logger.error(f"Failed to fetch devices with status code: {response.status_code}")
                 return False
             
             buildings = response.json()
+            self._archive_response("devices", buildings)
             
             # Save raw devices response if in debug mode
             if self.debug_mode:
@@ -164,9 +368,7 @@ class MELCloudCollector:
             
             logger.info(f"Found {len(buildings)} building(s)")
             
-            # Look for the target device
-            target_device_found = False
-            
+            all_devices = []
             for building in buildings:
                 if "Structure" not in building or "Devices" not in building["Structure"]:
                     logger.warning(f"No devices found in building {building.get('Name', 'Unknown')}")
@@ -179,51 +381,34 @@ class MELCloudCollector:
                     continue
                 
                 for device in devices:
-                    device_id = device.get("DeviceID")
-                    device_name = device.get("DeviceName")
-                    
-                    # If a specific device ID was requested, check for it
-                    if self.target_device_id and str(device_id) == str(self.target_device_id):
-                        self.device_id = device_id
-                        self.device_name = device_name
-                        self.building_id = building.get("ID")
-                        target_device_found = True
-                        logger.info(f"Found target device: {device_name} (ID: {device_id})")
-                        break
-                    
-                    # If a specific device name was requested, check for it
-                    elif self.target_device_name and self.target_device_name.lower() in device_name.lower():
-                        self.device_id = device_id
-                        self.device_name = device_name
-                        self.building_id = building.get("ID")
-                        target_device_found = True
-                        logger.info(f"Found device by name: {device_name} (ID: {device_id})")
-                        break
-                
-                if target_device_found:
-                    break
+                    all_devices.append({
+                        "device_id": device.get("DeviceID"),
+                        "device_name": device.get("DeviceName") or "",
+                        "building_id": building.get("ID")
+                    })
+            
+            # A requested device ID or name narrows the list, otherwise every device is collected
+            self.devices = all_devices
+            if self.target_device_id:
+                self.devices = [d for d in all_devices if str(d["device_id"]) == str(self.target_device_id)]
+            elif self.target_device_name:
+                self.devices = [d for d in all_devices if self.target_device_name.lower() in d["device_name"].lower()]
             
-            # If no specific device was requested or found, use the first device
-            if not target_device_found and not self.device_id:
-                for building in buildings:
-                    if "Structure" not in building or "Devices" not in building["Structure"]:
-                        continue
-                    
-                    devices = building["Structure"]["Devices"]
-                    
-                    if devices:
-                        self.device_id = devices[0].get("DeviceID")
-                        self.device_name = devices[0].get("DeviceName")
-                        self.building_id = building.get("ID")
-                        logger.info(f"No target device specified, using first available: {self.device_name} (ID: {self.device_id})")
-                        target_device_found = True
-                        break
-            
-            if not target_device_found:
+            if not self.devices and all_devices:
+                logger.warning("Requested device not found, using first available device")
+                self.devices = all_devices[:1]
+            
+            if not self.devices:
                 logger.error("No suitable device found in MELCloud account")
                 return False
             
-            logger.info(f"Using device: {self.device_name} (ID: {self.device_id}) in building ID: {self.building_id}")
+            self.device_id = self.devices[0]["device_id"]
+            self.device_name = self.devices[0]["device_name"]
+            self.building_id = self.devices[0]["building_id"]
+            
+            for device in self.devices:
+                self.db.register_device(device["device_id"], device["device_name"], device["building_id"])
+                logger.info(f"Using device: {device['device_name']} (ID: {device['device_id']}) in building ID: {device['building_id']}")
             return True
             
         except Exception as e:
@@ -232,9 +417,16 @@ class MELCloudCollector:
             logger.error(traceback.format_exc())
             return False
 
-    def get_energy_report_for_date_range(self, start_date, end_date):
+    def _device(self, device=None):
+        """Return the given device dict, or the default device selected by get_devices()."""
+        if device is not None:
+            return device
+        return {"device_id": self.device_id, "device_name": self.device_name, "building_id": self.building_id}
+
+    def get_energy_report_for_date_range(self, start_date, end_date, device=None):
         """Get energy report for a date range from MELCloud API."""
-        if not self.context_key or not self.device_id:
+        device = self._device(device)
+        if not self.context_key or not device["device_id"]:
             logger.error("Not properly initialized. Call authenticate() and get_devices() first.")
             return None
         
@@ -242,23 +434,25 @@ class MELCloudCollector:
         from_date = start_date - datetime.timedelta(days=3)
         to_date = end_date + datetime.timedelta(days=3)
         
-        logger.info(f"Fetching energy report from MELCloud for date range: {from_date} to {to_date}")
+        logger.info(f"Fetching energy report from MELCloud for device {device['device_id']}, date range: {from_date} to {to_date}")
         
         energy_url = f"https://app.melcloud.com/Mitsubishi.Wifi.Client/EnergyCost/Report"
         headers = {
             "X-MitsContextKey": self.context_key
         }
         payload = {
-            "DeviceId": self.device_id,
+            "DeviceId": device["device_id"],
             "UseCurrency": False,
             "FromDate": f"{from_date.strftime('%Y-%m-%d')}T00:00:00",
             "ToDate": f"{to_date.strftime('%Y-%m-%d')}T00:00:00"
         }
         
         try:
-            response = requests.post(energy_url, headers=headers, json=payload)
+            with api_call("melcloud", "energy_report"):
+                response = requests.post(energy_url, headers=headers, json=payload)
             
             if response.status_code != 200:
+                record_failure("melcloud", "energy_report", f"HTTP {response.status_code}")
                 logger.error(f"Failed to fetch energy report with status code: {response.status_code}")
                 return None
             
@@ -268,10 +462,13 @@ class MELCloudCollector:
                 logger.error("Empty energy report response")
                 return None
             
+            self._archive_response("energy_report", energy_data, device_id=device["device_id"],
+                                   start_date=from_date, end_date=to_date)
+            
             # Save energy report data if in debug mode
             if self.debug_mode:
                 os.makedirs('melcloud_debug', exist_ok=True)
-                debug_file = f"melcloud_debug/energy_report_{start_date}_to_{end_date}.json"
+                debug_file = f"melcloud_debug/energy_report_{device['device_id']}_{start_date}_to_{end_date}.json"
                 with open(debug_file, "w") as f:
                     json.dump(energy_data, f, indent=2)
                 logger.info(f"Saved energy report data to {debug_file}")
@@ -284,14 +481,24 @@ class MELCloudCollector:
             logger.error(traceback.format_exc())
             return None
 
-    def process_energy_report_for_date(self, energy_data, target_date):
-        """Extract energy data for a specific date from an energy report."""
+    def process_energy_report_for_date(self, energy_data, target_date, device=None, device_data=None):
+        """Extract energy data for a specific date from an energy report.
+        
+        Args:
+            energy_data: Energy report returned by get_energy_report_for_date_range()
+            target_date: Date to extract
+            device: Device dict the report belongs to (defaults to the first device)
+            device_data: Current device state, fetched if not given
+        """
         if not energy_data:
             logger.error("No energy data provided")
             return None
         
+        device = self._device(device)
+        
         # Extract basic device data from the current state
-        device_data = self.get_current_device_data()
+        if device_data is None:
+            device_data = self.get_current_device_data(device)
         if not device_data:
             logger.error("Failed to get current device data")
             return None
@@ -304,184 +511,29 @@ class MELCloudCollector:
         operation_mode = device_data.get("OperationMode", 0)
         demand_percentage = device_data.get("DemandPercentage", 0) or 0
         
-        # Default energy values
-        heating_consumed = 0
-        hot_water_consumed = 0
-        heating_produced = 0
-        hot_water_produced = 0
+        logger.info(f"Processing energy data for {target_date.strftime('%Y-%m-%d')} (day {target_date.day})")
         
-        # Convert date to string for comparison and extract day number
-        date_str = target_date.strftime("%Y-%m-%d")
-        target_day = target_date.day
-        target_month = target_date.month
-        target_year = target_date.year
+        values = extract_energy_values(energy_data, target_date)
         
-        logger.info(f"Processing energy data for {date_str} (day {target_day})")
-        
-        # Get the reported date range from the energy report
-        from_date_str = energy_data.get("FromDate", "")
-        to_date_str = energy_data.get("ToDate", "")
-        
-        try:
-            # Parse the dates from the report
-            if from_date_str and "T" in from_date_str:
-                from_date = datetime.datetime.strptime(from_date_str.split("T")[0], "%Y-%m-%d").date()
-                logger.info(f"Energy report start date: {from_date}")
-            else:
-                logger.warning(f"Invalid FromDate in energy report: {from_date_str}")
-                from_date = None
-                
-            if to_date_str and "T" in to_date_str:
-                to_date = datetime.datetime.strptime(to_date_str.split("T")[0], "%Y-%m-%d").date()
-                logger.info(f"Energy report end date: {to_date}")
-            else:
-                logger.warning(f"Invalid ToDate in energy report: {to_date_str}")
-                to_date = None
-        except Exception as e:
-            logger.error(f"Error parsing dates from energy report: {e}")
-            from_date = None
-            to_date = None
-        
-        # Find the target date in the Labels array
-        labels = energy_data.get("Labels", [])
-        
-        if not labels:
-            logger.warning(f"No Labels array found in energy report for {date_str}")
-            # Still return valid data with zeros for energy values
-            return self._create_result_object(
-                target_date, 0, 0, 0, 0, 0, 
-                room_temp, outdoor_temp, flow_temp, return_temp,
-                power, operation_mode, demand_percentage
-            )
-        
-        logger.info(f"Labels in energy report: {labels}")
-        
-        target_index = None
-        
-        # Determine if labels are dates or day numbers
-        is_date_format = False
-        for label in labels:
-            if isinstance(label, str) and "-" in label:
-                is_date_format = True
-                break
-        
-        # First check: direct match in Labels array
-        if is_date_format:
-            # Labels are date strings
-            for i, label in enumerate(labels):
-                if isinstance(label, str) and date_str in label:
-                    target_index = i
-                    logger.info(f"Found direct date match {date_str} at index {i}")
-                    break
-        else:
-            # Labels may be day numbers (most common case)
-            for i, label in enumerate(labels):
-                if isinstance(label, (int, float)) and int(label) == target_day:
-                    # Need to verify we're talking about the same month
-                    if from_date and from_date.month == target_month and from_date.year == target_year:
-                        target_index = i
-                        logger.info(f"Found day {target_day} at index {i} with matching month/year")
-                        break
-                    elif i < len(labels) - 1 and labels[i+1] == target_day + 1:
-                        # Sequential days, likely the right date
-                        target_index = i
-                        logger.info(f"Found sequential day {target_day} at index {i}")
-                        break
-        
-        # Second check: calculate index based on date offset from from_date
-        if target_index is None and from_date and to_date:
-            if from_date <= target_date <= to_date:
-                # Target date is in range of the report
-                offset = (target_date - from_date).days
-                if 0 <= offset < len(labels):
-                    target_index = offset
-                    logger.info(f"Calculated index {target_index} based on date offset from {from_date}")
-                else:
-                    logger.warning(f"Date offset {offset} out of range for labels array length {len(labels)}")
-        
-        # If we found an index into the arrays, extract the energy values
-        if target_index is not None:
-            logger.info(f"Retrieving energy data at index {target_index}")
-            
-            # Extract heating consumption
-            if "Heating" in energy_data and target_index < len(energy_data["Heating"]):
-                heating_item = energy_data["Heating"][target_index]
-                if isinstance(heating_item, (int, float)):
-                    heating_consumed = heating_item
-                elif isinstance(heating_item, dict) and "Value" in heating_item:
-                    heating_consumed = heating_item.get("Value", 0) or 0
-                logger.info(f"Heating consumption: {heating_consumed} kWh")
-            
-            # Extract hot water consumption
-            if "HotWater" in energy_data and target_index < len(energy_data["HotWater"]):
-                hotwater_item = energy_data["HotWater"][target_index]
-                if isinstance(hotwater_item, (int, float)):
-                    hot_water_consumed = hotwater_item
-                elif isinstance(hotwater_item, dict) and "Value" in hotwater_item:
-                    hot_water_consumed = hotwater_item.get("Value", 0) or 0
-                logger.info(f"Hot water consumption: {hot_water_consumed} kWh")
-            
-            # Extract heating production
-            if "ProducedHeating" in energy_data and target_index < len(energy_data["ProducedHeating"]):
-                prod_heating = energy_data["ProducedHeating"][target_index]
-                if isinstance(prod_heating, (int, float)):
-                    heating_produced = prod_heating
-                elif isinstance(prod_heating, dict) and "Value" in prod_heating:
-                    heating_produced = prod_heating.get("Value", 0) or 0
-                logger.info(f"Heating production: {heating_produced} kWh")
-            
-            # Extract hot water production
-            if "ProducedHotWater" in energy_data and target_index < len(energy_data["ProducedHotWater"]):
-                prod_hotwater = energy_data["ProducedHotWater"][target_index]
-                if isinstance(prod_hotwater, (int, float)):
-                    hot_water_produced = prod_hotwater
-                elif isinstance(prod_hotwater, dict) and "Value" in prod_hotwater:
-                    hot_water_produced = prod_hotwater.get("Value", 0) or 0
-                logger.info(f"Hot water production: {hot_water_produced} kWh")
-            
-            # Extract COP directly if available
-            cop_from_report = None
-            if "CoP" in energy_data and target_index < len(energy_data["CoP"]):
-                cop_item = energy_data["CoP"][target_index]
-                if isinstance(cop_item, (int, float)):
-                    cop_from_report = cop_item
-                    logger.info(f"COP from report: {cop_from_report}")
-        else:
-            # If date not found in report, log a message and return zeros
-            if from_date and to_date:
-                date_range_msg = f"The report only contains data from {from_date} to {to_date}"
-            else:
-                date_range_msg = "Could not determine the date range in the report"
-                
-            logger.warning(f"Date {date_str} not found in energy report. {date_range_msg}")
-            logger.warning(f"Available data in Labels: {labels}")
-            logger.warning(f"Returning zero values for energy metrics for {date_str}")
-            
+        if values is None:
             # Return valid data with zeros for energy values
+            logger.warning(f"Returning zero values for energy metrics for {target_date.strftime('%Y-%m-%d')}")
             return self._create_result_object(
                 target_date, 0, 0, 0, 0, 0, 
                 room_temp, outdoor_temp, flow_temp, return_temp,
-                power, operation_mode, demand_percentage
+                power, operation_mode, demand_percentage, device
             )
         
-        # Calculate totals
-        total_consumed = heating_consumed + hot_water_consumed
-        total_produced = heating_produced + hot_water_produced
-        
-        # Use COP from report if available, otherwise calculate it
-        if cop_from_report is not None:
-            cop = cop_from_report
-        else:
-            cop = total_produced / total_consumed if total_consumed > 0 else 0
-        
         # Create result object
         return self._create_result_object(
-            target_date, heating_consumed, hot_water_consumed, heating_produced, hot_water_produced, cop,
-            room_temp, outdoor_temp, flow_temp, return_temp, power, operation_mode, demand_percentage
+            target_date, values["heating_consumed"], values["hot_water_consumed"],
+            values["heating_produced"], values["hot_water_produced"], values["cop"],
+            room_temp, outdoor_temp, flow_temp, return_temp, power, operation_mode, demand_percentage, device
         )
 
     def _create_result_object(self, date, heating_consumed, hot_water_consumed, heating_produced, hot_water_produced, cop,
-                             room_temp, outdoor_temp, flow_temp, return_temp, power, operation_mode, demand_percentage):
+                             room_temp, outdoor_temp, flow_temp, return_temp, power, operation_mode, demand_percentage,
+                             device=None):
         """Create a standardized result object with all required fields."""
         # Map operation mode to text
         operation_modes = {
@@ -506,8 +558,11 @@ class MELCloudCollector:
         cost = total_consumed * electricity_price
         
         # Create result object
+        device = self._device(device)
         result = {
             "date": date,
+            "device_id": device["device_id"],
+            "device_name": device["device_name"],
             "heating_consumed": heating_consumed,
             "hot_water_consumed": hot_water_consumed,
             "total_consumed": total_consumed,
@@ -526,7 +581,7 @@ class MELCloudCollector:
         }
         
         # Print summary
-        print(f"\nEnergy data for {date.strftime('%Y-%m-%d')}:")
+        print(f"\nEnergy data for {date.strftime('%Y-%m-%d')} ({device['device_name']}):")
         print(f"  Heating consumption: {heating_consumed:.2f} kWh")
         print(f"  Hot water consumption: {hot_water_consumed:.2f} kWh")
         print(f"  Heating production: {heating_produced:.2f} kWh")
@@ -536,9 +591,10 @@ class MELCloudCollector:
         
         return result
 
-    def get_current_device_data(self):
+    def get_current_device_data(self, device=None):
         """Get current device data from MELCloud API."""
-        if not self.context_key or not self.device_id or not self.building_id:
+        device = self._device(device)
+        if not self.context_key or not device["device_id"] or not device["building_id"]:
             logger.error("Not properly initialized. Call authenticate() and get_devices() first.")
             return None
         
@@ -547,14 +603,16 @@ class MELCloudCollector:
             "X-MitsContextKey": self.context_key
         }
         params = {
-            "id": self.device_id,
-            "buildingID": self.building_id
+            "id": device["device_id"],
+            "buildingID": device["building_id"]
         }
         
         try:
-            response = requests.get(device_url, headers=headers, params=params)
+            with api_call("melcloud", "device_state"):
+                response = requests.get(device_url, headers=headers, params=params)
             
             if response.status_code != 200:
+                record_failure("melcloud", "device_state", f"HTTP {response.status_code}")
                 logger.error(f"Failed to fetch current device data with status code: {response.status_code}")
                 return None
             
@@ -564,6 +622,10 @@ class MELCloudCollector:
                 logger.error("Empty device data response")
                 return None
             
+            today = datetime.date.today()
+            self._archive_response("device_state", device_data, device_id=device["device_id"],
+                                   start_date=today, end_date=today)
+            
             return device_data
             
         except Exception as e:
@@ -615,6 +677,51 @@ class MELCloudCollector:
             logger.error(f"Failed to get energy report for date range: {start_date} to {end_date}")
             return None
 
+    def _fetch_device_reports(self, device, start_date, end_date):
+        """Fetch the energy report and current state of one device (network only, thread-safe)."""
+        energy_data = self.get_energy_report_for_date_range(start_date, end_date, device)
+        device_data = self.get_current_device_data(device) if energy_data else None
+        return device, energy_data, device_data
+
+    def fetch_all_devices(self, start_date, end_date):
+        """Fetch energy reports and current state for every device in parallel.
+        
+        Only the HTTP requests run in worker threads; parsing and database access
+        stay on the calling thread because the SQLite connection is not shared.
+        
+        Returns:
+            List of (device, energy_data, device_data) tuples in device order
+        """
+        if not self.devices:
+            logger.error("No devices available. Call get_devices() first.")
+            return []
+        
+        workers = min(len(self.devices), MAX_FETCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Workers run in copies of this context so their calls count towards the current run
+            futures = [executor.submit(contextvars.copy_context().run, self._fetch_device_reports,
+                                       device, start_date, end_date)
+                       for device in self.devices]
+            return [future.result() for future in futures]
+
+    def get_all_devices_data_for_date_range(self, start_date, end_date):
+        """Get device data for a range of dates for every device."""
+        results = []
+        
+        for device, energy_data, device_data in self.fetch_all_devices(start_date, end_date):
+            if not energy_data or not device_data:
+                logger.error(f"Failed to get energy report for device {device['device_id']}: {start_date} to {end_date}")
+                continue
+            
+            current_date = start_date
+            while current_date <= end_date:
+                result = self.process_energy_report_for_date(energy_data, current_date, device, device_data)
+                if result:
+                    results.append(result)
+                current_date += datetime.timedelta(days=1)
+        
+        return results
+
     def store_data_in_db(self, data):
         """Store data in the database."""
         if not data:
@@ -622,6 +729,10 @@ class MELCloudCollector:
             return False
         
         try:
+            # Compare with the stored row so the run telemetry can tell new, changed and unchanged rows apart
+            device_id = data.get("device_id", self.device_id)
+            existing = self.db.get_energy_values(data["date"], data["date"], device_id).get(str(data["date"]))
+            
             # Add energy data to database
             result = self.db.add_melcloud_data(
                 date=data["date"],
@@ -632,14 +743,20 @@ class MELCloudCollector:
                 cop=data["cop"],
                 power_consumption=data["demand_percentage"],
                 cost=data["cost"],
-                device_id=self.device_id,
-                device_name=self.device_name,
+                device_id=device_id,
+                device_name=data.get("device_name", self.device_name),
                 operation_mode=data["operation_mode"],
                 demand_percentage=data["demand_percentage"]
             )
             
             if result:
-                logger.info(f"Successfully stored energy data for {data['date']}")
+                if existing is None:
+                    record_rows_written("melcloud", inserted=1)
+                elif changed_fields(existing, data):
+                    record_rows_written("melcloud", updated=1)
+                else:
+                    record_rows_written("melcloud", unchanged=1)
+                logger.info(f"Successfully stored energy data for {data['date']} (device {data.get('device_id', self.device_id)})")
                 return True
             else:
                 logger.warning(f"Failed to store energy data for {data['date']}")
@@ -663,16 +780,18 @@ class MELCloudCollector:
             logger.error("Failed to get devices. Aborting.")
             return False
         
-        # Get current device data
-        data = self.get_device_data_for_date(datetime.date.today())
+        # Get current data for every device
+        today = datetime.date.today()
+        data_list = self.get_all_devices_data_for_date_range(today, today)
         
-        if data:
+        if data_list:
             # Store data in database
-            if self.store_data_in_db(data):
-                logger.info(f"Successfully collected and stored MELCloud data for {data['date']}")
+            stored = [data for data in data_list if self.store_data_in_db(data)]
+            if len(stored) == len(data_list):
+                logger.info(f"Successfully collected and stored MELCloud data for {today} ({len(stored)} device(s))")
                 return True
             else:
-                logger.error(f"Failed to store MELCloud data for {data['date']}")
+                logger.error(f"Failed to store MELCloud data for {len(data_list) - len(stored)} device(s) on {today}")
                 return False
         else:
             logger.error("Failed to get device data from MELCloud")
@@ -712,8 +831,8 @@ class MELCloudCollector:
             logger.error("Failed to retrieve devices. Aborting.")
             return False
         
-        # Get device data for the date range
-        data_list = self.get_device_data_for_date_range(start_date, end_date)
+        # Get data for every device over the date range
+        data_list = self.get_all_devices_data_for_date_range(start_date, end_date)
         
         if data_list:
             # Store data in database
@@ -725,7 +844,8 @@ class MELCloudCollector:
                 else:
                     logger.error(f"Failed to store MELCloud data for {data['date']}")
             
-            logger.info(f"Data collection complete. Successfully processed {success_count} out of {(end_date - start_date).days + 1} days")
+            expected = ((end_date - start_date).days + 1) * len(self.devices)
+            logger.info(f"Data collection complete. Successfully processed {success_count} out of {expected} device-days")
             return success_count > 0
         else:
             logger.error(f"Failed to get device data for date range: {start_date} to {end_date}")
@@ -770,7 +890,7 @@ def main():
     # Print configuration
     print("\n=== MELCloud Daily Collector ===")
     print(f"Processing date range: {start_date} to {end_date} ({total_days} days)")
-    print(f"Device ID: {collector.device_id}")
+    print(f"Device ID: {args.device_id or 'all devices'}")
     print(f"Debug mode: {'Enabled' if args.debug else 'Disabled'}")
     print(f"Raw only mode: {'Enabled' if args.raw_only else 'Disabled'}")
     print(f"Batch size: {args.batch_size} days")
@@ -805,81 +925,89 @@ def main():
         print(f"\nBatch: {current_start} to {current_end} ({days_in_batch} days)")
         print(f"Progress: {(current_start - start_date).days}/{total_days} days processed ({(current_start - start_date).days/total_days*100:.1f}% complete)")
         
-        # Get energy data for the batch 
-        energy_data = collector.get_energy_report_for_date_range(current_start, current_end)
-        
-        if not energy_data:
-            print(f"Failed to retrieve energy data for {current_start} to {current_end}")
-            failed_days += days_in_batch
-            current_start = current_end + datetime.timedelta(days=1)
-            continue
-        
-        # Get the actual date range returned in the report
-        actual_from = None
-        actual_to = None
+        # Get energy data for the batch, fetching every device in parallel
+        for device, energy_data, device_data in collector.fetch_all_devices(current_start, current_end):
+            label = f"{device['device_name']} (ID: {device['device_id']})"
+            
+            if not energy_data or not device_data:
+                print(f"Failed to retrieve energy data for {label}: {current_start} to {current_end}")
+                failed_days += days_in_batch
+                continue
+            
+            # Get the actual date range returned in the report
+            actual_from = None
+            actual_to = None
         
-        try:
-            from_date_str = energy_data.get("FromDate", "")
-            to_date_str = energy_data.get("ToDate", "")
+            try:
+                from_date_str = energy_data.get("FromDate", "")
+                to_date_str = energy_data.get("ToDate", "")
             
-            if from_date_str and "T" in from_date_str:
-                actual_from = datetime.datetime.strptime(from_date_str.split("T")[0], "%Y-%m-%d").date()
+                if from_date_str and "T" in from_date_str:
+                    actual_from = datetime.datetime.strptime(from_date_str.split("T")[0], "%Y-%m-%d").date()
             
-            if to_date_str and "T" in to_date_str:
-                actual_to = datetime.datetime.strptime(to_date_str.split("T")[0], "%Y-%m-%d").date()
+                if to_date_str and "T" in to_date_str:
+                    actual_to = datetime.datetime.strptime(to_date_str.split("T")[0], "%Y-%m-%d").date()
             
-            if actual_from and actual_to:
-                print(f"Note: MELCloud returned data for {actual_from} to {actual_to} (requested: {current_start} to {current_end})")
+                if actual_from and actual_to:
+                    print(f"Note: MELCloud returned data for {actual_from} to {actual_to} (requested: {current_start} to {current_end})")
                 
-                # If the returned range is completely different, adjust our expectations
-                if actual_from > current_end or actual_to < current_start:
-                    print(f"Warning: Returned date range does not overlap with requested range!")
-        except Exception as e:
-            print(f"Error parsing returned date range: {e}")
+                    # If the returned range is completely different, adjust our expectations
+                    if actual_from > current_end or actual_to < current_start:
+                        print(f"Warning: Returned date range does not overlap with requested range!")
+            except Exception as e:
+                print(f"Error parsing returned date range: {e}")
         
-        # Process each day in the batch
-        batch_date = current_start
-        while batch_date <= current_end:
-            print(f"\nProcessing date: {batch_date} ({(batch_date - start_date).days + 1}/{total_days})")
+            # Process each day in the batch
+            batch_date = current_start
+            while batch_date <= current_end:
+                print(f"\nProcessing date: {batch_date} for {label} ({(batch_date - start_date).days + 1}/{total_days})")
             
-            # Process the energy data for this date
-            result = collector.process_energy_report_for_date(energy_data, batch_date)
+                # Process the energy data for this date
+                result = collector.process_energy_report_for_date(energy_data, batch_date, device, device_data)
             
-            if result:
-                has_energy_data = (result['heating_consumed'] > 0 or 
-                                  result['hot_water_consumed'] > 0 or 
-                                  result['heating_produced'] > 0 or 
-                                  result['hot_water_produced'] > 0)
+                if result:
+                    has_energy_data = (result['heating_consumed'] > 0 or 
+                                      result['hot_water_consumed'] > 0 or 
+                                      result['heating_produced'] > 0 or 
+                                      result['hot_water_produced'] > 0)
                 
-                # If we got a result but all energy values are zero, we might not have actual data
-                if not has_energy_data:
-                    print(f"⚠ No energy data found for {batch_date} (returning zeros)")
+                    # If we got a result but all energy values are zero, we might not have actual data
+                    if not has_energy_data:
+                        print(f"⚠ No energy data found for {batch_date} (returning zeros)")
                 
-                # Store in database if not in raw-only mode
-                if not args.raw_only:
-                    if collector.store_data_in_db(result):
+                    # Store in database if not in raw-only mode
+                    if not args.raw_only:
+                        if collector.store_data_in_db(result):
+                            status = "✓" if has_energy_data else "⚠"
+                            print(f"{status} Stored data for {batch_date}")
+                            successful_days += 1
+                        else:
+                            print(f"✗ Failed to store data for {batch_date}")
+                            failed_days += 1
+                    else:
                         status = "✓" if has_energy_data else "⚠"
-                        print(f"{status} Stored data for {batch_date}")
+                        print(f"{status} Processed data for {batch_date} (raw only)")
                         successful_days += 1
-                    else:
-                        print(f"✗ Failed to store data for {batch_date}")
-                        failed_days += 1
                 else:
-                    status = "✓" if has_energy_data else "⚠"
-                    print(f"{status} Processed data for {batch_date} (raw only)")
-                    successful_days += 1
-            else:
-                print(f"✗ Failed to process data for {batch_date}")
-                failed_days += 1
+                    print(f"✗ Failed to process data for {batch_date}")
+                    failed_days += 1
             
-            batch_date += datetime.timedelta(days=1)
+                batch_date += datetime.timedelta(days=1)
         
         # Move to the next batch
         current_start = current_end + datetime.timedelta(days=1)
     
+    # Every device contributes one row per day
+    total_days *= len(collector.devices)
+    
+    run = current_run()
+    if run is not None:
+        run.dates_missing = total_days
+        run.dates_collected = successful_days
+    
     # Print summary
     print(f"\n=== Collection Summary ===")
-    print(f"Total days: {total_days}")
+    print(f"Total device-days: {total_days}")
     print(f"Successful days: {successful_days}")
     print(f"Failed days: {failed_days}")
     if total_days > 0:
@@ -892,5 +1020,6 @@ def main():
         return False
 
 if __name__ == "__main__":
-    success = main()
+    with traced("daily energy collector"), collector_run("daily_energy_collector", Database()):
+        success = main()
     sys.exit(0 if success else 1)
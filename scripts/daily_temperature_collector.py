@@ -1,78 +1,24 @@
 #!/usr/bin/env python3
 """
-Script to get the last temperature reading for a specific date from Home Assistant
-and update the temperature in the energy_data.db database if a row exists.
+Script to get the temperature readings of a specific date from Home Assistant,
+store them and update the day's outdoor temperature in the database.
 """
 
 import os
 import argparse
 import logging
-import sqlite3
 from datetime import datetime, timedelta, timezone, tzinfo
 from zoneinfo import ZoneInfo  # Standard library alternative to pytz
 from dotenv import load_dotenv
 import requests
+from app.db.models import Database
+from app.metrics import record_rows_written
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class Database:
-    """Database interface for storing temperature data."""
-    
-    def __init__(self, db_file=None):
-        """Initialize database connection."""
-        self.db_file = db_file or os.path.join(os.path.dirname(os.path.abspath(__file__)), 
-                                              "app", "db", "energy_data.db")
-        self.data = []  # For temporary storage
-        
-    def add_temperature_data(self, timestamp, temperature):
-        """Store temperature data."""
-        self.data.append({
-            'timestamp': timestamp,
-            'temperature': temperature
-        })
-        return True
-        
-    def get_temperature_data(self, start_date, end_date):
-        """Retrieve temperature data for the given date range."""
-        return self.data
-    
-    def update_temperature_in_db(self, date, temperature):
-        """Update the temperature in the database for the specified date if a row exists."""
-        try:
-            # Format date as string (YYYY-MM-DD)
-            date_str = date.strftime("%Y-%m-%d")
-            
-            # Connect to the SQLite database
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            # Check if a row exists for this date
-            cursor.execute("SELECT date FROM energy_data WHERE date = ?", (date_str,))
-            row = cursor.fetchone()
-            
-            if row:
-                # Update the temperature for this date
-                cursor.execute(
-                    "UPDATE energy_data SET outdoor_temp = ? WHERE date = ?", 
-                    (temperature, date_str)
-                )
-                conn.commit()
-                logger.info(f"Updated temperature to {temperature}°C for date {date_str} in database")
-                return True
-            else:
-                logger.warning(f"No row found for date {date_str} in database, temperature not updated")
-                return False
-                
-        except sqlite3.Error as e:
-            logger.error(f"Database error: {str(e)}")
-            return False
-        finally:
-            if conn:
-                conn.close()
-
 class HomeAssistantFetcher:
     """Fetches temperature data from Home Assistant."""
     
@@ -92,6 +38,18 @@ class HomeAssistantFetcher:
         if not self.hass_url or not self.hass_token:
             raise ValueError("Home Assistant credentials not found. Please set HASS_URL and HASS_TOKEN in .env file")
         
+        # Every sample is kept; the daily outdoor_temp is rolled up from them
+        from app.db.readings import ReadingsStore
+        self.readings = ReadingsStore(self.db, self.local_timezone)
+        
+        # Raw responses are always archived so they can be re-parsed offline
+        try:
+            from app.db.archive import RawArchive
+            self.archive = RawArchive()
+        except Exception as e:
+            logger.warning(f"Raw response archive unavailable: {e}")
+            self.archive = None
+        
     def fetch_data_for_date(self, target_date):
         """Fetch historical outdoor temperature data from Home Assistant for a specific date."""
         try:
@@ -129,6 +87,14 @@ class HomeAssistantFetcher:
             # Parse response - history API returns a list of lists
             history_data = response.json()
             
+            if self.archive is not None:
+                try:
+                    self.archive.store("homeassistant", "history", history_data,
+                                       device_id=params["filter_entity_id"],
+                                       start_date=target_date, end_date=target_date)
+                except Exception as e:
+                    logger.warning(f"Failed to archive Home Assistant history response: {e}")
+            
             if not history_data or len(history_data) == 0:
                 logger.error(f"No history data returned for {target_date}")
                 return None, None
@@ -143,6 +109,7 @@ class HomeAssistantFetcher:
             # Get the last temperature reading of the day
             last_reading = None
             last_timestamp = None
+            samples = []
             
             # Process each state change to find the last valid reading
             for state_item in entity_history:
@@ -156,6 +123,7 @@ class HomeAssistantFetcher:
                         # Parse timestamp and convert to local timezone
                         timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
                         local_timestamp = timestamp.astimezone(self.local_timezone)
+                        samples.append((timestamp, temp))
                         
                         # Update last reading if this is more recent
                         if last_timestamp is None or local_timestamp > last_timestamp:
@@ -169,12 +137,14 @@ class HomeAssistantFetcher:
                 logger.error(f"No valid temperature readings found for {target_date}")
                 return None, None
                 
-            # Store the last reading in the database
-            self.db.add_temperature_data(last_timestamp, last_reading)
-            logger.info(f"Last temperature reading for {target_date}: {last_reading}°C at {last_timestamp}")
-            
-            # Update the temperature in the energy_data.db if a row exists
-            self.db.update_temperature_in_db(target_date, last_reading)
+            # Store every sample and derive the day's outdoor_temp from the last one
+            series_id = self.readings.get_series_id(f"homeassistant:{params['filter_entity_id']}", unit='°C',
+                                                    agg='last', rollup_column='outdoor_temp')
+            self.readings.append(series_id, samples)
+            rollup = self.readings.rollup_daily(target_date, target_date)
+            record_rows_written('homeassistant', **rollup['temperature_days'])
+            logger.info(f"Last temperature reading for {target_date}: {last_reading}°C at {last_timestamp} "
+                        f"({len(samples)} samples stored)")
             
             return last_reading, last_timestamp
                 
@@ -196,10 +166,8 @@ def main():
     parser.add_argument('--date', type=parse_date, 
                         default=(datetime.now() - timedelta(days=1)).date(),
                         help='Date to show data for (YYYY-MM-DD format). Default: yesterday')
-    parser.add_argument('--db-file', type=str,
-                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 
-                                            "app", "db", "energy_data.db"),
-                        help='Path to the SQLite database file')
+    parser.add_argument('--db-file', type=str, default=None,
+                        help='Path to the SQLite database file (default: DATABASE_PATH)')
     args = parser.parse_args()
     
     date = args.date
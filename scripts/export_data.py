@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Export energy, temperature or price history as CSV or NDJSON.
+
+Rows are streamed from the database in batches, so memory use does not
+depend on the length of the range.
+
+Usage:
+    python scripts/export_data.py energy --output energy.csv
+    python scripts/export_data.py energy --format ndjson --aggregation month --start-date 2023-01-01
+    python scripts/export_data.py temperature --aggregation week --fields outdoor_temp,min_outdoor_temp
+    python scripts/export_data.py prices --start-date 2024-01-01 --end-date 2024-12-31
+"""
+
+import sys
+import logging
+import argparse
+import datetime
+from app.db.models import Database
+from app.db.export import AGGREGATIONS, DATASETS, EXPORT_BATCH_SIZE, FORMATS, export_data, get_export_range
+from app.routes.dashboard import determine_aggregation
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def parse_date(value):
+    """argparse type for YYYY-MM-DD dates."""
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Export energy, temperature or price history.")
+    parser.add_argument("dataset", help="Data to export", choices=list(DATASETS))
+    parser.add_argument("--format", help="Output format", choices=list(FORMATS), default="csv")
+    parser.add_argument("--start-date", help="First date (format: YYYY-MM-DD)", type=parse_date, default=None)
+    parser.add_argument("--end-date", help="Last date (format: YYYY-MM-DD)", type=parse_date, default=None)
+    parser.add_argument("--fields", help="Comma-separated fields to export (default: all)", default="")
+    parser.add_argument("--aggregation", help="Group rows by period as on the dashboard",
+                        choices=list(AGGREGATIONS) + ["auto"], default="none")
+    parser.add_argument("--device-id", help="Only export this device (energy)", type=int, default=None)
+    parser.add_argument("--db-path", help="Database file (default: DATABASE_PATH)", default=None)
+    parser.add_argument("--batch-size", help="Rows fetched per batch", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--output", help="Output file (default: stdout)", default=None)
+    args = parser.parse_args()
+
+    db = Database(args.db_path)
+    fields = [name.strip() for name in args.fields.split(",") if name.strip()]
+
+    aggregation = args.aggregation
+    if aggregation == "auto":
+        aggregation = determine_aggregation(*get_export_range(db, args.start_date, args.end_date))
+
+    try:
+        chunks = export_data(db, args.dataset, args.format, args.start_date, args.end_date,
+                             fields, aggregation, args.device_id, args.batch_size)
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+        db.close_connection()
+
+    if args.output:
+        logger.info(f"Exported {args.dataset} to {args.output}")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Load-test the web app with concurrent simulated clients.
+
+Starts the app on a synthetic dataset (the same cached datasets as
+scripts/benchmark.py) under gunicorn or the threaded Werkzeug server, runs
+N clients for a fixed duration with a realistic mix of dashboard, costs,
+consumption, temperature and /data API requests, and reports throughput and
+p50/p95/p99 latency per endpoint.
+
+Usage:
+    PYTHONPATH=. python scripts/load_test.py --clients 20 --duration 60
+    PYTHONPATH=. python scripts/load_test.py --server gunicorn --workers 4 --years 5 --devices 5
+    PYTHONPATH=. python scripts/load_test.py --url http://localhost:5000 --clients 50
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import tempfile
+import logging
+import argparse
+import datetime
+import threading
+import subprocess
+import urllib.request
+import requests
+from benchmark import DATA_DIR, dataset_path, build_dataset, current_commit
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Share of the requests going to each endpoint
+ENDPOINT_WEIGHTS = {
+    "/dashboard/": 30,
+    "/costs/": 15,
+    "/consumption/": 15,
+    "/temperature/": 15,
+    "/data/energy": 10,
+    "/data/temperature": 10,
+    "/data/prices": 5
+}
+
+# Time ranges picked by users of the dashboard views, most recent first
+TIME_RANGE_WEIGHTS = {"7d": 30, "30d": 30, "90d": 12, "ytd": 8, "1y": 12, "2y": 5, "5y": 3}
+ENERGY_TYPE_WEIGHTS = {"total": 70, "heating": 15, "hot_water": 15}
+# Days requested from the /data API
+API_DAYS_WEIGHTS = {1: 20, 7: 40, 30: 30, 365: 10}
+
+def weighted_choice(rng, weights):
+    """Pick a key of weights with probability proportional to its value."""
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+def build_request(rng, devices):
+    """Return (endpoint, query parameters) for one simulated request."""
+    endpoint = weighted_choice(rng, ENDPOINT_WEIGHTS)
+
+    if endpoint.startswith("/data/"):
+        params = {}
+        if endpoint != "/data/prices":
+            params["days"] = weighted_choice(rng, API_DAYS_WEIGHTS)
+        if endpoint == "/data/energy" and devices > 1 and rng.random() < 0.3:
+            params["device_id"] = rng.randint(1, devices)
+        return endpoint, params
+
+    params = {
+        "time_range": weighted_choice(rng, TIME_RANGE_WEIGHTS),
+        "energy_type": weighted_choice(rng, ENERGY_TYPE_WEIGHTS),
+        "aggregation": "auto",
+        "is_auto_aggregation": "true"
+    }
+    if devices > 1 and rng.random() < 0.3:
+        params["device"] = rng.randint(1, devices)
+    return endpoint, params
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def free_port():
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(db_path, server, port, workers, threads):
+    """Start the app in a subprocess and return the process once it answers."""
+    env = dict(os.environ, DATABASE_PATH=db_path, PYTHONPATH=os.getcwd(), SQL_DEBUG_PANEL="false")
+
+    if server == "gunicorn":
+        command = ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+                   "--threads", str(threads), "--log-level", "warning", "app:create_app()"]
+    else:
+        command = [sys.executable, "-c",
+                   "from app import create_app; "
+                   f"create_app().run(host='127.0.0.1', port={port}, threaded=True, debug=False)"]
+
+    logger.info(f"Starting {server} on port {port}: {' '.join(command)}")
+    # The app logs every request; a file keeps a full pipe from blocking the server
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f"Server exited: {log.read().decode(errors='replace')[-2000:]}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/data/prices", timeout=2)
+            return process
+        except OSError:
+            time.sleep(0.25)
+
+    process.terminate()
+    raise RuntimeError("Server did not start within 60 seconds")
+
+def run_client(base_url, deadline, warmup_until, devices, think_time, seed, samples, lock):
+    """Send requests until the deadline, recording (endpoint, ms, status) after the warmup."""
+    rng = random.Random(seed)
+    session = requests.Session()
+    local = []
+
+    while time.time() < deadline:
+        endpoint, params = build_request(rng, devices)
+        started = time.perf_counter()
+        try:
+            status = session.get(base_url + endpoint, params=params, timeout=60).status_code
+        except requests.RequestException:
+            status = 0
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if time.time() >= warmup_until:
+            local.append((endpoint, elapsed_ms, status))
+
+        if think_time > 0:
+            time.sleep(rng.expovariate(1 / think_time))
+
+    with lock:
+        samples.extend(local)
+
+def summarize(samples, duration):
+    """Per-endpoint and overall request counts, errors, throughput and latency percentiles."""
+    groups = {}
+    for endpoint, elapsed_ms, status in samples:
+        groups.setdefault(endpoint, []).append((elapsed_ms, status))
+    groups["ALL"] = [(elapsed_ms, status) for _, elapsed_ms, status in samples]
+
+    summary = {}
+    for endpoint, values in groups.items():
+        latencies = sorted(elapsed_ms for elapsed_ms, _ in values)
+        errors = sum(1 for _, status in values if status == 0 or status >= 500)
+        summary[endpoint] = {
+            "requests": len(values),
+            "errors": errors,
+            "throughput_rps": round(len(values) / duration, 2),
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "max_ms": round(latencies[-1], 1)
+        }
+    return summary
+
+def print_summary(summary):
+    """Print the summary as a table, busiest endpoint first."""
+    print(f"\n{'endpoint':22s} {'requests':>9s} {'errors':>7s} {'req/s':>8s} "
+          f"{'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    rows = sorted(summary.items(), key=lambda item: (item[0] == "ALL", -item[1]["requests"]))
+    for endpoint, stats in rows:
+        print(f"{endpoint:22s} {stats['requests']:9d} {stats['errors']:7d} {stats['throughput_rps']:8.1f} "
+              f"{stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f} {stats['max_ms']:9.1f}")
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Load-test the web app with concurrent simulated clients.")
+    parser.add_argument("--url", help="Test a running server instead of starting one", default=None)
+    parser.add_argument("--clients", help="Concurrent simulated clients", type=int, default=10)
+    parser.add_argument("--duration", help="Measured seconds", type=float, default=30)
+    parser.add_argument("--warmup", help="Seconds of requests before measuring", type=float, default=3)
+    parser.add_argument("--think-time", help="Mean pause between a client's requests in seconds", type=float, default=0)
+    parser.add_argument("--years", help="Dataset length in years", type=int, default=2)
+    parser.add_argument("--devices", help="Number of devices in the dataset", type=int, default=1)
+    parser.add_argument("--server", help="Server to start", choices=["werkzeug", "gunicorn"], default="werkzeug")
+    parser.add_argument("--workers", help="gunicorn worker processes", type=int, default=2)
+    parser.add_argument("--threads", help="gunicorn threads per worker", type=int, default=1)
+    parser.add_argument("--seed", help="Random seed of the request mix", type=int, default=1)
+    parser.add_argument("--output", help="Also write the results as JSON to this file", default=None)
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+        dataset = "external"
+    else:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        db_path = dataset_path(args.years, args.devices, False)
+        if not os.path.exists(db_path):
+            print(f"Building dataset: {args.years} years, {args.devices} devices")
+            build_dataset(db_path, args.years, args.devices, False)
+        port = free_port()
+        process = start_server(db_path, args.server, port, args.workers, args.threads)
+        base_url = f"http://127.0.0.1:{port}"
+        dataset = os.path.splitext(os.path.basename(db_path))[0]
+
+    print(f"Running {args.clients} clients against {base_url} for {args.duration:.0f}s "
+          f"(+{args.warmup:.0f}s warmup)")
+
+    samples = []
+    lock = threading.Lock()
+    warmup_until = time.time() + args.warmup
+    deadline = warmup_until + args.duration
+    clients = [
+        threading.Thread(target=run_client, args=(base_url, deadline, warmup_until, args.devices,
+                                                  args.think_time, args.seed + i, samples, lock))
+        for i in range(args.clients)
+    ]
+
+    try:
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    if not samples:
+        print("No requests completed")
+        return False
+
+    summary = summarize(samples, args.duration)
+    print_summary(summary)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": current_commit(),
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "dataset": dataset,
+                "server": "external" if args.url else args.server,
+                "workers": args.workers,
+                "threads": args.threads,
+                "clients": args.clients,
+                "duration": args.duration,
+                "endpoints": summary
+            }, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    return summary["ALL"]["errors"] == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
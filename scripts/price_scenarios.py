@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Simulate the heat pump and diesel cost of a period under many price scenarios
+without touching the recorded prices or costs.
+
+Scenarios come from a JSON file (a list of {"name", "electricity_price",
+"diesel_price", "diesel_efficiency"}, each price a number, a list with one
+price per month or an object of "YYYY-MM" prices) and/or Monte Carlo paths
+around the recorded prices.
+
+Usage:
+    python scripts/price_scenarios.py --start-date 2025-01-01 --end-date 2025-12-31 --monte-carlo 1000
+    python scripts/price_scenarios.py --start-date 2025-01-01 --end-date 2025-12-31 --scenarios scenarios.json
+    python scripts/price_scenarios.py --start-date 2025-01-01 --end-date 2025-12-31 --monte-carlo 500 --seed 42 --json
+"""
+
+import sys
+import json
+import logging
+import argparse
+import datetime
+from app.db.models import Database
+from app.db.scenarios import simulate
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def parse_date(value):
+    """argparse type for YYYY-MM-DD dates."""
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+def print_summary(result):
+    """Print the recorded cost, the named scenarios and the distributions."""
+    print(f"{result['start_date']} - {result['end_date']}: {len(result['months'])} months, "
+          f"{result['scenario_count']} scenarios")
+    print(f"{'Scenario':<24} {'Heat pump':>12} {'Diesel':>12} {'Savings':>12}")
+    for row in [result['recorded']] + result['scenarios']:
+        print(f"{row['name']:<24} {row['heat_pump_cost']:>12.2f} {row['diesel_cost']:>12.2f} {row['savings']:>12.2f}")
+
+    distribution = result['distribution']
+    stats = [key for key in distribution['savings'] if key != 'std']
+    print()
+    print(f"{'':<16}" + ''.join(f"{key:>11}" for key in stats))
+    for metric in ('heat_pump_cost', 'diesel_cost', 'savings'):
+        print(f"{metric:<16}" + ''.join(f"{distribution[metric][key]:>11.2f}" for key in stats))
+    print(f"Probability that the heat pump saves money: {distribution['savings_probability']:.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate costs under price scenarios")
+    parser.add_argument("--start-date", help="First date (format: YYYY-MM-DD)", type=parse_date, required=True)
+    parser.add_argument("--end-date", help="Last date (format: YYYY-MM-DD)", type=parse_date, required=True)
+    parser.add_argument("--scenarios", help="JSON file with a list of scenarios", default=None)
+    parser.add_argument("--monte-carlo", help="Number of Monte Carlo price paths", type=int, default=0)
+    parser.add_argument("--seed", help="Random seed of the Monte Carlo paths", type=int, default=None)
+    parser.add_argument("--electricity-volatility", help="Monthly electricity price volatility", type=float, default=0.05)
+    parser.add_argument("--diesel-volatility", help="Monthly diesel price volatility", type=float, default=0.05)
+    parser.add_argument("--drift", help="Monthly price drift", type=float, default=0.0)
+    parser.add_argument("--correlation", help="Correlation of electricity and diesel shocks", type=float, default=0.0)
+    parser.add_argument("--energy-type", help="Energy type", choices=["total", "heating", "hot_water"], default="total")
+    parser.add_argument("--device-id", help="Only this device", type=int, default=None)
+    parser.add_argument("--db-path", help="Database file (default: DATABASE_PATH)", default=None)
+    parser.add_argument("--json", help="Print the full result as JSON", action="store_true")
+    args = parser.parse_args()
+
+    scenarios = []
+    if args.scenarios:
+        with open(args.scenarios) as f:
+            scenarios = json.load(f)
+    monte_carlo = None
+    if args.monte_carlo:
+        monte_carlo = {
+            'count': args.monte_carlo,
+            'seed': args.seed,
+            'electricity_volatility': args.electricity_volatility,
+            'diesel_volatility': args.diesel_volatility,
+            'drift': args.drift,
+            'correlation': args.correlation
+        }
+
+    db = Database(args.db_path)
+    try:
+        result = simulate(db, args.start_date, args.end_date, scenarios, monte_carlo,
+                          energy_type=args.energy_type, device_id=args.device_id)
+    except ValueError as e:
+        logger.error(f"Simulation failed: {e}")
+        return False
+    finally:
+        db.close_connection()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_summary(result)
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Rebuild energy_data from archived MELCloud energy reports without any network access.
+
+Archived raw reports are replayed through the current parser
+(extract_energy_values in daily_energy_collector.py) on a process pool,
+the results are compared against the rows currently stored, and then
+bulk-upserted with one transaction per chunk.
+
+Usage:
+    python scripts/reprocess_energy_reports.py --start-date 2020-01-01 --dry-run
+    python scripts/reprocess_energy_reports.py --device-id 12345 --workers 8
+
+Every archived device is rebuilt unless --device-id is given.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from app.db.models import Database
+from app.db.archive import RawArchive
+from daily_energy_collector import extract_energy_values, changed_fields
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+_worker_archive = None
+
+def _init_worker(archive_root):
+    """Open the archive once per worker process and silence per-date parser warnings."""
+    global _worker_archive
+    _worker_archive = RawArchive(archive_root)
+    logging.getLogger("daily_energy_collector").setLevel(logging.ERROR)
+
+def _parse_report(task):
+    """Parse every requested date out of one archived report.
+
+    Args:
+        task: Tuple of (content_hash, list of ISO date strings)
+
+    Returns:
+        Tuple of (content_hash, list of (date string, values dict))
+    """
+    content_hash, dates = task
+    energy_data = _worker_archive.load(content_hash)
+
+    results = []
+    for date_str in dates:
+        target_date = datetime.date.fromisoformat(date_str)
+        values = extract_energy_values(energy_data, target_date)
+        if values is not None:
+            results.append((date_str, values))
+
+    return content_hash, results
+
+def _date_range(start_date, end_date):
+    """Yield every date between start_date and end_date inclusive."""
+    current = start_date
+    while current <= end_date:
+        yield current
+        current += datetime.timedelta(days=1)
+
+def plan_reports(archive, device_id, start_date, end_date):
+    """Group archived energy reports by payload hash with the dates each should be parsed for.
+
+    Returns:
+        Tuple of (dict of hash -> sorted date list, dict of hash -> freshness rank)
+    """
+    rows = archive.find(source="melcloud", kind="energy_report", device_id=device_id,
+                        start_date=start_date, end_date=end_date)
+
+    # find() orders by start_date; the rank must follow the fetch time
+    rows = sorted(rows, key=lambda row: (row["last_fetched_at"], row["id"]))
+
+    dates_by_hash = {}
+    rank_by_hash = {}
+    for rank, row in enumerate(rows):
+        if not row["start_date"] or not row["end_date"]:
+            continue
+
+        first = max(datetime.date.fromisoformat(row["start_date"]), start_date)
+        last = min(datetime.date.fromisoformat(row["end_date"]), end_date)
+
+        dates = dates_by_hash.setdefault(row["hash"], set())
+        dates.update(d.isoformat() for d in _date_range(first, last))
+
+        # Rows are sorted oldest fetch first, so later fetches win
+        rank_by_hash[row["hash"]] = rank
+
+    return {h: sorted(d) for h, d in dates_by_hash.items()}, rank_by_hash
+
+def reprocess(archive, device_id, start_date, end_date, workers=None):
+    """Replay archived reports through the parser on a process pool.
+
+    Returns:
+        Dictionary of date string -> parsed values, taken from the most recently
+        fetched report that contains each date
+    """
+    dates_by_hash, rank_by_hash = plan_reports(archive, device_id, start_date, end_date)
+    logger.info(f"Replaying {len(dates_by_hash)} distinct archived reports")
+
+    tasks = list(dates_by_hash.items())
+    chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 4))
+
+    best = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(archive.root,)) as executor:
+        for content_hash, results in executor.map(_parse_report, tasks, chunksize=chunksize):
+            rank = rank_by_hash[content_hash]
+            for date_str, values in results:
+                if date_str not in best or best[date_str][0] < rank:
+                    best[date_str] = (rank, values)
+
+    return {date_str: values for date_str, (rank, values) in best.items()}
+
+def diff_against_db(parsed, current):
+    """Compare parsed values against the rows currently stored.
+
+    Returns:
+        Dictionary with new, changed and unchanged dates; changed entries list
+        the old and new value of every field that differs
+    """
+    diff = {"new": [], "changed": {}, "unchanged": 0}
+
+    for date_str in sorted(parsed):
+        values = parsed[date_str]
+        row = current.get(date_str)
+        if row is None:
+            diff["new"].append(date_str)
+            continue
+
+        changes = changed_fields(row, values)
+        if changes:
+            diff["changed"][date_str] = changes
+        else:
+            diff["unchanged"] += 1
+
+    return diff
+
+def reprocess_device(db, archive, device_id, start_date, end_date, args):
+    """Rebuild one device's rows, print its diff and write it unless this is a dry run.
+
+    Returns:
+        The diff report, or None if the archive has nothing for this device
+    """
+    started = time.perf_counter()
+    parsed = reprocess(archive, device_id, start_date, end_date, workers=args.workers)
+    parse_seconds = time.perf_counter() - started
+
+    if not parsed:
+        print(f"No archived energy reports found for device {device_id}, {start_date} to {end_date}")
+        return None
+
+    # Resolve the electricity price once per month instead of once per row
+    month_prices = {}
+    for date_str, values in parsed.items():
+        date = datetime.date.fromisoformat(date_str)
+        key = (date.year, date.month)
+        if key not in month_prices:
+            price_data = db.get_prices_for_month(date.year, date.month)
+            month_prices[key] = price_data['electricity_price'] if price_data else 0.28
+        values["cost"] = (values["heating_consumed"] + values["hot_water_consumed"]) * month_prices[key]
+
+    db_device_id = int(device_id) if device_id and str(device_id).isdigit() else 0
+    current = db.get_energy_values(min(parsed), max(parsed), db_device_id)
+    diff = diff_against_db(parsed, current)
+
+    print(f"\n=== Reprocessing Summary (device {device_id or 'unknown'}) ===")
+    print(f"Dates parsed: {len(parsed)} in {parse_seconds:.2f}s")
+    print(f"New rows: {len(diff['new'])}")
+    print(f"Changed rows: {len(diff['changed'])}")
+    print(f"Unchanged rows: {diff['unchanged']}")
+    for date_str, changes in list(diff["changed"].items())[:20]:
+        details = ", ".join(f"{field}: {change['old']} -> {change['new']}" for field, change in changes.items())
+        print(f"  {date_str}: {details}")
+    if len(diff["changed"]) > 20:
+        print(f"  ... {len(diff['changed']) - 20} more changed rows")
+    print("============================")
+
+    if args.dry_run:
+        print("Dry run: database not modified")
+        return diff
+
+    records = []
+    for date_str in diff["new"] + list(diff["changed"]):
+        record = dict(parsed[date_str])
+        record["date"] = date_str
+        record["device_id"] = db_device_id
+        records.append(record)
+
+    started = time.perf_counter()
+    written = db.bulk_upsert_energy_data(records, chunk_size=args.chunk_size)
+    print(f"Wrote {written} rows in {time.perf_counter() - started:.2f}s")
+
+    return diff
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Rebuild energy_data from archived MELCloud energy reports.")
+    parser.add_argument("--start-date", help="First date to rebuild (format: YYYY-MM-DD)", default="2000-01-01")
+    parser.add_argument("--end-date", help="Last date to rebuild (format: YYYY-MM-DD)", default=None)
+    parser.add_argument("--device-id", help="Device ID to rebuild (default: every archived device)", default=None)
+    parser.add_argument("--workers", help="Number of parser processes", type=int, default=None)
+    parser.add_argument("--chunk-size", help="Rows written per transaction", type=int, default=500)
+    parser.add_argument("--archive-path", help="Raw archive directory", default=None)
+    parser.add_argument("--diff-file", help="Write the full diff report to this JSON file", default=None)
+    parser.add_argument("--dry-run", help="Only report the diff, don't write to the database", action="store_true")
+    args = parser.parse_args()
+
+    start_date = datetime.datetime.strptime(args.start_date, "%Y-%m-%d").date()
+    if args.end_date:
+        end_date = datetime.datetime.strptime(args.end_date, "%Y-%m-%d").date()
+    else:
+        end_date = datetime.date.today()
+
+    archive = RawArchive(args.archive_path)
+    db = Database()
+
+    if args.device_id is not None:
+        device_ids = [str(args.device_id)]
+    else:
+        device_ids = sorted({row["device_id"] for row in archive.find(source="melcloud", kind="energy_report")})
+
+    if not device_ids:
+        print(f"No archived energy reports found for {start_date} to {end_date}")
+        return False
+
+    diff_report = {}
+    for device_id in device_ids:
+        diff = reprocess_device(db, archive, device_id, start_date, end_date, args)
+        if diff is not None:
+            diff_report[device_id] = diff
+
+    if args.diff_file:
+        with open(args.diff_file, "w") as f:
+            json.dump(diff_report, f, indent=2, default=str)
+        print(f"Diff written to {args.diff_file}")
+
+    db.close_connection()
+    return bool(diff_report)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Rebuild daily energy_data rows from the high-frequency readings store.
+
+Usage:
+    python scripts/rollup_readings.py --start-date 2024-01-01 --end-date 2024-12-31
+    python scripts/rollup_readings.py --device-id 12345
+"""
+
+import sys
+import logging
+import argparse
+import datetime
+from app.db.models import Database
+from app.db.readings import ReadingsStore
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def main():
+    """Main function."""
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+
+    parser = argparse.ArgumentParser(description="Rebuild daily energy_data rows from stored readings.")
+    parser.add_argument("--start-date", help="First date to rebuild (format: YYYY-MM-DD)", default=yesterday.isoformat())
+    parser.add_argument("--end-date", help="Last date to rebuild (format: YYYY-MM-DD)", default=None)
+    parser.add_argument("--device-id", help="Only roll up series of this device", type=int, default=None)
+    args = parser.parse_args()
+
+    start_date = datetime.datetime.strptime(args.start_date, "%Y-%m-%d").date()
+    end_date = datetime.datetime.strptime(args.end_date, "%Y-%m-%d").date() if args.end_date else start_date
+
+    db = Database()
+    store = ReadingsStore(db)
+
+    series = store.get_series(args.device_id)
+    if not series:
+        print("No readings series registered")
+        return False
+
+    print(f"Rolling up {len(series)} series from {start_date} to {end_date}")
+    result = store.rollup_daily(start_date, end_date, args.device_id)
+    temperature_days = result['temperature_days']
+    print(f"Wrote {result['energy_rows']} daily energy rows")
+    print(f"Temperature days: {temperature_days['inserted']} inserted, {temperature_days['updated']} updated, "
+          f"{temperature_days['unchanged']} unchanged")
+
+    db.close_connection()
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
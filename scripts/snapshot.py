@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Export energy_data and prices to a columnar snapshot file, import one back,
+or summarize one.
+
+Snapshots store every column as a typed array, optionally zlib-compressed,
+so years of multi-device history fit in a few MB and open in milliseconds.
+
+Usage:
+    python scripts/snapshot.py export energy.snap
+    python scripts/snapshot.py export energy.snap --compress --start-date 2020-01-01
+    python scripts/snapshot.py info energy.snap
+    python scripts/snapshot.py import energy.snap --db-path /tmp/analysis.db
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import datetime
+from app.db.models import Database
+from app.db.snapshot import Snapshot, write_snapshot, restore_snapshot
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def parse_date(value):
+    """argparse type for YYYY-MM-DD dates."""
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+def show_info(path):
+    """Print the contents of a snapshot and time loading it into the engines."""
+    from app.routes.dashboard import aggregate_data
+
+    started = time.perf_counter()
+    with Snapshot(path) as snapshot:
+        opened_ms = (time.perf_counter() - started) * 1000
+
+        rows = snapshot.rows("energy_data")
+        print(f"{path}: {os.path.getsize(path)} bytes, created {snapshot.header['created_at']}, "
+              f"compression {snapshot.header.get('compression') or 'none'}")
+        print(f"energy_data: {rows} rows, prices: {snapshot.rows('prices')} rows")
+        print(f"Opened in {opened_ms:.2f} ms")
+        if not rows:
+            return True
+
+        dates = snapshot.column("energy_data", "date")
+        start_date = datetime.date.fromordinal(dates[0])
+        end_date = datetime.date.fromordinal(dates[-1])
+
+        started = time.perf_counter()
+        energy = snapshot.energy_rows()
+        monthly = aggregate_data(energy, "month", avg_keys=[3])
+        aggregate_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        diesel_cost = snapshot.diesel_cost(start_date, end_date)
+        cost_ms = (time.perf_counter() - started) * 1000
+
+        consumed = sum(row[1] or 0 for row in energy)
+        electricity_cost = sum(row[5] or 0 for row in energy)
+        print(f"{start_date} to {end_date}: {len(energy)} days, {len(monthly)} months, "
+              f"{consumed:.0f} kWh consumed (aggregated in {aggregate_ms:.1f} ms)")
+        print(f"Electricity cost {electricity_cost:.2f}, diesel equivalent {diesel_cost:.2f} "
+              f"(computed in {cost_ms:.1f} ms)")
+    return True
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Export, import or inspect columnar energy snapshots.")
+    parser.add_argument("command", help="What to do", choices=["export", "import", "info"])
+    parser.add_argument("path", help="Snapshot file")
+    parser.add_argument("--db-path", help="Database file (default: DATABASE_PATH)", default=None)
+    parser.add_argument("--compress", help="Compress the columns (export)", action="store_true")
+    parser.add_argument("--start-date", help="First date to export (format: YYYY-MM-DD)", type=parse_date, default=None)
+    parser.add_argument("--end-date", help="Last date to export (format: YYYY-MM-DD)", type=parse_date, default=None)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        return show_info(args.path)
+
+    db = Database(args.db_path)
+    try:
+        if args.command == "export":
+            started = time.perf_counter()
+            header = write_snapshot(db, args.path, args.compress, args.start_date, args.end_date)
+            print(f"Exported {header['tables']['energy_data']['rows']} energy rows and "
+                  f"{header['tables']['prices']['rows']} prices to {args.path} "
+                  f"({os.path.getsize(args.path)} bytes) in {time.perf_counter() - started:.2f}s")
+        else:
+            with Snapshot(args.path) as snapshot:
+                energy_rows, price_rows = restore_snapshot(snapshot, db)
+            print(f"Imported {energy_rows} energy rows and {price_rows} prices from {args.path}")
+    finally:
+        db.close_connection()
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)